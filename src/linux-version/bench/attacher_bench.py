@@ -0,0 +1,110 @@
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+from types import SimpleNamespace
+from config import setting
+from tor.monitor import percentile
+from tor.attacher import StreamAttacher
+from bench.fake_controller import FakeController
+from bench.connect_bench import sandbox_logs
+
+
+def summarize(ttfb: list) -> dict:
+    """Summarizes time to first byte in milliseconds."""
+
+    return {
+        "streams": len(ttfb),
+        "p50_ms": round(percentile(ttfb, 0.50) * 1000, 1) if ttfb else None,
+        "p95_ms": round(percentile(ttfb, 0.95) * 1000, 1) if ttfb else None,
+    }
+
+def drive(controller: FakeController, workload: list, timeout: float) -> list:
+    """Opens the workload's streams at their offsets and returns every stream's time to first byte."""
+
+    start = time.monotonic()
+    for index, (offset, address) in enumerate(workload):
+        time.sleep(max(0.0, start + offset - time.monotonic()))
+        controller.open_stream(str(index), address)
+    deadline = time.monotonic() + timeout
+    while len(controller.ttfb) < len(workload) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return list(controller.ttfb.values())
+
+def run(streams: int, destinations: int, rate: float, exits: int, pool_size: int, seed: int) -> dict:
+    """Runs the same stream workload with tor building circuits on demand and with the stream attacher."""
+
+    rng = random.Random(seed)
+    offset, workload = 0.0, []
+    for _ in range(streams):
+        offset += rng.expovariate(rate)
+        workload.append((offset, f"site{rng.randrange(destinations)}.example"))
+    timeout = 10.0
+
+    # Tor with destination isolation builds a circuit the first time each destination is seen.
+    baseline = FakeController(exits=exits, seed=seed)
+    on_demand = drive(baseline, workload, timeout)
+
+    setting.ATTACHER_POOL_SIZE = pool_size
+    setting.ATTACHER_ISOLATION = "destination"
+    controller = FakeController(exits=exits, seed=seed)
+    attacher = StreamAttacher(SimpleNamespace(controller=controller, is_alive=lambda: True))
+    if not attacher.start():
+        return {"ok": False, "error": "Stream attacher did not start"}
+    try:
+        # Give the pool one build time to fill, as it would while the user is idle.
+        deadline = time.monotonic() + timeout
+        while attacher.snapshot()["pooled"] < pool_size and time.monotonic() < deadline:
+            time.sleep(0.05)
+        pooled = drive(controller, workload, timeout)
+        counters = attacher.snapshot()
+    finally:
+        attacher.stop()
+
+    attached = counters["attached"]
+    new_keys = attached["pool"] + attached["tor"]
+    return {
+        "ok": True,
+        "streams": streams,
+        "destinations": destinations,
+        "on_demand": {**summarize(on_demand), "circuits_built": baseline.launched},
+        "attacher": {**summarize(pooled), "circuits_built": controller.launched},
+        "pool_hit_share": round(attached["pool"] / new_keys, 3) if new_keys else None,
+        "counters": counters,
+    }
+
+def main():
+    """Benchmarks time to first byte with and without the stream attacher against a fake controller."""
+
+    parser = argparse.ArgumentParser(description="Benchmark Torsen's stream attacher against a fake tor controller.")
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--destinations", type=int, default=40)
+    parser.add_argument("--rate", type=float, default=40.0, help="New streams per second.")
+    parser.add_argument("--exits", type=int, default=10)
+    parser.add_argument("--pool-size", type=int, default=setting.ATTACHER_POOL_SIZE)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON result to this file.")
+    parser.add_argument("--verbose", action="store_true", help="Keep Torsen's log output.")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory(prefix="torsen-bench-") as workdir:
+        sandbox_logs(workdir)
+        result = run(args.streams, args.destinations, args.rate, args.exits, args.pool_size, args.seed)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    # Every stream must get its first byte, and sooner at the median than with circuits built on demand.
+    ok = (result["ok"] and result["attacher"]["streams"] == args.streams
+          and result["attacher"]["p50_ms"] < result["on_demand"]["p50_ms"])
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+from config import setting
+from bench.connect_bench import sandbox_logs
+
+
+class Listener:
+    """A local bridge stand-in that accepts connections, optionally only after its accept queue was held full."""
+
+    def __init__(self, delay: float = 0.0):
+        """Initializes the Listener."""
+
+        self.accepted = 0
+        self.delay = delay
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.filler = None
+
+    def start(self) -> "Listener":
+        """Starts accepting; a delayed listener first fills its one-slot queue so new handshakes wait for a SYN retry."""
+
+        if self.delay:
+            self.sock.listen(0)
+            self.filler = socket.create_connection(("127.0.0.1", self.port))
+        else:
+            self.sock.listen(16)
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def _accept(self):
+        """Accepts and closes connections until the socket is closed."""
+
+        if self.delay:
+            threading.Event().wait(self.delay)
+            self.sock.accept()[0].close()
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            connection.close()
+
+    def stop(self):
+        """Stops listening."""
+
+        if self.filler is not None:
+            self.filler.close()
+        self.sock.close()
+
+
+def closed_port() -> int:
+    """Returns a loopback port nothing listens on, so a probe to it is refused."""
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def bridge_line(port: int) -> str:
+    """Renders an obfs4 bridge line pointing at a local port."""
+
+    return f"obfs4 127.0.0.1:{port} {port:040X} cert=bench iat-mode=0"
+
+def expire_cache(path: str):
+    """Ages the cached probe results just past the TTL."""
+
+    with open(path, 'r', encoding='utf-8') as f:
+        cache = json.load(f)
+    cache["probed_at"] = time.time() - setting.BRIDGE_CACHE_TTL - 1
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+
+def run(delay: float) -> dict:
+    """Ranks a fast, a delayed and a refusing bridge, then checks no probe is sent while routing is active."""
+
+    from core.connection import ConnectionManager
+
+    fast, slow = Listener().start(), Listener(delay).start()
+    bridges = {"slow": bridge_line(slow.port), "closed": bridge_line(closed_port()), "fast": bridge_line(fast.port)}
+    names = {line: name for name, line in bridges.items()}
+
+    def order(manager: ConnectionManager) -> list:
+        return [names[line] for line in manager.torrc_overrides().get("Bridge", [])]
+
+    def probes() -> int:
+        time.sleep(0.1)  # Let the listeners accept whatever handshakes reached them
+        return fast.accepted + slow.accepted
+
+    with tempfile.TemporaryDirectory(prefix="torsen-bridge-bench-") as workdir:
+        sandbox_logs(workdir)
+        setting.TORSEN_PID_PATH = os.path.join(workdir, "torsen.pid")
+        setting.BRIDGE_POOL_FILENAME = os.path.join(workdir, "bridges.txt")
+        setting.BRIDGE_CACHE_FILENAME = os.path.join(workdir, "bridges.cache.json")
+        setting.BRIDGE_PROBE_TIMEOUT = delay + 2
+        setting.BRIDGE_COUNT = len(bridges)
+        with open(setting.BRIDGE_POOL_FILENAME, 'w', encoding='utf-8') as f:
+            f.write("".join(f"Bridge {line}\n" for line in bridges.values()))
+        # Date the pool before any probe, so an aged cache still describes it.
+        edited = time.time() - 2 * setting.BRIDGE_CACHE_TTL
+        os.utime(setting.BRIDGE_POOL_FILENAME, (edited, edited))
+
+        result = {}
+        try:
+            manager = ConnectionManager()
+            result["disconnected"] = {"order": order(manager), "probes": probes()}
+            with open(setting.BRIDGE_CACHE_FILENAME, 'r', encoding='utf-8') as f:
+                result["latency_ms"] = {names[r["bridge"]]: None if r["latency"] is None else round(r["latency"] * 1000, 1)
+                                        for r in json.load(f)["results"]}
+
+            # Connected: a stale cache is reused as it is instead of probing through the redirect.
+            expire_cache(setting.BRIDGE_CACHE_FILENAME)
+            manager.is_connected = True
+            result["connected_stale_cache"] = {"order": order(manager), "probes": probes()}
+
+            # Another process holds the connection and there is no cache: fall back to the configured order.
+            os.remove(setting.BRIDGE_CACHE_FILENAME)
+            with open(setting.TORSEN_PID_PATH, 'w', encoding='utf-8') as f:
+                f.write(f"{os.getpid()}\n")
+            result["other_process_no_cache"] = {"order": order(ConnectionManager()), "probes": probes()}
+        finally:
+            fast.stop()
+            slow.stop()
+    return result
+
+def main():
+    """Checks bridge ranking against delayed local listeners and that probing stops while routing is active."""
+
+    parser = argparse.ArgumentParser(description="Check Torsen's bridge prober against delayed local listeners.")
+    parser.add_argument("--delay", type=float, default=0.2, help="Seconds the delayed listener holds its queue full.")
+    parser.add_argument("--output", help="Write the JSON result to this file.")
+    parser.add_argument("--verbose", action="store_true", help="Keep Torsen's log output.")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    result = run(args.delay)
+    # Probing ranks reachable bridges by latency; with routing active nothing is probed and the known order is kept.
+    result["ok"] = (result["disconnected"] == {"order": ["fast", "slow"], "probes": 2}
+                    and result["connected_stale_cache"] == {"order": ["fast", "slow"], "probes": 2}
+                    and result["other_process_no_cache"] == {"order": ["slow", "closed", "fast"], "probes": 2})
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    sys.exit(0 if result["ok"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import sys
+import pwd
+import json
+import time
+import logging
+import argparse
+import tempfile
+from config import setting
+from utils.metrics import registry
+from bench.fake_tor import FakeTorControlPort
+from utils.runner import SimulatedRunner, set_runner
+
+DEFAULT_LATENCY = {
+    "systemctl": 0.05,
+    "nmcli": 0.05,
+    "bash.sh start": 0.2,
+    "bash.sh stop": 0.1,
+    "iptables-save": 0.01,
+    "ip6tables-save": 0.01,
+    "iptables-restore": 0.015,
+    "ip6tables-restore": 0.01,
+    "ipset": 0.01,
+    "nft": 0.015,
+}
+DEFAULT_OUTPUTS = {
+    "iptables-save": "*filter\n:INPUT ACCEPT [0:0]\n:FORWARD ACCEPT [0:0]\n:OUTPUT ACCEPT [0:0]\nCOMMIT\n",
+}
+
+
+def parse_rules(pairs: list, cast=float) -> dict:
+    """Parses 'command prefix=value' arguments into runner rules."""
+
+    rules = {}
+    for pair in pairs or []:
+        prefix, _, value = pair.rpartition("=")
+        rules[prefix] = cast(value)
+    return rules
+
+def sandbox_logs(workdir: str):
+    """Points Torsen's log files into the work directory; takes effect only before the first logger is created."""
+
+    setting.LOG_DIRECTORY = workdir
+
+def sandbox_settings(workdir: str, control_port: int):
+    """Points every file Torsen touches into the work directory and at the fake control port."""
+
+    sandbox_logs(workdir)
+    setting.SYSTEM_TORRC_PATH = os.path.join(workdir, "torrc")
+    setting.RESOLV_CONF_PATH = os.path.join(workdir, "resolv.conf")
+    setting.TORSEN_PID_PATH = os.path.join(workdir, "torsen.pid")
+    setting.TOR_CONTROL_PORT = control_port
+    setting.TOR_USER = pwd.getpwuid(os.getuid()).pw_name
+    setting.TOR_BOOTSTRAP_TIMEOUT = 10
+    with open(setting.RESOLV_CONF_PATH, 'w', encoding='utf-8') as f:
+        f.write("nameserver 192.0.2.53\n")
+
+def step_means() -> dict:
+    """Returns the mean duration of each connect/cleanup step recorded in the metrics registry."""
+
+    histogram = registry.metrics["torsen_step_duration_seconds"]
+    return {f"{phase}.{step}": round(entry["sum"] / entry["count"], 4)
+            for (phase, step), entry in sorted(histogram.values.items()) if entry["count"]}
+
+def describe(calls: list) -> list:
+    """Renders recorded calls as short command lines."""
+
+    return [" ".join([os.path.basename(call["command"][0])] + call["command"][1:3]) for call in calls]
+
+def summarize(samples: list) -> dict:
+    """Summarizes wall-time samples."""
+
+    return {"mean": round(sum(samples) / len(samples), 4), "min": round(min(samples), 4), "max": round(max(samples), 4)}
+
+def run(iterations: int, latency: dict, failures: dict, phase_delay: float) -> dict:
+    """Runs connect()/disconnect() cycles against the simulated runner and fake control port."""
+
+    from core.connection import ConnectionManager
+
+    fake_tor = FakeTorControlPort(phase_delay=phase_delay).start()
+    runner = SimulatedRunner(latency=latency, outputs=DEFAULT_OUTPUTS, failures=failures)
+    previous_runner = set_runner(runner)
+    connect_times, cleanup_times, connect_spawns, cleanup_spawns = [], [], [], []
+    commands = {}
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="torsen-bench-") as workdir:
+            sandbox_settings(workdir, fake_tor.port)
+            for _ in range(iterations):
+                connection = ConnectionManager()
+                connection.dns_manager.backup_path = os.path.join(workdir, "resolv.conf.bak")
+                connection.torrc_manager.backup_path = os.path.join(workdir, "torrc.bak")
+                runner.calls.clear()
+
+                start = time.perf_counter()
+                connected = connection.connect()
+                connect_times.append(time.perf_counter() - start)
+                connect_spawns.append(len(runner.calls))
+                commands["connect"] = describe(runner.calls)
+                if not connected:
+                    return {"ok": False, "error": "connect failed", "commands": commands}
+
+                runner.calls.clear()
+                start = time.perf_counter()
+                connection.disconnect()
+                cleanup_times.append(time.perf_counter() - start)
+                cleanup_spawns.append(len(runner.calls))
+                commands["cleanup"] = describe(runner.calls)
+    finally:
+        set_runner(previous_runner)
+        fake_tor.stop()
+
+    return {
+        "ok": True,
+        "iterations": iterations,
+        "connect": {"wall_seconds": summarize(connect_times), "spawns": max(connect_spawns)},
+        "cleanup": {"wall_seconds": summarize(cleanup_times), "spawns": max(cleanup_spawns)},
+        "steps": step_means(),
+        "commands": commands,
+    }
+
+def check_regressions(result: dict, baseline: dict) -> list:
+    """Lists spawn count regressions against a baseline result.
+
+    Wall times depend on the machine the baseline was recorded on, so they are reported but not gated.
+    """
+
+    problems = []
+    for phase in ("connect", "cleanup"):
+        if result[phase]["spawns"] > baseline[phase]["spawns"]:
+            problems.append(f"{phase} spawns {result[phase]['spawns']} > baseline {baseline[phase]['spawns']}")
+    return problems
+
+def main():
+    """Runs the benchmark and optionally gates it against a baseline."""
+
+    parser = argparse.ArgumentParser(description="Benchmark Torsen connect/disconnect with simulated system commands.")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--latency", action="append", metavar="PREFIX=SECONDS", help="Override per-command latency.")
+    parser.add_argument("--fail", action="append", metavar="PREFIX=STDERR", help="Make matching commands fail.")
+    parser.add_argument("--bootstrap-phase-delay", type=float, default=0.05)
+    parser.add_argument("--baseline", help="JSON result whose spawn counts must not grow; exits 1 if they do.")
+    parser.add_argument("--output", help="Write the JSON result to this file.")
+    parser.add_argument("--verbose", action="store_true", help="Keep Torsen's log output.")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    result = run(args.iterations, {**DEFAULT_LATENCY, **parse_rules(args.latency)},
+                 parse_rules(args.fail, cast=str), args.bootstrap_phase_delay)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    if not result["ok"]:
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            problems = check_regressions(result, json.load(f))
+        for problem in problems:
+            print(f"REGRESSION: {problem}", file=sys.stderr)
+        sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
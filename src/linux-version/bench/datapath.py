@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import tempfile
+from config import setting
+from tor.monitor import percentile
+from bench.fake_dns import FakeResolver
+from bench.dns_bench import run_wave, summarize as summarize_dns
+from bench.connect_bench import sandbox_logs
+
+# Benchmarking ranges (RFC 2544): never routed on the Internet, so a leaked probe reaches nobody.
+TCP_TARGET = ("198.18.0.1", 80)
+DNS_TARGET = "198.18.0.2"
+LEAK_TARGET = ("198.18.0.3", 9)
+
+
+class EchoService:
+    """A TransPort stand-in that accepts connections and echoes every byte back."""
+
+    def __init__(self, port: int = 0):
+        """Initializes the EchoService."""
+
+        self.port = port
+        self.accepted = 0
+        self.bytes = 0
+        self.server = None
+
+    async def start(self) -> "EchoService":
+        """Starts listening on 127.0.0.1."""
+
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", self.port, backlog=1024)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        """Stops listening."""
+
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Echoes one connection until the client closes it."""
+
+        self.accepted += 1
+        try:
+            while data := await reader.read(65536):
+                self.bytes += len(data)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def transfer(address: str, port: int, payload: bytes, timeout: float) -> float | None:
+    """Opens one connection, round-trips the payload and returns the connect latency, or None on failure."""
+
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(address, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    connected = time.perf_counter() - start
+    try:
+        writer.write(payload)
+        await writer.drain()
+        await asyncio.wait_for(reader.readexactly(len(payload)), timeout)
+        return connected
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return None
+    finally:
+        writer.close()
+
+async def run_tcp(address: str, port: int, connections: int, concurrency: int, payload_size: int, timeout: float) -> dict:
+    """Runs `connections` echo transfers with at most `concurrency` in flight and summarizes their rate."""
+
+    payload = os.urandom(payload_size)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded():
+        async with semaphore:
+            return await transfer(address, port, payload, timeout)
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(bounded() for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+    completed = [latency for latency in latencies if latency is not None]
+    return {
+        "connections": connections,
+        "completed": len(completed),
+        "errors": connections - len(completed),
+        "seconds": round(elapsed, 3),
+        "connections_per_second": round(len(completed) / elapsed, 1),
+        "bytes_per_second": round(2 * payload_size * len(completed) / elapsed),
+        "connect_p50_ms": round(percentile(completed, 0.50) * 1000, 2) if completed else None,
+        "connect_p95_ms": round(percentile(completed, 0.95) * 1000, 2) if completed else None,
+    }
+
+def probe_leaks(probes: int, timeout: float) -> dict:
+    """Sends UDP datagrams that no rule redirects and counts how many the firewall rejected.
+
+    A rejected datagram fails the send (EPERM) or the next receive (ICMP port unreachable).
+    A probe that fails neither way left the host.
+    """
+
+    rejected = leaked = 0
+    for _ in range(probes):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(timeout)
+            try:
+                sock.connect(LEAK_TARGET)
+                sock.send(b"torsen-leak-probe")
+                sock.recv(1)
+                leaked += 1
+            except (ConnectionRefusedError, PermissionError):
+                rejected += 1
+            except (socket.timeout, OSError):
+                leaked += 1
+    return {"probes": probes, "rejected": rejected, "leaked": leaked}
+
+
+class DatapathBench:
+    """Drives concurrent TCP, DNS and leak-probe load through a local stand-in for tor.
+
+    In direct mode the clients talk to the stand-in over loopback, which needs no privileges
+    and measures the harness itself. In redirect mode Torsen's own firewall ruleset is loaded,
+    the stand-in takes tor's TransPort and DNSPort, and the clients aim at unrouted addresses,
+    so every byte goes through the REDIRECT and REJECT rules a real connection uses.
+    """
+
+    def __init__(self, redirect: bool = False):
+        """Initializes the DatapathBench."""
+
+        self.redirect = redirect
+        self.iptables_manager = None
+
+    def _install_rules(self) -> bool:
+        """Loads Torsen's ruleset around the stand-in's ports, refusing to touch a live connection."""
+
+        from iptables.rules import IptablesManager
+
+        if os.geteuid() != 0:
+            print("Redirect mode loads firewall rules and must run as root.", file=sys.stderr)
+            return False
+        if os.path.exists(setting.TORSEN_PID_PATH) or os.path.exists(setting.DAEMON_SOCKET_PATH):
+            print("Torsen is running; disconnect before benchmarking its data path.", file=sys.stderr)
+            return False
+        self.iptables_manager = IptablesManager()
+        if self.iptables_manager.apply_tor_rules():
+            return True
+        self.iptables_manager.restore_rules()
+        return False
+
+    async def _load(self, tcp: dict, dns: dict, probes: int, timeout: float) -> dict:
+        """Runs the TCP transfers, DNS queries and leak probes at the same time."""
+
+        echo = await EchoService(setting.TOR_TRANSPARENT_PORT if self.redirect else 0).start()
+        resolver = FakeResolver(port=setting.TOR_DNS_PORT if self.redirect else 0).start()
+        address, port = TCP_TARGET if self.redirect else ("127.0.0.1", echo.port)
+        dns_address, dns_port = (DNS_TARGET, 53) if self.redirect else ("127.0.0.1", resolver.port)
+        names = [f"host{index}.example" for index in range(dns["queries"])]
+        loop = asyncio.get_running_loop()
+        try:
+            tcp_result, dns_result, leaks = await asyncio.gather(
+                run_tcp(address, port, tcp["connections"], tcp["concurrency"], tcp["payload"], timeout),
+                run_wave(dns_port, names, dns["concurrency"], timeout, dns_address),
+                loop.run_in_executor(None, probe_leaks, probes, 0.2) if self.redirect else asyncio.sleep(0),
+            )
+        finally:
+            await echo.stop()
+            resolver.stop()
+
+        # A connection that completed without reaching the stand-in went somewhere else.
+        tcp_result["leaked"] = max(0, tcp_result["completed"] - echo.accepted)
+        return {"tcp": tcp_result, "dns": summarize_dns(dns_result), "leaks": leaks}
+
+    def run(self, tcp: dict, dns: dict, probes: int, timeout: float) -> dict:
+        """Runs one benchmark and returns its JSON-ready result."""
+
+        result = {
+            "ok": True,
+            "mode": "redirect" if self.redirect else "direct",
+            "timestamp": time.time(),
+            "firewall_backend": setting.FIREWALL_BACKEND,
+            "load": {"tcp": tcp, "dns": dns, "leak_probes": probes},
+        }
+        if self.redirect and not self._install_rules():
+            return {**result, "ok": False, "error": "Torsen's firewall rules could not be loaded"}
+        try:
+            before = self.iptables_manager.read_counters() if self.redirect else {}
+            result.update(asyncio.run(self._load(tcp, dns, probes, timeout)))
+            after = self.iptables_manager.read_counters() if self.redirect else {}
+        finally:
+            if self.redirect:
+                self.iptables_manager.restore_rules()
+        if self.redirect:
+            result["counters"] = {rule: after.get(rule, 0) - before.get(rule, 0) for rule in after}
+        return result
+
+
+def main(argv: list | None = None):
+    """Benchmarks throughput, DNS latency and leaks of Torsen's data path against a local tor stand-in."""
+
+    parser = argparse.ArgumentParser(prog="torsen bench", description="Benchmark the TransPort/DNSPort data path against a local echo stand-in.")
+    parser.add_argument("--redirect", action="store_true", help="Load Torsen's firewall rules and go through them (root).")
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--payload", type=int, default=16384, help="Bytes each connection sends and reads back.")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--dns-concurrency", type=int, default=100)
+    parser.add_argument("--leak-probes", type=int, default=50, help="UDP probes that must be rejected (redirect mode).")
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--output", help="Write the JSON result to this file.")
+    parser.add_argument("--verbose", action="store_true", help="Keep Torsen's log output.")
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    tcp = {"connections": args.connections, "concurrency": args.concurrency, "payload": args.payload}
+    dns = {"queries": args.queries, "concurrency": args.dns_concurrency}
+    with tempfile.TemporaryDirectory(prefix="torsen-bench-") as workdir:
+        sandbox_logs(workdir)
+        result = DatapathBench(args.redirect).run(tcp, dns, args.leak_probes, args.timeout)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    # Every transfer and query must succeed, and nothing may leave the host outside the stand-in.
+    ok = (result["ok"] and result["tcp"]["errors"] == 0 and result["tcp"]["leaked"] == 0
+          and result["dns"]["timeouts"] == 0 and not (result["leaks"] or {}).get("leaked"))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
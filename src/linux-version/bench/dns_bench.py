@@ -0,0 +1,135 @@
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+from config import setting
+from tor.monitor import percentile
+from dns.cache import DNSCacheServer
+from bench.fake_dns import FakeResolver, build_query
+from bench.connect_bench import sandbox_logs
+
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+    """Resolves a future with the first datagram received."""
+
+    def __init__(self, future: asyncio.Future):
+        """Initializes the _ClientProtocol."""
+
+        self.future = future
+
+    def datagram_received(self, data: bytes, addr):
+        """Hands the reply to the waiting query."""
+
+        if not self.future.done():
+            self.future.set_result(data)
+
+
+async def query(port: int, name: str, timeout: float, address: str = "127.0.0.1") -> float | None:
+    """Sends one query and returns its latency in seconds, or None if it timed out."""
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(lambda: _ClientProtocol(future), remote_addr=(address, port))
+    start = time.perf_counter()
+    try:
+        transport.sendto(build_query(name, txid=random.getrandbits(16)))
+        await asyncio.wait_for(future, timeout)
+        return time.perf_counter() - start
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        transport.close()
+
+async def run_wave(port: int, names: list, concurrency: int, timeout: float, address: str = "127.0.0.1") -> list:
+    """Queries every name with at most `concurrency` queries in flight."""
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(name):
+        async with semaphore:
+            return await query(port, name, timeout, address)
+
+    return await asyncio.gather(*(bounded(name) for name in names))
+
+def summarize(latencies: list) -> dict:
+    """Summarizes one wave's latencies in milliseconds."""
+
+    answered = [latency for latency in latencies if latency is not None]
+    return {
+        "queries": len(latencies),
+        "timeouts": len(latencies) - len(answered),
+        "p50_ms": round(percentile(answered, 0.50) * 1000, 2) if answered else None,
+        "p95_ms": round(percentile(answered, 0.95) * 1000, 2) if answered else None,
+        "p99_ms": round(percentile(answered, 0.99) * 1000, 2) if answered else None,
+    }
+
+def run(names: int, burst: int, waves: int, concurrency: int, latency: float, negative_share: float) -> dict:
+    """Runs a cold wave with duplicate bursts and then warm waves, directly and through the cache."""
+
+    workload = [f"nx{i}.example" if i < names * negative_share else f"host{i}.example" for i in range(names)]
+    cold = [name for name in workload for _ in range(burst)]
+    random.shuffle(cold)
+    timeout = max(setting.DNS_CACHE_TIMEOUT, latency * 4)
+
+    resolver = FakeResolver(latency=latency).start()
+    server = DNSCacheServer(upstreams=[("127.0.0.1", resolver.port)], address="127.0.0.1", port=0)
+    if not server.start():
+        resolver.stop()
+        return {"ok": False, "error": "DNS cache did not start"}
+    try:
+        direct = asyncio.run(run_wave(resolver.port, cold, concurrency, timeout))
+        upstream_before = resolver.queries
+        cached_cold = asyncio.run(run_wave(server.port, cold, concurrency, timeout))
+        cached_warm = []
+        for _ in range(waves):
+            cached_warm += asyncio.run(run_wave(server.port, random.sample(workload, len(workload)), concurrency, timeout))
+        upstream_queries = resolver.queries - upstream_before
+    finally:
+        server.stop()
+        resolver.stop()
+
+    return {
+        "ok": True,
+        "names": names,
+        "upstream_latency_ms": latency * 1000,
+        "direct": summarize(direct),
+        "cached_cold": summarize(cached_cold),
+        "cached_warm": summarize(cached_warm),
+        "upstream_queries": upstream_queries,
+        "counters": server.snapshot(),
+    }
+
+def main():
+    """Benchmarks the caching DNS stub against a fake upstream resolver."""
+
+    parser = argparse.ArgumentParser(description="Benchmark Torsen's caching DNS stub against a fake Tor DNSPort.")
+    parser.add_argument("--names", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=3, help="Concurrent duplicates of each name in the cold wave.")
+    parser.add_argument("--waves", type=int, default=3, help="Warm waves over every name after the cold wave.")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2, help="Upstream answer latency in seconds.")
+    parser.add_argument("--negative-share", type=float, default=0.1, help="Share of names answered with NXDOMAIN.")
+    parser.add_argument("--output", help="Write the JSON result to this file.")
+    parser.add_argument("--verbose", action="store_true", help="Keep Torsen's log output.")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory(prefix="torsen-bench-") as workdir:
+        sandbox_logs(workdir)
+        result = run(args.names, args.burst, args.waves, args.concurrency, args.latency, args.negative_share)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    # Every name must reach the upstream exactly once: duplicates coalesce and later waves hit the cache.
+    sys.exit(0 if result["ok"] and result["upstream_queries"] == args.names else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import time
+import random
+import threading
+from types import SimpleNamespace
+
+
+class FakeController:
+    """An in-process stand-in for a stem Controller that builds circuits and carries streams with set latencies.
+
+    Circuits take `build_time` seconds and end at one of `exits` exits, each with its own
+    round-trip time. A stream attached to circuit "0" is handled the way tor would with
+    destination isolation: it reuses the destination's circuit or builds one on demand.
+    Events are delivered to listeners as plain objects with stem's attribute names.
+    """
+
+    def __init__(self, exits: int = 10, build_time: tuple = (0.2, 0.8), exit_rtt: tuple = (0.02, 0.3), seed: int = 1):
+        """Initializes the FakeController."""
+
+        self.random = random.Random(seed)
+        self.build_time = build_time
+        self.exits = {f"EXIT{index:02d}": self.random.uniform(*exit_rtt) for index in range(exits)}
+        self.conf = {}
+        self.listeners = {}
+        self.circuits = {}
+        self.streams = {}
+        self.ttfb = {}
+        self.closed = []
+        self.signals = []
+        self.launched = 0
+        self._next_circuit = 0
+        self._own = {}
+        self._lock = threading.Lock()
+
+    def add_event_listener(self, listener, event_type):
+        """Subscribes a listener to one event type."""
+
+        self.listeners.setdefault(event_type, []).append(listener)
+
+    def remove_event_listener(self, listener):
+        """Unsubscribes a listener from every event type."""
+
+        for listeners in self.listeners.values():
+            if listener in listeners:
+                listeners.remove(listener)
+
+    def emit(self, event_type: str, **fields):
+        """Delivers one event to every listener of its type."""
+
+        for listener in list(self.listeners.get(event_type, [])):
+            listener(SimpleNamespace(**fields))
+
+    def set_conf(self, option: str, value: str):
+        """Sets a configuration option."""
+
+        self.conf[option] = value
+
+    def reset_conf(self, option: str):
+        """Resets a configuration option."""
+
+        self.conf.pop(option, None)
+
+    def _build(self) -> tuple:
+        """Starts building a circuit and returns (id, event that is set once it is built)."""
+
+        with self._lock:
+            self._next_circuit += 1
+            self.launched += 1
+            circuit_id = str(self._next_circuit)
+            built = threading.Event()
+            self.circuits[circuit_id] = {"exit": self.random.choice(list(self.exits)), "built": built}
+
+        def finish():
+            built.set()
+            self.emit("CIRC", id=circuit_id, status="BUILT", path=[(self.circuits[circuit_id]["exit"], "exit")])
+
+        threading.Timer(self.random.uniform(*self.build_time), finish).start()
+        return circuit_id, built
+
+    def new_circuit(self, path=None, purpose: str = "general", await_build: bool = False, timeout=None) -> str:
+        """Launches a circuit and returns its id."""
+
+        circuit_id, built = self._build()
+        if await_build:
+            built.wait(timeout)
+        return circuit_id
+
+    def signal(self, signal):
+        """Records a signal such as NEWNYM."""
+
+        self.signals.append(str(signal))
+
+    def close_circuit(self, circuit_id: str):
+        """Closes a circuit."""
+
+        with self._lock:
+            self.circuits.pop(circuit_id, None)
+            self.closed.append(circuit_id)
+        self.emit("CIRC", id=circuit_id, status="CLOSED", path=[])
+
+    def open_stream(self, stream_id: str, address: str, port: int = 443):
+        """Starts a client stream, the way tor reports a new TransPort connection."""
+
+        with self._lock:
+            self.streams[stream_id] = {"address": address, "start": None}
+        self.streams[stream_id]["start"] = time.monotonic()
+        if not self.listeners.get("STREAM") or self.conf.get("__LeaveStreamsUnattached") != "1":
+            self.attach_stream(stream_id, "0")
+            return
+        self.emit("STREAM", id=stream_id, status="NEW", target_address=address, target_port=port,
+                  source_address="127.0.0.1", source_port=40000, circ_id=None)
+
+    def attach_stream(self, stream_id: str, circuit_id: str, exiting_hop=None):
+        """Carries a stream over a circuit and records its time to first byte once the exit answers."""
+
+        stream = self.streams[stream_id]
+        with self._lock:
+            if circuit_id == "0":
+                circuit_id = self._own.get(stream["address"])
+                if circuit_id not in self.circuits:
+                    circuit_id = None
+            elif circuit_id not in self.circuits:
+                raise ValueError(f"unknown circuit {circuit_id}")
+        if circuit_id is None:
+            circuit_id, _ = self._build()
+            with self._lock:
+                self._own[stream["address"]] = circuit_id
+        circuit = self.circuits[circuit_id]
+
+        def carry():
+            circuit["built"].wait()
+            threading.Timer(self.exits[circuit["exit"]], first_byte).start()
+
+        def first_byte():
+            self.ttfb[stream_id] = time.monotonic() - stream["start"]
+            self.emit("STREAM_BW", id=stream_id, read=512, written=64)
+
+        threading.Thread(target=carry, daemon=True).start()
@@ -0,0 +1,78 @@
+import socket
+import struct
+import threading
+
+
+def build_query(name: str, qtype: int = 1, txid: int = 0) -> bytes:
+    """Builds a recursive wire-format query for one name."""
+
+    labels = b"".join(bytes([len(label)]) + label.encode() for label in name.strip(".").split("."))
+    return struct.pack("!HHHHHH", txid, 0x0100, 1, 0, 0, 0) + labels + b"\x00" + struct.pack("!HH", qtype, 1)
+
+
+class FakeResolver:
+    """A UDP resolver stand-in for tor's DNSPort with a fixed answer latency.
+
+    Names starting with "nx" get NXDOMAIN; every other A query gets one address with the
+    configured TTL. Each reply is sent from its own thread, so slow answers overlap like
+    they do over separate Tor circuits.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.0, ttl: int = 300):
+        """Initializes the FakeResolver."""
+
+        self.ttl = ttl
+        self.queries = 0
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", port))
+        self.port = self.sock.getsockname()[1]
+
+    def start(self) -> "FakeResolver":
+        """Starts answering in a background thread."""
+
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stops the resolver."""
+
+        self._stopped.set()
+        self.sock.close()
+
+    def answer(self, query: bytes) -> bytes:
+        """Builds the reply for one query."""
+
+        end = 12
+        while query[end]:
+            end += query[end] + 1
+        question = query[12:end + 5]
+        name = query[13:13 + query[12]].decode(errors="replace")
+        if name.startswith("nx"):
+            return query[:2] + struct.pack("!HHHHH", 0x8183, 1, 0, 0, 0) + question
+        record = b"\xc0\x0c" + struct.pack("!HHIH", 1, 1, self.ttl, 4) + socket.inet_aton("10.11.12.13")
+        return query[:2] + struct.pack("!HHHHH", 0x8180, 1, 1, 0, 0) + question + record
+
+    def _reply(self, query: bytes, addr):
+        """Waits out the latency and sends the answer."""
+
+        if self._stopped.wait(self.latency):
+            return
+        try:
+            self.sock.sendto(self.answer(query), addr)
+        except OSError:
+            pass
+
+    def _serve(self):
+        """Receives queries until stopped."""
+
+        while not self._stopped.is_set():
+            try:
+                query, addr = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            with self._lock:
+                self.queries += 1
+            threading.Thread(target=self._reply, args=(query, addr), daemon=True).start()
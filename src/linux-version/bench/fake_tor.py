@@ -0,0 +1,119 @@
+import socket
+import threading
+
+
+class FakeTorControlPort:
+    """A scriptable stand-in for tor's control port, good enough for stem to authenticate and subscribe.
+
+    On SETEVENTS including STATUS_CLIENT it replays the bootstrap phases with the configured
+    delay between them; emit() pushes any other asynchronous event line to every client.
+    """
+
+    def __init__(self, port: int = 0, phase_delay: float = 0.0, phases: tuple = (10, 50, 75, 90, 100)):
+        """Initializes the FakeTorControlPort."""
+
+        self.phases = phases
+        self.commands = []
+        self.conf = {}
+        self._clients = []
+        self.phase_delay = phase_delay
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", port))
+        self.port = self.sock.getsockname()[1]
+
+    def start(self) -> "FakeTorControlPort":
+        """Starts accepting control connections in a background thread."""
+
+        self.sock.listen(16)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stops the server and drops every client."""
+
+        self._stopped.set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        with self._lock:
+            for client in self._clients:
+                try:
+                    client.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                client.close()
+
+    def emit(self, line: str):
+        """Sends one asynchronous '650' event line to every connected client."""
+
+        with self._lock:
+            for client in list(self._clients):
+                try:
+                    client.sendall(f"650 {line}\r\n".encode())
+                except OSError:
+                    self._clients.remove(client)
+
+    def _accept_loop(self):
+        """Accepts clients until stopped."""
+
+        while not self._stopped.is_set():
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._clients.append(client)
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _replay_bootstrap(self):
+        """Emits the configured bootstrap phases as STATUS_CLIENT events."""
+
+        for progress in self.phases:
+            if self._stopped.wait(self.phase_delay):
+                return
+            self.emit(f'STATUS_CLIENT NOTICE BOOTSTRAP PROGRESS={progress} TAG=phase_{progress} SUMMARY="Phase {progress}"')
+
+    def _reply(self, command: str) -> str:
+        """Builds the reply for one control command."""
+
+        keyword, _, argument = command.partition(" ")
+        keyword = keyword.upper()
+        if keyword == "PROTOCOLINFO":
+            return '250-PROTOCOLINFO 1\r\n250-AUTH METHODS=NULL\r\n250-VERSION Tor="0.4.8.9"\r\n250 OK\r\n'
+        if keyword == "GETINFO":
+            values = {"version": "0.4.8.9", "status/circuit-established": "1",
+                      "status/bootstrap-phase": 'NOTICE BOOTSTRAP PROGRESS=0 TAG=starting SUMMARY="Starting"'}
+            lines = [f"250-{key}={values.get(key, '')}" for key in argument.split()]
+            return "\r\n".join(lines + ["250 OK"]) + "\r\n"
+        if keyword == "GETCONF":
+            lines = [f"250-{key}={value}" for key in argument.split() for value in self.conf.get(key, [])]
+            lines += [f"250-{key}" for key in argument.split() if key not in self.conf]
+            lines[-1] = "250 " + lines[-1][4:]
+            return "\r\n".join(lines) + "\r\n"
+        if keyword == "SETCONF":
+            for assignment in argument.split():
+                key, _, value = assignment.partition("=")
+                self.conf[key] = [value.strip('"')] if value else []
+        return "250 OK\r\n"
+
+    def _serve(self, client: socket.socket):
+        """Answers one client's commands line by line."""
+
+        with client, client.makefile('rb') as reader:
+            for raw in reader:
+                command = raw.decode().strip()
+                with self._lock:
+                    self.commands.append(command)
+                try:
+                    client.sendall(self._reply(command).encode())
+                except OSError:
+                    return
+                if command.upper().startswith("SETEVENTS") and "STATUS_CLIENT" in command:
+                    threading.Thread(target=self._replay_bootstrap, daemon=True).start()
+                if command.upper() == "QUIT":
+                    return
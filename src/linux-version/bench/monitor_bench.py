@@ -0,0 +1,144 @@
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from types import SimpleNamespace
+from config import setting
+from tor.monitor import CircuitMonitor, percentile
+from bench.fake_controller import FakeController
+from bench.connect_bench import sandbox_logs
+
+
+def build_circuits(controller: FakeController, delays: list, first_id: int = 1):
+    """Launches one circuit per delay at once and reports each one BUILT after its delay."""
+
+    circuits = [str(first_id + index) for index in range(len(delays))]
+    for circuit_id in circuits:
+        controller.emit("CIRC", id=circuit_id, status="LAUNCHED")
+    start = time.monotonic()
+    for circuit_id, delay in sorted(zip(circuits, delays), key=lambda pair: pair[1]):
+        time.sleep(max(0.0, start + delay - time.monotonic()))
+        controller.emit("CIRC", id=circuit_id, status="BUILT")
+
+def carry_streams(controller: FakeController, circuits: list, delays: list, first_id: int = 1):
+    """Opens one stream per circuit (None leaves it unattached) and reports its first bytes after its delay."""
+
+    streams = [str(first_id + index) for index in range(len(delays))]
+    for stream_id, circuit_id in zip(streams, circuits):
+        controller.emit("STREAM", id=stream_id, status="NEW", circ_id=None)
+        if circuit_id is not None:
+            controller.emit("STREAM", id=stream_id, status="SUCCEEDED", circ_id=circuit_id)
+    start = time.monotonic()
+    for stream_id, delay in sorted(zip(streams, delays), key=lambda pair: pair[1]):
+        time.sleep(max(0.0, start + delay - time.monotonic()))
+        controller.emit("STREAM_BW", id=stream_id, read=512, written=64)
+
+def report(monitor: CircuitMonitor, controller: FakeController) -> dict:
+    """Returns the monitor's window in milliseconds and the rotations the controller received."""
+
+    snapshot = monitor.snapshot()
+    to_ms = lambda seconds: None if seconds is None else round(seconds * 1000, 1)
+    return {
+        "circuit_build_p95_ms": to_ms(snapshot["circuit_build_p95"]),
+        "stream_ttfb_p95_ms": to_ms(snapshot["stream_ttfb_p95"]),
+        "samples": snapshot["samples"],
+        "rotations": snapshot["rotations"],
+        "signals": controller.signals,
+        "closed": controller.closed,
+    }
+
+def scenario(build_p95: float, ttfb_p95: float, interval: float = 0) -> tuple:
+    """Starts a monitor on a fresh fake controller with the given thresholds."""
+
+    setting.MONITOR_ENABLED = True
+    setting.MONITOR_MIN_SAMPLES = 10
+    setting.MONITOR_CIRC_BUILD_P95 = build_p95
+    setting.MONITOR_STREAM_TTFB_P95 = ttfb_p95
+    setting.MONITOR_ACTION_INTERVAL = interval
+    controller = FakeController()
+    monitor = CircuitMonitor(SimpleNamespace(controller=controller, is_alive=lambda: True))
+    monitor.start()
+    return monitor, controller
+
+def run(step: float, slow: float) -> dict:
+    """Scripts CIRC, STREAM and STREAM_BW events against the monitor and records what it measured and rotated."""
+
+    result = {}
+    ramp = [step * index for index in range(1, 11)]
+
+    # Healthy: p95 is the slowest of ten samples; failed circuits, closed streams and repeated reads add nothing.
+    monitor, controller = scenario(build_p95=1.0, ttfb_p95=1.0)
+    controller.emit("CIRC", id="99", status="LAUNCHED")
+    controller.emit("CIRC", id="99", status="FAILED")
+    controller.emit("CIRC", id="99", status="BUILT")
+    build_circuits(controller, ramp)
+    controller.emit("STREAM", id="99", status="NEW", circ_id=None)
+    controller.emit("STREAM", id="99", status="CLOSED", circ_id=None)
+    controller.emit("STREAM_BW", id="99", read=512, written=64)
+    carry_streams(controller, [str(index) for index in range(1, 11)], ramp)
+    controller.emit("STREAM_BW", id="1", read=512, written=64)
+    result["healthy"] = report(monitor, controller)
+
+    # Slow builds: NEWNYM once the window is full, then no second action within the action interval.
+    monitor, controller = scenario(build_p95=(step + slow) / 2, ttfb_p95=1.0)
+    build_circuits(controller, [step] * 8 + [slow] * 2)
+    result["slow_builds"] = report(monitor, controller)
+    setting.MONITOR_ACTION_INTERVAL = 60
+    build_circuits(controller, [slow] * 10, first_id=11)
+    result["slow_builds_rate_limited"] = report(monitor, controller)
+
+    # One slow exit: the circuit carrying most of the slow streams is closed, not the whole identity.
+    monitor, controller = scenario(build_p95=1.0, ttfb_p95=(step + slow) / 2)
+    circuits = ["1", "2", "3", "4", "4", "4", "5", "6", "7", "8"]
+    carry_streams(controller, circuits, [slow if circuit in ("4", "8") else step for circuit in circuits])
+    result["slow_exit"] = report(monitor, controller)
+
+    # Slow streams that never reached a circuit: nothing to close, so NEWNYM.
+    monitor, controller = scenario(build_p95=1.0, ttfb_p95=(step + slow) / 2)
+    carry_streams(controller, [None] * 10, [step] * 8 + [slow] * 2)
+    result["slow_unattached"] = report(monitor, controller)
+    return result
+
+def main():
+    """Checks the circuit monitor's percentiles and rotations against scripted fake controller events."""
+
+    parser = argparse.ArgumentParser(description="Check Torsen's circuit monitor against scripted controller events.")
+    parser.add_argument("--step", type=float, default=0.01, help="Seconds between the fast samples.")
+    parser.add_argument("--slow", type=float, default=0.2, help="Seconds a slow circuit or stream takes.")
+    parser.add_argument("--output", help="Write the JSON result to this file.")
+    parser.add_argument("--verbose", action="store_true", help="Keep Torsen's log output.")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory(prefix="torsen-bench-") as workdir:
+        sandbox_logs(workdir)
+        result = run(args.step, args.slow)
+    # Measured times may run late by scheduling jitter, never early.
+    near = lambda value, expected: value is not None and expected * 1000 <= value < (expected + 0.05) * 1000
+    healthy, slow_builds, limited = result["healthy"], result["slow_builds"], result["slow_builds_rate_limited"]
+    checks = {
+        "percentile": (percentile(range(1, 21), 0.95), percentile(range(1, 21), 0.5), percentile([], 0.95)) == (19, 10, None),
+        "healthy_p95": near(healthy["circuit_build_p95_ms"], 10 * args.step) and near(healthy["stream_ttfb_p95_ms"], 10 * args.step),
+        "healthy_samples": healthy["samples"] == {"circuit_build": 10, "stream_ttfb": 10},
+        "healthy_no_rotation": healthy["rotations"] == 0 and not healthy["signals"] and not healthy["closed"],
+        "slow_builds_newnym": slow_builds["signals"] == ["NEWNYM"] and slow_builds["rotations"] == 1,
+        "slow_builds_window_cleared": slow_builds["samples"] == {"circuit_build": 0, "stream_ttfb": 0},
+        "rate_limited": limited["signals"] == ["NEWNYM"] and near(limited["circuit_build_p95_ms"], args.slow),
+        "slow_exit_closed": result["slow_exit"]["closed"] == ["4"] and not result["slow_exit"]["signals"],
+        "slow_unattached_newnym": result["slow_unattached"]["signals"] == ["NEWNYM"] and not result["slow_unattached"]["closed"],
+    }
+    result["failed_checks"] = [name for name, passed in checks.items() if not passed]
+    result["ok"] = not result["failed_checks"]
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    sys.exit(0 if result["ok"] else 1)
+
+if __name__ == "__main__":
+    main()
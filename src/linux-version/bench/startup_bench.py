@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Keep the run away from a real daemon or connection on this machine.
+PRELUDE = ("from config import setting; "
+           "setting.DAEMON_SOCKET_PATH = '/nonexistent/torsen.sock'; "
+           "setting.TORSEN_PID_PATH = '/nonexistent/torsen.pid'; ")
+
+SCENARIOS = {
+    "usage": PRELUDE + "import sys, main; sys.argv = ['main.py']; main.main()",
+    "status": PRELUDE + "import sys, main; sys.argv = ['main.py', 'status']; main.main()",
+    # The real 'disconnect': read the pid file, SIGTERM the running connection and wait for it to exit.
+    # It refuses to run without the stand-in, which would mean cleaning up this host for real.
+    "disconnect": PRELUDE + "setting.TORSEN_PID_PATH = {pid_path!r}; setting.LOG_DIRECTORY = {workdir!r}; "
+                            "import sys, main; main.running_instance() or sys.exit('stand-in is not running'); main.disconnect()",
+    # What 'disconnect' builds to clean up locally when no connection is running.
+    "cleanup_managers": PRELUDE + "import main; main.get_connection()",
+}
+HEAVY_MODULES = ("stem", "coloredlogs", "asyncio", "http.server", "concurrent.futures")
+# Both log, so they may load the logging stack; only the managers need the step graph.
+ALLOWED = {"disconnect": ("coloredlogs",), "cleanup_managers": ("coloredlogs", "concurrent.futures")}
+BUDGETED = ("usage", "status")
+
+
+def start_stand_in(pid_path: str):
+    """Starts a process that plays the running 'connect' in the pid file, reaped as soon as it exits."""
+
+    process = subprocess.Popen(["sleep", "60"])
+    threading.Thread(target=process.wait, daemon=True).start()
+    with open(pid_path, 'w', encoding='utf-8') as f:
+        f.write(f"{process.pid}\n")
+
+def run_python(code: str, importtime: bool = False, setup=None) -> tuple:
+    """Runs a snippet in a fresh interpreter, after the optional setup, and returns (wall seconds, stderr)."""
+
+    if setup is not None:
+        setup()
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    return time.perf_counter() - start, result.stderr
+
+def imported_modules(stderr: str) -> dict:
+    """Parses -X importtime output into module -> cumulative microseconds."""
+
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+def cold_start(code: str, runs: int, setup=None) -> float:
+    """Returns the median wall time in milliseconds of several fresh interpreter runs."""
+
+    return statistics.median(run_python(code, setup=setup)[0] for _ in range(runs)) * 1000
+
+def run(runs: int) -> dict:
+    """Measures every scenario against a bare interpreter."""
+
+    bare = cold_start("pass", runs)
+    results = {"bare_python_ms": round(bare, 1), "scenarios": {}}
+    workdir = tempfile.TemporaryDirectory(prefix="torsen-startup-bench-")
+    pid_path = os.path.join(workdir.name, "torsen.pid")
+    for name, code in SCENARIOS.items():
+        code = code.format(pid_path=pid_path, workdir=workdir.name)
+        setup = (lambda: start_stand_in(pid_path)) if name == "disconnect" else None
+        modules = imported_modules(run_python(code, importtime=True, setup=setup)[1])
+        heavy = sorted(module for module in HEAVY_MODULES
+                       if module in modules and module not in ALLOWED.get(name, ()))
+        wall = cold_start(code, runs, setup)
+        results["scenarios"][name] = {
+            "wall_ms": round(wall, 1),
+            "overhead_ms": round(wall - bare, 1),
+            "import_main_ms": round(modules.get("main", 0) / 1000, 1),
+            "modules": len(modules),
+            "heavy_imports": heavy,
+        }
+    workdir.cleanup()
+    return results
+
+def main():
+    """Benchmarks CLI cold start and fails if heavy imports come back or startup overhead grows."""
+
+    parser = argparse.ArgumentParser(description="Measure Torsen CLI startup with python -X importtime.")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--max-overhead-ms", type=float, default=60.0,
+                        help="Allowed cold-start time above a bare interpreter for 'usage' and 'status'.")
+    parser.add_argument("--output", help="Write the JSON result to this file.")
+    args = parser.parse_args()
+
+    result = run(args.runs)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+
+    problems = []
+    for name, scenario in result["scenarios"].items():
+        if scenario["heavy_imports"]:
+            problems.append(f"{name} imports {', '.join(scenario['heavy_imports'])}")
+        if name in BUDGETED and scenario["overhead_ms"] > args.max_overhead_ms:
+            problems.append(f"{name} starts {scenario['overhead_ms']}ms slower than bare python "
+                            f"(budget {args.max_overhead_ms}ms)")
+    for problem in problems:
+        print(f"REGRESSION: {problem}", file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
@@ -13,14 +13,89 @@ FILE_LOG_LEVEL = logging.INFO
 GLOBAL_LOG_LEVEL = logging.DEBUG
 CONSOLE_LOG_LEVEL = logging.DEBUG
 
+LOG_JSON_ENABLED = False
+LOG_JSON_FILENAME = "torsen.jsonl"
+LOG_JSON_LEVEL = logging.DEBUG
+LOG_JSON_BATCH_SIZE = 100
+LOG_JSON_FLUSH_INTERVAL = 2.0
+
 # ==================================
 #     TOR SETTINGS
 # ==================================
 TOR_BOOTSTRAP_TIMEOUT = 120
+TORSEN_PID_PATH = "/run/torsen.pid"
+TASK_GRAPH_WORKERS = 4  # Threads used to run independent connect/cleanup steps concurrently
 SYSTEM_TORRC_PATH = "/etc/tor/torrc"
 TOR_LOG_FILE_PATH = "/var/log/tor/notices.log"
 TOR_CONTROL_PORT = 9051
+TOR_CONTROL_RETRY_INTERVAL = 0.25
 TOR_USER = "tor" 
+TOR_EXIT_NODES = "{US},{DE},{NL}"
+TOR_DATA_DIRECTORY = "/var/lib/tor"
+TORRC_OVERRIDES = {}  # Option -> value, list of values, or None to drop it from the template
+TOR_RESTART_OPTIONS = ("User", "DataDirectory", "ControlPort", "CookieAuthentication", "RunAsDaemon", "Sandbox")
+
+# ==================================
+#     DAEMON SETTINGS
+# ==================================
+DAEMON_SOCKET_PATH = "/run/torsen.sock"
+DAEMON_CONNECT_ON_START = False
+
+# ==================================
+#     TOR POOL SETTINGS
+# ==================================
+TOR_POOL_SIZE = 1  # Tor instances to run; 1 uses the system tor service, more launch a pool spread by the firewall
+TOR_POOL_DIRECTORY = "/var/lib/torsen/pool"
+TOR_POOL_PORT_STRIDE = 100  # Instance N listens on the base TransPort/DNSPort/ControlPort + N * stride
+TOR_POOL_HEALTH_INTERVAL = 15
+TOR_POOL_STOP_TIMEOUT = 10  # Seconds an instance gets to exit after SIGTERM before it is killed
+TOR_POOL_MIN_HEALTHY = 1
+
+# ==================================
+#     TOR STATE CACHE SETTINGS
+# ==================================
+TOR_STATE_CACHE_ENABLED = False
+TOR_STATE_CACHE_PATH = "/var/lib/torsen/tor-state.tar"
+TOR_STATE_CACHE_PREWARM = True  # Keep the bundle fresh from the daemon while disconnected
+TOR_STATE_CACHE_REFRESH_INTERVAL = 3600
+TOR_STATE_PREWARM_INDEX = 9  # Pool slot (ports and DataDirectory) of the throwaway pre-warm tor
+
+# ==================================
+#     STREAM ATTACHER SETTINGS
+# ==================================
+ATTACHER_ENABLED = False  # Attach streams from a pool of pre-built circuits (sets __LeaveStreamsUnattached)
+ATTACHER_POOL_SIZE = 4
+ATTACHER_ISOLATION = "destination"  # "destination", "uid" or "none": which streams may share a circuit
+ATTACHER_CIRCUIT_LIFETIME = 600  # Seconds an isolation key keeps its circuit, like MaxCircuitDirtiness
+ATTACHER_MAX_LATENCY = 5.0  # Close pool circuits that built, or whose exit answered, slower than this
+ATTACHER_REFILL_INTERVAL = 5
+
+# ==================================
+#     METRICS SETTINGS
+# ==================================
+METRICS_ENABLED = False
+METRICS_ADDRESS = "127.0.0.1"
+METRICS_PORT = 9797
+
+# ==================================
+#     CIRCUIT MONITOR SETTINGS
+# ==================================
+MONITOR_ENABLED = True
+MONITOR_WINDOW_SIZE = 50
+MONITOR_MIN_SAMPLES = 10
+MONITOR_CIRC_BUILD_P95 = 5.0  # Seconds from LAUNCHED to BUILT
+MONITOR_STREAM_TTFB_P95 = 3.0  # Seconds from stream NEW to its first bytes read
+MONITOR_ACTION_INTERVAL = 60  # Minimum seconds between NEWNYM/close-circuit actions
+
+# ==================================
+#     BRIDGE SETTINGS
+# ==================================
+BRIDGE_COUNT = 3
+BRIDGE_CACHE_TTL = 3600
+BRIDGE_PROBE_TIMEOUT = 5
+BRIDGE_PROBE_CONCURRENCY = 64
+BRIDGE_POOL_FILENAME = "bridges.txt"
+BRIDGE_CACHE_FILENAME = "bridges.cache.json"
 
 # ==================================
 #  IPTABLES & FIREWALL SETTINGS
@@ -29,6 +104,20 @@ TOR_DNS_IP = "127.0.0.1"
 TOR_DNS_PORT = 5353
 TOR_TRANSPARENT_PORT = 9040
 NON_TOR_NETWORKS = "192.168.0.0/16 10.0.0.0/8 172.16.0.0/12"
+BYPASS_NETWORKS_FILENAME = "bypass.txt"  # More bypass CIDRs in config/, one per line
+BYPASS_USE_SET = True  # Match bypass networks with one set lookup per chain (iptables needs the ipset tool)
+BYPASS_SET_NAME = "torsen_bypass"
+FIREWALL_BACKEND = "iptables"  # "iptables" (iptables-restore) or "nftables" (nft -f)
+FIREWALL_DRY_RUN = False  # Print the compiled ruleset instead of loading it
+
+# ==================================
+#     GATEWAY SETTINGS
+# ==================================
+GATEWAY_ENABLED = False  # Also route TCP and DNS from hosts behind GATEWAY_INTERFACES through Tor
+GATEWAY_INTERFACES = []  # Ingress interfaces, e.g. ["eth1"]; each needs an IPv4 address
+GATEWAY_MAX_CLIENT_CIRCUITS_PENDING = 256  # Tor's default of 32 stalls new streams once many clients connect at once
+GATEWAY_NUM_ENTRY_GUARDS = 3  # Spreads client circuits over more guards (tor uses 1 by default)
+GATEWAY_CONN_LIMIT = 16384  # Open files tor must be able to use; lowered to the hard limit when that is smaller
 
 # ==================================
 #     DNS SETTINGS
@@ -37,3 +126,13 @@ RESOLV_CONF_PATH = "/etc/resolv.conf"
 DNS_SERVICE_NAME = "systemd-resolved"
 RESOLV_CONF_BACKUP_FILENAME = "resolv.conf.torsen.bak"
 
+# ==================================
+#     DNS CACHE SETTINGS
+# ==================================
+DNS_CACHE_ENABLED = False  # Answer redirected DNS from a local caching stub that forwards misses to Tor
+DNS_CACHE_PORT = 5300
+DNS_CACHE_SIZE = 10000
+DNS_CACHE_MAX_TTL = 3600
+DNS_CACHE_NEGATIVE_TTL = 60  # Seconds to remember NXDOMAIN and empty answers
+DNS_CACHE_TIMEOUT = 10
+
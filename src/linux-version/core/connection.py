@@ -0,0 +1,483 @@
+import os
+import time
+import threading
+import subprocess
+from config import setting
+from utils.logger import RecordLog
+from tor.control import ControlSession
+from tor.controller import TorrcManager
+from dns.dns_manager import DNSManager
+from utils.metrics import registry
+from utils.runner import run_command
+from utils.taskgraph import TaskGraph
+from iptables.rules import IptablesManager
+
+STEP_SECONDS = registry.histogram("torsen_step_duration_seconds", "Duration of each connect and cleanup step.", ("phase", "step"))
+FIREWALL_PACKETS = registry.counter("torsen_firewall_packets_total", "Packets matched by Torsen's DNS redirect and REJECT rules.", ("rule",))
+
+
+class ConnectionManager:
+    """Owns the DNS, torrc and firewall managers and drives a Tor connection through its lifecycle."""
+
+    def __init__(self):
+        """Initializes the ConnectionManager."""
+
+        self.is_connected = False
+        self.is_suspended = False
+        self.circuit_monitor = None
+        self.stream_attacher = None
+        self.connected_since = None
+        self.bootstrap_tracker = None
+        self.connection_in_progress = False
+
+        self.dns_manager = DNSManager()
+        self.torrc_manager = TorrcManager()
+        self.control_session = ControlSession()
+        self.iptables_manager = IptablesManager()
+        self.pool = None
+        self.gateway = None
+        self.dns_cache = None
+        self.state_cache = None
+        self.tor_cache = "unknown"
+        # Pool health checks rebalance the rules from their own thread; every firewall change goes through this lock.
+        self._firewall_lock = threading.RLock()
+        # The pool, DNS cache, monitor and bootstrap tracker pull in stem and asyncio, so they
+        # are imported only when used; 'disconnect' and 'status' never need them.
+        if setting.TOR_POOL_SIZE > 1:
+            from tor.pool import TorPool
+            self.pool = TorPool()
+        if setting.DNS_CACHE_ENABLED:
+            from dns.cache import DNSCacheServer
+            self.dns_cache = DNSCacheServer()
+        if setting.TOR_STATE_CACHE_ENABLED:
+            from tor.state_cache import TorStateCache
+            self.state_cache = TorStateCache()
+        if setting.GATEWAY_ENABLED:
+            from core.gateway import GatewayManager
+            self.gateway = GatewayManager()
+            registry.add_collector(self._collect_gateway_clients)
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+        self.script_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'bash.sh')
+        registry.add_collector(self._collect_firewall_counters)
+
+    def _collect_firewall_counters(self):
+        """Refreshes the firewall rule counters at scrape time."""
+
+        for rule, packets in self.iptables_manager.read_counters().items():
+            FIREWALL_PACKETS.set(packets, rule=rule)
+
+    def _collect_gateway_clients(self):
+        """Refreshes the gateway client gauges at scrape time."""
+
+        self.gateway.snapshot(self.iptables_manager.trans_ports)
+
+    def _run_system_command(self, command: list, description: str, check_result: bool = True) -> bool:
+        """Executes a system command and logs its description and outcome."""
+
+        self.logger.info(description, extra={"command": command})
+        try:
+            result = run_command(command, check=check_result)
+            if result.stdout: self.logger.debug("Stdout: %s", result.stdout.strip())
+            return True
+        except subprocess.CalledProcessError as e:
+            self.logger.critical("Failed to execute '%s'. Stderr: %s", ' '.join(command), e.stderr.strip(), extra={"command": command})
+            return False
+        except FileNotFoundError:
+            self.logger.critical("Command '%s' not found. Is it in your PATH?", command[0])
+            return False
+
+    def _routing_active(self) -> bool:
+        """Returns True if this process, or another running Torsen connection, may have its firewall rules loaded."""
+
+        if self.is_connected:
+            return not self.is_suspended
+        return os.path.exists(setting.TORSEN_PID_PATH)
+
+    def torrc_overrides(self, extra: dict | None = None) -> dict:
+        """Merges gateway listeners, configured torrc overrides, the fastest probed bridges and any extra options."""
+
+        from tor.bridges import BridgeProber
+
+        overrides = self.gateway.torrc_overrides() if self.gateway is not None else {}
+        overrides.update(setting.TORRC_OVERRIDES)
+        # While the firewall redirects traffic, probes would land on tor's TransPort and time tor, not the bridges.
+        bridges = BridgeProber().fastest(probe=not self._routing_active())
+        if bridges:
+            overrides["Bridge"] = bridges
+        overrides.update(extra or {})
+        return overrides
+
+    def wait_for_tor_bootstrap(self) -> bool:
+        """Waits for the Tor service, or every instance of the pool, to fully connect to the network."""
+
+        from tor.monitor import CircuitMonitor
+        from tor.bootstrap import BootstrapTracker
+
+        if self.pool is not None:
+            if not self.pool.wait_for_bootstrap(setting.TOR_BOOTSTRAP_TIMEOUT):
+                return False
+            self._rebalance(self.pool.healthy())
+            self.pool.start_health_checks(self._rebalance)
+            session = self.pool.healthy()[0].session
+        else:
+            self.bootstrap_tracker = BootstrapTracker(self.control_session, self.tor_cache)
+            if not self.bootstrap_tracker.wait(setting.TOR_BOOTSTRAP_TIMEOUT):
+                return False
+            session = self.control_session
+
+        if setting.MONITOR_ENABLED or setting.METRICS_ENABLED:
+            self.circuit_monitor = CircuitMonitor(session)
+            self.circuit_monitor.start()
+        if setting.ATTACHER_ENABLED:
+            self._start_attacher(session)
+        return True
+
+    def _start_attacher(self, session):
+        """Starts attaching streams from pre-built circuits; tor keeps attaching them itself if this fails."""
+
+        from tor.attacher import StreamAttacher
+
+        if self.pool is not None:
+            self.logger.warning("The stream attacher only drives a single tor; pool instances attach their own streams.")
+            return
+        self.stream_attacher = StreamAttacher(session)
+        if not self.stream_attacher.start():
+            self.stream_attacher = None
+
+    def _rebalance(self, instances: list):
+        """Points the firewall (and the DNS cache) at the given pool instances, reloading the rules if they are active."""
+
+        with self._firewall_lock:
+            self.iptables_manager.trans_ports = [instance.trans_port for instance in instances]
+            self.iptables_manager.gateway_dns_ports = [instance.dns_port for instance in instances]
+            if self.dns_cache is not None:
+                self.dns_cache.upstreams = [(setting.TOR_DNS_IP, instance.dns_port) for instance in instances]
+            else:
+                self.iptables_manager.dns_ports = [instance.dns_port for instance in instances]
+            if self.is_connected and not self.is_suspended:
+                self.iptables_manager.apply_tor_rules()
+
+    def _start_dns_cache(self) -> bool:
+        """Starts the caching DNS stub and points the firewall's DNS redirect at it."""
+
+        if not self.dns_cache.start():
+            return False
+        self.iptables_manager.dns_ports = [self.dns_cache.port]
+        return True
+
+    def _resolve_gateway(self) -> bool:
+        """Looks up the ingress addresses tor has to listen on before its torrc is rendered."""
+
+        if not self.gateway.resolve():
+            return False
+        if self.pool is not None:
+            self.pool.listen_addresses = self.gateway.listen_addresses
+        return True
+
+    def _tor_ready(self) -> bool:
+        """Returns True if tor (any pool instance, in pool mode) has an established circuit."""
+
+        if self.pool is not None:
+            return any(self.pool.check(instance) for instance in self.pool.instances)
+        return self.control_session.open(timeout=1) and \
+            self.control_session.controller.get_info("status/circuit-established") == "1"
+
+    def _data_directories(self) -> list:
+        """Returns the DataDirectory of the system tor, or of every pool instance."""
+
+        if self.pool is not None:
+            return [instance.data_directory for instance in self.pool.instances]
+        return [setting.TOR_DATA_DIRECTORY]
+
+    def _restore_tor_state(self) -> bool:
+        """Restores the saved directory cache before tor starts and remembers how warm the start will be."""
+
+        states = {self.state_cache.restore(directory) for directory in self._data_directories()}
+        self.tor_cache = states.pop() if len(states) == 1 else "mixed"
+        if self.pool is not None:
+            self.pool.cache = self.tor_cache
+        return True
+
+    def _snapshot_tor_state(self) -> bool:
+        """Saves the freshest directory cache left by the stopped tor for the next connect."""
+
+        return all([self.state_cache.snapshot(directory) for directory in self._data_directories()])
+
+    def start_prewarm(self):
+        """Keeps the tor state bundle fresh in the background while Torsen is disconnected."""
+
+        if self.state_cache is not None and setting.TOR_STATE_CACHE_PREWARM:
+            self.state_cache.start_prewarm(lambda: not self.is_connected and not self.connection_in_progress,
+                                           self.torrc_overrides)
+
+    def stop_prewarm(self):
+        """Stops the background refresh of the tor state bundle."""
+
+        if self.state_cache is not None:
+            self.state_cache.stop_prewarm()
+
+    def _start_tor(self) -> bool:
+        """Starts the tor service through bash.sh, or launches the pool."""
+
+        if self.pool is not None:
+            return self.pool.start(self.torrc_overrides())
+        return self._run_system_command([self.script_path, "start"], "Executing bash startup script for Tor service", check_result=False)
+
+    def _stop_tor(self) -> bool:
+        """Stops the tor service through bash.sh, or every instance of the pool."""
+
+        if self.pool is not None:
+            return self.pool.stop()
+        return self._run_system_command([self.script_path, "stop"], "Executing bash shutdown script for Tor service")
+
+    def _close_session(self) -> bool:
+        """Cancels any bootstrap wait, stops the circuit monitor and closes the control session."""
+
+        if self.bootstrap_tracker is not None:
+            self.bootstrap_tracker.cancel()
+        if self.pool is not None:
+            self.pool.cancel_bootstrap()
+        if self.stream_attacher is not None:
+            self.stream_attacher.stop()
+            self.stream_attacher = None
+        if self.circuit_monitor is not None:
+            self.circuit_monitor.stop()
+            self.circuit_monitor = None
+        self.control_session.close()
+        return True
+
+    def _run_graph(self, graph: TaskGraph, phase: str) -> bool:
+        """Runs a step graph and records each step's duration."""
+
+        ok = graph.run()
+        for step, seconds in graph.durations.items():
+            STEP_SECONDS.observe(seconds, phase=phase, step=step)
+        return ok
+
+    def _apply_firewall(self) -> bool:
+        """Applies the Tor rules and removes Torsen's chains again if ip6tables failed after IPv4 was committed."""
+
+        with self._firewall_lock:
+            if self.iptables_manager.apply_tor_rules():
+                return True
+            self.iptables_manager.restore_rules()
+            return False
+
+    def _restore_firewall(self) -> bool:
+        """Removes Torsen's rules, holding the firewall lock so no rebalance can reinstall them halfway."""
+
+        with self._firewall_lock:
+            return self.iptables_manager.restore_rules()
+
+    def _must(self, action, message: str):
+        """Wraps a cleanup action so failures are reported but never stop the remaining steps."""
+
+        def run():
+            if not action():
+                self.logger.critical(message)
+            return True
+        return run
+
+    def connect(self) -> bool:
+        """Establishes the system-wide Tor connection, rolling back completed steps on failure."""
+
+        if self.is_connected:
+            self.logger.info("Already connected.")
+            return True
+
+        self.connection_in_progress = True
+        self.logger.info("--- Starting Secure Connection Process ---")
+        if self.state_cache is not None:
+            self.state_cache.cancel_prewarm()
+        torrc_path = setting.SYSTEM_TORRC_PATH
+
+        # DNS takeover and torrc preparation are independent of each other;
+        # only the firewall switch has to wait for a bootstrapped tor.
+        # Pool instances render their own torrcs, so the system torrc is left alone in pool mode.
+        graph = TaskGraph("connect", setting.TASK_GRAPH_WORKERS)
+        graph.add("dns_take_control", self.dns_manager.take_control, rollback=self.dns_manager.release_control)
+        if self.gateway is not None:
+            graph.add("gateway_resolve", self._resolve_gateway)
+        if self.pool is None:
+            graph.add("torrc_backup", lambda: self.torrc_manager.backup_torrc(torrc_path),
+                      rollback=lambda: self.torrc_manager.restore_torrc(torrc_path))
+            graph.add("torrc_apply", lambda: self.torrc_manager.apply_template(torrc_path, self.torrc_overrides()),
+                      depends=("torrc_backup", "gateway_resolve"))
+        if self.state_cache is not None:
+            graph.add("tor_state_restore", self._restore_tor_state)
+        graph.add("tor_start", self._start_tor, rollback=self._stop_tor,
+                  depends=("torrc_apply", "tor_state_restore", "gateway_resolve"))
+        graph.add("tor_bootstrap", self.wait_for_tor_bootstrap, rollback=self._close_session, depends=("tor_start",))
+        if self.dns_cache is not None:
+            graph.add("dns_cache_start", self._start_dns_cache, rollback=self.dns_cache.stop)
+        graph.add("firewall_apply", self._apply_firewall, depends=("tor_bootstrap", "dns_cache_start"))
+
+        connected = self._run_graph(graph, "connect")
+        self.connection_in_progress = False
+        if not connected:
+            self.logger.critical("Connection failed at: %s. Completed steps were rolled back.", ', '.join(graph.failed))
+            return False
+
+        self.is_connected = True
+        self.connected_since = time.time()
+        self.logger.info("✅ System traffic is now securely routed through Tor.")
+        return True
+
+    def disconnect(self) -> bool:
+        """Restores all system configurations to their original state."""
+
+        if not self.is_connected and not self.connection_in_progress:
+            return True
+
+        if self.is_connected: self.logger.warning("--- Cleanup Process Initiated ---")
+        self.connection_in_progress = False
+        torrc_path = setting.SYSTEM_TORRC_PATH
+
+        # Nothing may rebalance the rules back in once they are removed.
+        if self.pool is not None:
+            self.pool.stop_health_checks()
+
+        graph = TaskGraph("cleanup", setting.TASK_GRAPH_WORKERS, stop_on_failure=False)
+        graph.add("session_close", self._close_session)
+        # A failed stop must not skip its dependents: the torrc and state snapshot are restored regardless.
+        graph.add("tor_stop", self._must(self._stop_tor, "Failed to stop Tor. Manual intervention may be required!"),
+                  depends=("session_close",))
+        if self.pool is None:
+            graph.add("torrc_restore", self._must(lambda: self.torrc_manager.restore_torrc(torrc_path),
+                      "Failed to restore original torrc. Manual intervention may be required!"), depends=("tor_stop",))
+        if self.state_cache is not None:
+            graph.add("tor_state_snapshot", self._snapshot_tor_state, depends=("tor_stop",))
+        if not self.is_suspended:
+            graph.add("firewall_restore", self._must(self._restore_firewall,
+                      "Failed to restore iptables. Manual intervention may be required!"))
+            graph.add("dns_release", self._must(self.dns_manager.release_control,
+                      "Failed to restore DNS. Manual intervention may be required!"))
+        if self.dns_cache is not None:
+            graph.add("dns_cache_stop", self.dns_cache.stop, depends=("firewall_restore",))
+        self._run_graph(graph, "cleanup")
+
+        self.logger.info("✅ System connectivity restored. Tor service is stopped.")
+        self.is_connected = False
+        self.is_suspended = False
+        self.connected_since = None
+        return True
+
+    def suspend(self) -> bool:
+        """Removes the traffic redirection and DNS takeover while keeping the bootstrapped tor running."""
+
+        if not self.is_connected or self.is_suspended:
+            return False
+
+        self.logger.warning("--- Suspending Tor routing (tor stays warm) ---")
+        with self._firewall_lock:
+            if not self.iptables_manager.restore_rules():
+                self.logger.critical("Failed to restore iptables. Manual intervention may be required!")
+            if not self.dns_manager.release_control():
+                self.logger.critical("Failed to restore DNS. Manual intervention may be required!")
+            self.is_suspended = True
+        self.logger.info("✅ Routing suspended. Run 'resume' to route traffic through Tor again.")
+        return True
+
+    def resume(self) -> bool:
+        """Re-applies the DNS takeover and firewall redirection after checking that tor is still alive."""
+
+        if not self.is_connected or not self.is_suspended:
+            return False
+
+        start_time = time.monotonic()
+        try:
+            if not self._tor_ready():
+                raise ConnectionError("no established circuit")
+        except Exception as e:
+            self.logger.critical("Tor is not ready (%s). Staying suspended; disconnect and connect again.", e)
+            return False
+
+        with self._firewall_lock:
+            if not self.dns_manager.take_control():
+                self.logger.critical("Failed to take control of DNS. Staying suspended.")
+                return False
+            if not self.iptables_manager.apply_tor_rules():
+                self.logger.critical("Failed to apply firewall rules. Staying suspended.")
+                self.dns_manager.release_control()
+                return False
+            self.is_suspended = False
+        self.logger.info("✅ Routing resumed in %.2fs.", time.monotonic() - start_time)
+        return True
+
+    def reload(self, extra: dict | None = None) -> bool:
+        """Re-renders torrc with extra overrides and applies only the changes to the running tor."""
+
+        if self.pool is not None:
+            if not self.pool.reconfigure(self.torrc_overrides(extra)):
+                self.logger.error("Some tor instances could not be reconfigured.")
+                return False
+            self.logger.info("✅ Tor configuration reloaded on every pool instance.")
+            return True
+
+        if not self.control_session.open(timeout=5):
+            self.logger.critical("Tor is not reachable on the control port. Is Torsen connected?")
+            return False
+
+        restart = self.torrc_manager.reconfigure(self.control_session.controller, setting.SYSTEM_TORRC_PATH, self.torrc_overrides(extra))
+        if restart is None:
+            return False
+        if restart:
+            # Stops the attacher and monitor too, so the new session does not inherit their listeners and threads.
+            self._close_session()
+            self._run_system_command([self.script_path, "stop"], "Stopping Tor service for options that need a restart")
+            self._run_system_command([self.script_path, "start"], "Starting Tor service with the new configuration", check_result=False)
+            if not self.wait_for_tor_bootstrap():
+                return False
+        self.logger.info("✅ Tor configuration reloaded.")
+        return True
+
+    def newnym(self) -> bool:
+        """Asks tor to switch to clean circuits for new connections."""
+
+        from stem import Signal
+
+        if self.pool is not None:
+            if not self.pool.signal(Signal.NEWNYM):
+                self.logger.error("NEWNYM failed on some tor instances.")
+                return False
+            self.logger.info("Requested new Tor circuits (NEWNYM) on every pool instance.")
+            return True
+        if not self.control_session.open(timeout=5):
+            self.logger.error("Tor is not reachable on the control port.")
+            return False
+        try:
+            self.control_session.controller.signal(Signal.NEWNYM)
+        except Exception as e:
+            self.logger.error("NEWNYM failed: %s", e)
+            return False
+        self.logger.info("Requested new Tor circuits (NEWNYM).")
+        return True
+
+    def status(self) -> dict:
+        """Returns a snapshot of the connection state."""
+
+        status = {
+            "connected": self.is_connected,
+            "suspended": self.is_suspended,
+            "in_progress": self.connection_in_progress,
+            "connected_since": self.connected_since,
+            "control_session": self.control_session.is_alive(),
+        }
+        if self.bootstrap_tracker is not None:
+            status["bootstrap_progress"] = self.bootstrap_tracker.progress
+            status["bootstrap_seconds"] = round(self.bootstrap_tracker.elapsed(), 3)
+        if self.state_cache is not None:
+            status["tor_cache"] = self.tor_cache
+        if self.pool is not None:
+            status["pool"] = [{"instance": instance.index, "trans_port": instance.trans_port,
+                               "dns_port": instance.dns_port, "healthy": instance.healthy}
+                              for instance in self.pool.instances]
+        if self.dns_cache is not None:
+            status["dns_cache"] = self.dns_cache.snapshot()
+        if self.circuit_monitor is not None:
+            status["circuits"] = self.circuit_monitor.snapshot()
+        if self.stream_attacher is not None:
+            status["attacher"] = self.stream_attacher.snapshot()
+        if self.gateway is not None:
+            status["gateway"] = self.gateway.snapshot(self.iptables_manager.trans_ports)
+        return status
@@ -0,0 +1,126 @@
+import fcntl
+import socket
+import struct
+import resource
+from config import setting
+from utils.logger import RecordLog
+from utils.metrics import registry
+
+SIOCGIFADDR = 0x8915
+TCP_ESTABLISHED = "01"
+
+GATEWAY_CLIENTS = registry.gauge("torsen_gateway_clients", "LAN clients with at least one connection to Tor's TransPort.")
+GATEWAY_CONNECTIONS = registry.gauge("torsen_gateway_connections", "Established LAN client connections to Tor's TransPort.")
+
+
+def interface_address(interface: str) -> str | None:
+    """Returns the primary IPv4 address of a network interface, which is where REDIRECT sends its packets."""
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            request = struct.pack("256s", interface.encode()[:15])
+            return socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)[20:24])
+        except OSError:
+            return None
+
+
+def _decode(address: str) -> tuple:
+    """Decodes a /proc/net/tcp 'ADDR:PORT' field into (dotted address, port)."""
+
+    host, _, port = address.partition(":")
+    return socket.inet_ntoa(struct.pack("=I", int(host, 16))), int(port, 16)
+
+
+class GatewayManager:
+    """Serves transparent Tor to the hosts behind the configured ingress interfaces.
+
+    The firewall redirects TCP and DNS arriving on GATEWAY_INTERFACES to the TransPort and
+    DNSPort, which REDIRECT delivers to the interface's primary address, so tor listens there
+    as well as on localhost. Forwarded traffic from those interfaces is rejected, so nothing a
+    client sends can leave the gateway outside Tor.
+    """
+
+    def __init__(self, interfaces: list = None):
+        """Initializes the GatewayManager."""
+
+        self.interfaces = list(interfaces or setting.GATEWAY_INTERFACES)
+        self.addresses = {}
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+
+    def resolve(self) -> bool:
+        """Looks up every ingress interface's IPv4 address; fails if one has none."""
+
+        addresses = {interface: interface_address(interface) for interface in self.interfaces}
+        missing = [interface for interface, address in addresses.items() if address is None]
+        if not self.interfaces or missing:
+            self.logger.critical("Gateway mode needs an IPv4 address on every ingress interface; missing: %s.",
+                                 ', '.join(missing) or "no GATEWAY_INTERFACES configured")
+            return False
+        self.addresses = addresses
+        self.logger.info("Serving Tor to clients on %s.", ', '.join(f"{i} ({a})" for i, a in addresses.items()))
+        return True
+
+    @property
+    def listen_addresses(self) -> list:
+        """The ingress addresses tor listens on besides 127.0.0.1, each once."""
+
+        return [address for address in dict.fromkeys(self.addresses.values()) if address != "127.0.0.1"]
+
+    def listeners(self, port: int) -> list:
+        """Returns the torrc values for one port: localhost plus every ingress address."""
+
+        return [str(port)] + [f"{address}:{port}" for address in self.listen_addresses]
+
+    def conn_limit(self) -> int:
+        """Returns GATEWAY_CONN_LIMIT, lowered to the open-file hard limit tor will inherit."""
+
+        hard = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+        if hard == resource.RLIM_INFINITY or hard >= setting.GATEWAY_CONN_LIMIT:
+            return setting.GATEWAY_CONN_LIMIT
+        # Tor refuses to start when fewer descriptors than ConnLimit are available.
+        self.logger.warning("Open-file hard limit is %s; lowering ConnLimit from %s.", hard, setting.GATEWAY_CONN_LIMIT)
+        return hard
+
+    def torrc_overrides(self) -> dict:
+        """Returns the listeners and client limits tor needs to serve many hosts at once."""
+
+        return {
+            "TransPort": self.listeners(setting.TOR_TRANSPARENT_PORT),
+            "DNSPort": self.listeners(setting.TOR_DNS_PORT),
+            "MaxClientCircuitsPending": str(setting.GATEWAY_MAX_CLIENT_CIRCUITS_PENDING),
+            "NumEntryGuards": str(setting.GATEWAY_NUM_ENTRY_GUARDS),
+            "ConnLimit": str(self.conn_limit()),
+        }
+
+    def clients(self, trans_ports: list, table: str = "/proc/net/tcp") -> dict:
+        """Counts established connections to the TransPorts on the ingress addresses, per client address."""
+
+        local = set(self.addresses.values())
+        ports = set(trans_ports)
+        counts = {}
+        try:
+            with open(table, 'r', encoding='utf-8') as f:
+                next(f, None)
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 4 or fields[3] != TCP_ESTABLISHED:
+                        continue
+                    address, port = _decode(fields[1])
+                    if address in local and port in ports:
+                        client = _decode(fields[2])[0]
+                        counts[client] = counts.get(client, 0) + 1
+        except (IOError, ValueError) as e:
+            self.logger.debug("Could not read client connections: %s", e)
+        return counts
+
+    def snapshot(self, trans_ports: list) -> dict:
+        """Returns the ingress addresses and per-client connection counts, busiest clients first."""
+
+        counts = self.clients(trans_ports)
+        GATEWAY_CLIENTS.set(len(counts))
+        GATEWAY_CONNECTIONS.set(sum(counts.values()))
+        return {
+            "interfaces": dict(self.addresses),
+            "connections": sum(counts.values()),
+            "clients": dict(sorted(counts.items(), key=lambda item: item[1], reverse=True)),
+        }
@@ -0,0 +1,34 @@
+import sys
+import json
+import socket
+from config import setting
+
+
+def send_command(command: str, socket_path: str = None, timeout: float = None, **arguments) -> dict:
+    """Sends one JSON request to the Torsen daemon and returns its decoded JSON reply."""
+
+    socket_path = socket_path or setting.DAEMON_SOCKET_PATH
+    request = json.dumps({"command": command, "arguments": arguments}) + "\n"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(request.encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8') as reply:
+            return json.loads(reply.readline())
+
+
+if __name__ == "__main__":
+    # Lightweight entry point (python3 -m daemon.client status) that skips the managers entirely.
+    if len(sys.argv) != 2:
+        print("Usage: python3 -m daemon.client [status|stats|connect|disconnect|suspend|resume|newnym|reload]")
+        sys.exit(1)
+    try:
+        response = send_command(sys.argv[1])
+    except OSError as e:
+        print(f"Torsen daemon is not reachable: {e}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as e:
+        print(f"Torsen daemon sent no valid reply: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(response, indent=2))
+    sys.exit(0 if response.get("ok") else 1)
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import signal
+import asyncio
+from config import setting
+from utils.logger import RecordLog
+from utils.metrics import registry
+
+
+class TorsenDaemon:
+    """Long-running supervisor that serves a JSON API for a ConnectionManager over a Unix socket."""
+
+    def __init__(self, connection):
+        """Initializes the TorsenDaemon."""
+
+        self.server = None
+        self.connection = connection
+        self.started_at = time.time()
+        self._stopping = None
+        self._lock = None
+        self.socket_path = setting.DAEMON_SOCKET_PATH
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+        self.actions = {
+            "connect": connection.connect,
+            "disconnect": connection.disconnect,
+            "suspend": connection.suspend,
+            "resume": connection.resume,
+            "newnym": connection.newnym,
+            "reload": connection.reload,
+        }
+
+    async def _run_locked(self, func, *args) -> bool:
+        """Runs a blocking manager call in a worker thread, one state change at a time."""
+
+        async with self._lock:
+            return bool(await asyncio.to_thread(func, *args))
+
+    def _status(self) -> dict:
+        """Returns the connection status plus daemon bookkeeping, without waiting on the lock."""
+
+        status = self.connection.status()
+        status["daemon_uptime"] = round(time.time() - self.started_at, 3)
+        status["busy"] = self._lock.locked()
+        return status
+
+    async def _dispatch(self, request: dict) -> dict:
+        """Executes one decoded request and builds its response."""
+
+        command = request.get("command")
+        arguments = request.get("arguments") or {}
+        if command == "status":
+            return {"ok": True, "status": self._status()}
+        if command == "stats":
+            return {"ok": True, "metrics": await asyncio.to_thread(registry.render)}
+        if command not in self.actions:
+            return {"ok": False, "error": f"unknown command {command!r}"}
+
+        args = (arguments.get("options"),) if command == "reload" else ()
+        ok = await self._run_locked(self.actions[command], *args)
+        return {"ok": ok, "status": self._status()}
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serves newline-delimited JSON requests from one client connection."""
+
+        try:
+            while line := await reader.readline():
+                try:
+                    response = await self._dispatch(json.loads(line))
+                except (ValueError, AttributeError) as e:
+                    response = {"ok": False, "error": f"malformed request: {e}"}
+                except Exception as e:
+                    # A failing manager call must still get a reply, or the client is left reading nothing.
+                    self.logger.error("Request failed: %s", e, exc_info=True)
+                    response = {"ok": False, "error": f"request failed: {e}"}
+                writer.write((json.dumps(response) + "\n").encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self):
+        """Starts the control socket and runs until a stop signal arrives."""
+
+        self._lock = asyncio.Lock()
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self._stopping.set)
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self.logger.info("Torsen daemon listening on '%s'.", self.socket_path)
+
+        if setting.DAEMON_CONNECT_ON_START:
+            await self._run_locked(self.connection.connect)
+        self.connection.start_prewarm()
+
+        await self._stopping.wait()
+        self.logger.warning("Stop signal received, shutting down daemon...")
+        self.server.close()
+        await self.server.wait_closed()
+        await asyncio.to_thread(self.connection.stop_prewarm)
+        async with self._lock:
+            await asyncio.to_thread(self.connection.disconnect)
+        os.remove(self.socket_path)
+
+    def run(self):
+        """Runs the daemon's event loop until it is stopped."""
+
+        asyncio.run(self._serve())
@@ -0,0 +1,304 @@
+import time
+import struct
+import random
+import asyncio
+import threading
+from collections import OrderedDict
+from config import setting
+from utils.logger import RecordLog
+from utils.metrics import registry
+
+DNS_CACHE_REQUESTS = registry.counter("torsen_dns_cache_requests_total", "DNS queries answered by the caching stub, by outcome.", ("result",))
+DNS_CACHE_ENTRIES = registry.gauge("torsen_dns_cache_entries", "Answers currently held by the DNS cache.")
+
+RCODE_NXDOMAIN = 3
+TYPE_OPT = 41
+
+
+def _skip_name(data: bytes, offset: int) -> int:
+    """Returns the offset just past a possibly compressed domain name."""
+
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1
+        if length == 0:
+            return offset
+        offset += length
+
+def parse_question(data: bytes) -> tuple:
+    """Returns the cache key (lowercased name, type, class) of the first question and the offset after it."""
+
+    if len(data) < 12 or struct.unpack("!H", data[4:6])[0] < 1:
+        raise ValueError("no question")
+    end = _skip_name(data, 12)
+    qtype, qclass = struct.unpack("!HH", data[end:end + 4])
+    return (data[12:end].lower(), qtype, qclass), end + 4
+
+def parse_response(data: bytes) -> dict:
+    """Finds the response code, answer count and the offset and value of every record TTL."""
+
+    flags, qdcount, ancount, nscount, arcount = struct.unpack("!HHHHH", data[2:12])
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(data, offset) + 4
+
+    ttls, authority = [], []
+    for index in range(ancount + nscount + arcount):
+        offset = _skip_name(data, offset)
+        rtype, _, ttl, rdlength = struct.unpack("!HHIH", data[offset:offset + 10])
+        # The OPT pseudo-record reuses the TTL field for EDNS flags; it must never be aged.
+        if rtype != TYPE_OPT:
+            ttls.append((offset + 4, ttl))
+            if ancount <= index < ancount + nscount:
+                authority.append(ttl)
+        offset += 10 + rdlength
+    return {"rcode": flags & 0x000F, "truncated": bool(flags & 0x0200), "ancount": ancount,
+            "ttls": ttls, "authority": authority}
+
+def servfail(query: bytes) -> bytes:
+    """Builds a SERVFAIL reply echoing the query's ID and question."""
+
+    _, end = parse_question(query)
+    return query[:2] + struct.pack("!HHHHH", 0x8182, 1, 0, 0, 0) + query[12:end]
+
+
+class DNSCache:
+    """A size-bounded LRU of wire-format answers that expire with their own TTLs."""
+
+    def __init__(self, max_entries: int = None, negative_ttl: int = None, max_ttl: int = None):
+        """Initializes the DNSCache."""
+
+        self.entries = OrderedDict()
+        self.max_ttl = max_ttl or setting.DNS_CACHE_MAX_TTL
+        self.max_entries = max_entries or setting.DNS_CACHE_SIZE
+        self.negative_ttl = setting.DNS_CACHE_NEGATIVE_TTL if negative_ttl is None else negative_ttl
+
+    def get(self, key: tuple, query: bytes, question_end: int) -> tuple | None:
+        """Returns (answer, negative) rewritten for this query with aged TTLs, or None on a miss."""
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        age = int(time.monotonic() - entry["stored_at"])
+        if age >= entry["ttl"]:
+            del self.entries[key]
+            DNS_CACHE_ENTRIES.set(len(self.entries))
+            return None
+        self.entries.move_to_end(key)
+
+        answer = bytearray(entry["response"])
+        answer[0:2] = query[0:2]
+        # Echo the query's question bytes so clients relying on 0x20 case randomization accept the reply.
+        answer[12:question_end] = query[12:question_end]
+        for offset, ttl in entry["ttls"]:
+            answer[offset:offset + 4] = struct.pack("!I", max(ttl - age, 0))
+        return bytes(answer), entry["negative"]
+
+    def put(self, key: tuple, response: bytes) -> bool:
+        """Stores an answer; NXDOMAIN and empty answers are cached negatively, failures not at all."""
+
+        try:
+            info = parse_response(response)
+        except (struct.error, IndexError):
+            return False
+        if info["truncated"] or info["rcode"] not in (0, RCODE_NXDOMAIN):
+            return False
+
+        negative = info["rcode"] == RCODE_NXDOMAIN or info["ancount"] == 0
+        if negative:
+            ttl = min(info["authority"] + [self.negative_ttl])
+        else:
+            ttl = min(ttl for _, ttl in info["ttls"]) if info["ttls"] else 0
+        ttl = min(ttl, self.max_ttl)
+        if ttl <= 0:
+            return False
+
+        self.entries[key] = {"response": response, "ttls": info["ttls"], "ttl": ttl,
+                             "negative": negative, "stored_at": time.monotonic()}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        DNS_CACHE_ENTRIES.set(len(self.entries))
+        return True
+
+
+class _UpstreamProtocol(asyncio.DatagramProtocol):
+    """Matches upstream replies to pending queries by transaction ID."""
+
+    def __init__(self):
+        """Initializes the _UpstreamProtocol."""
+
+        self.pending = {}
+
+    def datagram_received(self, data: bytes, addr):
+        """Resolves the future waiting on this reply's transaction ID."""
+
+        if len(data) >= 12:
+            future = self.pending.pop(data[:2], None)
+            if future is not None and not future.done():
+                future.set_result(data)
+
+
+class _StubProtocol(asyncio.DatagramProtocol):
+    """Hands every client datagram to the server."""
+
+    def __init__(self, server: "DNSCacheServer"):
+        """Initializes the _StubProtocol."""
+
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        """Keeps the listening transport for replies."""
+
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        """Answers the query in its own task."""
+
+        asyncio.get_running_loop().create_task(self.server.answer(self.transport, data, addr))
+
+
+class DNSCacheServer:
+    """Caching DNS stub that forwards misses to Tor's DNSPort, coalescing duplicate in-flight queries."""
+
+    def __init__(self, upstreams: list = None, address: str = None, port: int = None):
+        """Initializes the DNSCacheServer."""
+
+        self.cache = DNSCache()
+        self.address = address or setting.TOR_DNS_IP
+        self.port = setting.DNS_CACHE_PORT if port is None else port
+        self.upstreams = upstreams or [(setting.TOR_DNS_IP, setting.TOR_DNS_PORT)]
+        self.counts = {"hit": 0, "negative_hit": 0, "miss": 0, "coalesced": 0, "failed": 0}
+        self.loop = None
+        self._thread = None
+        self._inflight = {}
+        self._upstream = None
+        self._transports = []
+        self._next_upstream = 0
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+
+    def _count(self, result: str):
+        """Bumps one outcome counter."""
+
+        self.counts[result] += 1
+        DNS_CACHE_REQUESTS.inc(result=result)
+
+    async def _forward(self, query: bytes) -> bytes | None:
+        """Sends the query to the next upstream under a fresh transaction ID and waits for the reply."""
+
+        pending = self._upstream.pending
+        txid = struct.pack("!H", random.getrandbits(16))
+        while txid in pending:
+            txid = struct.pack("!H", random.getrandbits(16))
+        future = asyncio.get_running_loop().create_future()
+        pending[txid] = future
+
+        upstream = self.upstreams[self._next_upstream % len(self.upstreams)]
+        self._next_upstream += 1
+        self._transports[0].sendto(txid + query[2:], upstream)
+        try:
+            return await asyncio.wait_for(future, setting.DNS_CACHE_TIMEOUT)
+        except asyncio.TimeoutError:
+            pending.pop(txid, None)
+            return None
+
+    async def resolve(self, query: bytes) -> bytes:
+        """Answers one wire-format query from the cache or the upstream."""
+
+        key, question_end = parse_question(query)
+        cached = self.cache.get(key, query, question_end)
+        if cached is not None:
+            self._count("negative_hit" if cached[1] else "hit")
+            return cached[0]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self._count("coalesced")
+            response = await asyncio.shield(future)
+        else:
+            self._count("miss")
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            response = None
+            try:
+                response = await self._forward(query)
+                if response is not None:
+                    self.cache.put(key, response)
+            finally:
+                del self._inflight[key]
+                if not future.done():
+                    future.set_result(response)
+
+        if response is None:
+            self._count("failed")
+            return servfail(query)
+        reply = bytearray(response)
+        reply[0:2] = query[0:2]
+        reply[12:question_end] = query[12:question_end]
+        return bytes(reply)
+
+    async def answer(self, transport, data: bytes, addr):
+        """Resolves one client datagram and sends the reply back."""
+
+        try:
+            transport.sendto(await self.resolve(data), addr)
+        except (ValueError, struct.error, IndexError):
+            self.logger.debug("Dropping malformed DNS query from %s.", addr[0])
+
+    async def open(self):
+        """Binds the upstream socket and the listening socket on the running loop."""
+
+        loop = asyncio.get_running_loop()
+        upstream, self._upstream = await loop.create_datagram_endpoint(_UpstreamProtocol, local_addr=("127.0.0.1", 0))
+        listener, _ = await loop.create_datagram_endpoint(lambda: _StubProtocol(self), local_addr=(self.address, self.port))
+        self._transports = [upstream, listener]
+        self.port = listener.get_extra_info("sockname")[1]
+
+    def start(self) -> bool:
+        """Runs the stub on its own event loop in a background thread."""
+
+        ready = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self.loop.run_until_complete(self.open())
+            except OSError as e:
+                errors.append(e)
+                ready.set()
+                self.loop.close()
+                return
+            ready.set()
+            self.loop.run_forever()
+            for transport in self._transports:
+                transport.close()
+            self.loop.run_until_complete(asyncio.sleep(0))
+            self.loop.close()
+
+        self._thread = threading.Thread(target=run, name="dns-cache", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if errors:
+            self.logger.error("Could not start DNS cache on %s:%s: %s", self.address, self.port, errors[0])
+            self._thread = None
+            return False
+        self.logger.info("DNS cache listening on %s:%s, forwarding to %s upstream(s).", self.address, self.port, len(self.upstreams))
+        return True
+
+    def stop(self) -> bool:
+        """Stops the event loop and closes both sockets."""
+
+        if self._thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self._thread = None
+        return True
+
+    def snapshot(self) -> dict:
+        """Returns the outcome counters and the number of cached answers."""
+
+        return dict(self.counts, entries=len(self.cache.entries))
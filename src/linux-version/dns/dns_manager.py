@@ -3,6 +3,7 @@ import shutil
 import subprocess
 from config import setting
 from utils.logger import RecordLog
+from utils.runner import run_command
 
 
 class DNSManager:
@@ -24,14 +25,14 @@ class DNSManager:
         """Executes a system command and logs the outcome."""
         
         try:
-            subprocess.run(command, capture_output=True, text=True, check=True, encoding='utf-8')
-            self.logger.info(f"Successfully {description}.")
+            run_command(command)
+            self.logger.info("Successfully %s.", description)
             return True
         except FileNotFoundError:
-            self.logger.info(f"Command '{command[0]}' not found, skipping.")
+            self.logger.info("Command '%s' not found, skipping.", command[0])
             return True 
         except subprocess.CalledProcessError as e:
-            self.logger.warning(f"Failed to {description}: {e.stderr.strip()}")
+            self.logger.warning("Failed to %s: %s", description, e.stderr.strip())
             return False
 
     def take_control(self) -> bool:
@@ -40,18 +41,18 @@ class DNSManager:
         self.logger.info("Taking control of system DNS...")
         self._run_system_command(["systemctl", "stop", self.dns_service], f"stopped {self.dns_service}")
 
-        self.logger.info(f"Backing up '{self.resolv_conf_path}'...")
+        self.logger.info("Backing up '%s'...", self.resolv_conf_path)
         if os.path.islink(self.resolv_conf_path):
             self._was_symlink = True
             self._symlink_target = os.readlink(self.resolv_conf_path)
-            self.logger.info(f"Detected symlink, target is '{self._symlink_target}'.")
+            self.logger.info("Detected symlink, target is '%s'.", self._symlink_target)
         
         try:
             if os.path.exists(self.resolv_conf_path):
                  shutil.copy(self.resolv_conf_path, self.backup_path, follow_symlinks=True)
-                 self.logger.info(f"Content backed up to '{self.backup_path}'.")
+                 self.logger.info("Content backed up to '%s'.", self.backup_path)
         except (IOError, PermissionError) as e:
-            self.logger.error(f"Could not back up DNS configuration: {e}")
+            self.logger.error("Could not back up DNS configuration: %s", e)
             self._run_system_command(["systemctl", "start", self.dns_service], f"re-started {self.dns_service}")
             return False
 
@@ -62,7 +63,7 @@ class DNSManager:
                 f.write(f"# Managed by Torsen\nnameserver {setting.TOR_DNS_IP}\n")
             return True
         except (IOError, PermissionError) as e:
-            self.logger.error(f"Could not write to '{self.resolv_conf_path}': {e}")
+            self.logger.error("Could not write to '%s': %s", self.resolv_conf_path, e)
             self.release_control()
             return False
 
@@ -76,13 +77,13 @@ class DNSManager:
 
             if self._was_symlink and self._symlink_target:
                 os.symlink(self._symlink_target, self.resolv_conf_path)
-                self.logger.info(f"Restored symlink -> '{self._symlink_target}'.")
+                self.logger.info("Restored symlink -> '%s'.", self._symlink_target)
             elif os.path.exists(self.backup_path):
                 shutil.move(self.backup_path, self.resolv_conf_path)
                 self.logger.info("Restored original file.")
 
         except (IOError, PermissionError) as e:
-            self.logger.critical(f"Failed to restore DNS config: {e}. Manual intervention required!")
+            self.logger.critical("Failed to restore DNS config: %s. Manual intervention required!", e)
 
         self._run_system_command(["systemctl", "restart", self.dns_service], f"restarted {self.dns_service}")
         self._run_system_command(["nmcli", "general", "reload"], "reloaded NetworkManager")
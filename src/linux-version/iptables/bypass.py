@@ -0,0 +1,38 @@
+import os
+import ipaddress
+from config import setting
+from utils.logger import RecordLog
+
+
+class BypassNetworks:
+    """Collects the IPv4 networks that skip Tor from NON_TOR_NETWORKS and the bypass file."""
+
+    def __init__(self):
+        """Initializes the BypassNetworks."""
+
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+        self.path = os.path.join(os.path.dirname(__file__), '..', 'config', setting.BYPASS_NETWORKS_FILENAME)
+
+    def _read_file(self) -> list:
+        """Reads one CIDR per line from the bypass file, skipping blanks and comments."""
+
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return [line.split("#", 1)[0].strip() for line in f if line.split("#", 1)[0].strip()]
+
+    def load(self) -> list:
+        """Returns the bypass networks, validated and collapsed so overlapping ranges become one entry."""
+
+        networks = []
+        for entry in setting.NON_TOR_NETWORKS.split() + self._read_file():
+            try:
+                network = ipaddress.ip_network(entry, strict=False)
+            except ValueError:
+                self.logger.warning("Skipping invalid bypass network '%s'.", entry)
+                continue
+            if network.version != 4:
+                self.logger.warning("Skipping IPv6 bypass network '%s'; IPv6 is blocked while connected.", entry)
+                continue
+            networks.append(network)
+        return [str(network) for network in ipaddress.collapse_addresses(networks)]
@@ -0,0 +1,198 @@
+from iptables.reconciler import CHAIN_PREFIX
+
+
+class RulesetCompiler:
+    """Compiles the Tor-only firewall policy into desired iptables chains and single-shot nft scripts.
+
+    With a bypass_set name, bypass networks live in an ipset (iptables) or a named nftables
+    interval set, matched by one rule per chain and replaceable without touching the chains.
+    With gateway_interfaces, TCP and DNS arriving on those interfaces are redirected the same
+    way as local traffic, and everything else they would forward is rejected.
+    """
+
+    def __init__(self, tor_uid: str, trans_ports: list, dns_ports: list, bypass_networks: list, bypass_set: str | None = None,
+                 gateway_interfaces: list | None = None, gateway_dns_ports: list | None = None):
+        """Initializes the RulesetCompiler."""
+
+        self.tor_uid = tor_uid
+        self.bypass_set = bypass_set
+        self.dns_ports = list(dns_ports)
+        self.gateway_interfaces = list(gateway_interfaces or [])
+        self.gateway_dns_ports = list(gateway_dns_ports or dns_ports)
+        self.trans_ports = list(trans_ports)
+        self.bypass_networks = list(bypass_networks) + ["127.0.0.0/8"]
+
+    @staticmethod
+    def _spread_iptables(match: str, ports: list) -> list:
+        """Redirects new flows round-robin across the ports with one statistic/nth rule per backend.
+
+        Each rule only sees flows the earlier rules let through, so rule i takes every
+        (N - i)th of them and the last rule catches the rest, giving an even split.
+        """
+
+        rules = []
+        for index, port in enumerate(ports[:-1]):
+            rules.append(f"{match} -m statistic --mode nth --every {len(ports) - index} --packet 0 -j REDIRECT --to-ports {port}")
+        rules.append(f"{match} -j REDIRECT --to-ports {ports[-1]}")
+        return rules
+
+    @staticmethod
+    def _spread_nftables(ports: list) -> str:
+        """Returns the redirect target, mapping an incrementing counter onto the ports when there are several."""
+
+        if len(ports) == 1:
+            return f"redirect to :{ports[0]}"
+        mapping = ", ".join(f"{index} : {port}" for index, port in enumerate(ports))
+        return f"redirect to :numgen inc mod {len(ports)} map {{ {mapping} }}"
+
+    def _bypass_iptables(self, target: str, match: str = "") -> list:
+        """Returns the rules that let bypass networks skip Tor: one set match, or one rule per network.
+
+        An interface match goes where iptables-save prints it: after -d, before any -m module.
+        """
+
+        prefix, suffix = (f"{match} ", f" {match}") if match else ("", "")
+        if self.bypass_set:
+            return [f"{prefix}-m set --match-set {self.bypass_set} dst -j {target}"]
+        return [f"-d {net}{suffix} -j {target}" for net in self.bypass_networks]
+
+    def _gateway_iptables(self) -> tuple:
+        """Returns (nat PREROUTING rules, filter FORWARD rules) for the ingress interfaces."""
+
+        prerouting, forward = [], []
+        for interface in self.gateway_interfaces:
+            ingress = f"-i {interface}"
+            prerouting += self._spread_iptables(f"{ingress} -p udp -m udp --dport 53", self.gateway_dns_ports)
+            prerouting += self._bypass_iptables("RETURN", ingress)
+            prerouting += self._spread_iptables(f"{ingress} -p tcp -m tcp --tcp-flags FIN,SYN,RST,ACK SYN", self.trans_ports)
+            forward += self._bypass_iptables("ACCEPT", ingress)
+            forward.append(f"{ingress} -j REJECT --reject-with icmp-port-unreachable")
+        return prerouting, forward
+
+    def compile_ipset(self) -> str:
+        """Builds an 'ipset restore -exist' document that fills a fresh set and swaps it in atomically."""
+
+        staging = f"{self.bypass_set}_new"
+        maxelem = max(65536, 2 * len(self.bypass_networks))
+        lines = [
+            f"create {self.bypass_set} hash:net family inet maxelem {maxelem}",
+            f"create {staging} hash:net family inet maxelem {maxelem}",
+            f"flush {staging}",
+        ]
+        lines += [f"add {staging} {net}" for net in self.bypass_networks]
+        lines += [f"swap {staging} {self.bypass_set}", f"destroy {staging}"]
+        return "\n".join(lines) + "\n"
+
+    def compile_ipset_restore(self) -> str:
+        """Builds the ipset document that drops the bypass set once no rule references it."""
+
+        return f"destroy {self.bypass_set}\n"
+
+    def compile_iptables(self) -> dict:
+        """Builds the desired Torsen chains as {family: {table: {chain: [rule specs]}}}.
+
+        Rules are written the way iptables-save prints them back (implicit protocol matches,
+        expanded --syn, explicit --reject-with), so the reconciler sees unchanged rules as equal.
+        """
+
+        dns = "-p udp -m udp --dport 53"
+        nat_output = [f"-m owner --uid-owner {self.tor_uid} -j RETURN"]
+        nat_output += self._spread_iptables(dns, self.dns_ports)
+        nat_output += self._bypass_iptables("RETURN")
+        nat_output += self._spread_iptables("-p tcp -m tcp --tcp-flags FIN,SYN,RST,ACK SYN", self.trans_ports)
+
+        filter_output = ["-m state --state RELATED,ESTABLISHED -j ACCEPT"]
+        filter_output += self._bypass_iptables("ACCEPT")
+        filter_output += [
+            f"-m owner --uid-owner {self.tor_uid} -j ACCEPT",
+            "-j REJECT --reject-with icmp-port-unreachable",
+        ]
+
+        gateway_prerouting, gateway_forward = self._gateway_iptables()
+        filters = {f"{CHAIN_PREFIX}OUTPUT": filter_output}
+        if gateway_forward:
+            filters[f"{CHAIN_PREFIX}FORWARD"] = gateway_forward
+
+        return {
+            "iptables": {
+                "nat": {
+                    f"{CHAIN_PREFIX}OUTPUT": nat_output,
+                    f"{CHAIN_PREFIX}PREROUTING": self._spread_iptables(f"-i lo {dns}", self.dns_ports) + gateway_prerouting,
+                },
+                "filter": filters,
+            },
+            "ip6tables": {
+                "filter": {f"{CHAIN_PREFIX}{hook}": ["-j DROP"] for hook in ("INPUT", "FORWARD", "OUTPUT")},
+            },
+        }
+
+    def compile_nftables(self) -> str:
+        """Builds one nft script that atomically replaces Torsen's own inet table."""
+
+        networks = ", ".join(self.bypass_networks)
+        dns_redirect = self._spread_nftables(self.dns_ports)
+        bypass = f"@{self.bypass_set}" if self.bypass_set else f"{{ {networks} }}"
+        gateway_prerouting, gateway_forward = [], []
+        if self.gateway_interfaces:
+            ingress = "iifname { " + ", ".join(f'"{interface}"' for interface in self.gateway_interfaces) + " }"
+            gateway_prerouting = [
+                f"        {ingress} meta nfproto ipv4 udp dport 53 counter {self._spread_nftables(self.gateway_dns_ports)}",
+                f"        {ingress} ip daddr {bypass} return",
+                f"        {ingress} meta nfproto ipv4 tcp flags & (fin|syn|rst|ack) == syn {self._spread_nftables(self.trans_ports)}",
+            ]
+            gateway_forward = [
+                f"        {ingress} ip daddr {bypass} accept",
+                f"        {ingress} counter reject",
+            ]
+        declarations = [
+            f"    set {self.bypass_set} {{",
+            "        type ipv4_addr; flags interval; auto-merge;",
+            f"        elements = {{ {networks} }}",
+            "    }",
+        ] if self.bypass_set else []
+        return "\n".join([
+            "add table inet torsen",
+            "delete table inet torsen",
+            "table inet torsen {",
+        ] + declarations + [
+            "    chain nat_output {",
+            "        type nat hook output priority -100; policy accept;",
+            f"        meta skuid {self.tor_uid} return",
+            f"        meta nfproto ipv4 udp dport 53 counter {dns_redirect}",
+            f"        ip daddr {bypass} return",
+            f"        meta nfproto ipv4 tcp flags & (fin|syn|rst|ack) == syn {self._spread_nftables(self.trans_ports)}",
+            "    }",
+            "    chain nat_prerouting {",
+            "        type nat hook prerouting priority -100; policy accept;",
+            f"        iifname \"lo\" meta nfproto ipv4 udp dport 53 counter {dns_redirect}",
+        ] + gateway_prerouting + [
+            "    }",
+            "    chain filter_input {",
+            "        type filter hook input priority 0; policy accept;",
+            "        meta nfproto ipv6 drop",
+            "    }",
+            "    chain filter_forward {",
+            "        type filter hook forward priority 0; policy accept;",
+            "        meta nfproto ipv6 drop",
+        ] + gateway_forward + [
+            "    }",
+            "    chain filter_output {",
+            "        type filter hook output priority 0; policy accept;",
+            "        meta nfproto ipv6 drop",
+            "        ct state established,related accept",
+            f"        ip daddr {bypass} accept",
+            f"        meta skuid {self.tor_uid} accept",
+            "        counter reject",
+            "    }",
+            "}",
+        ]) + "\n"
+
+    def compile_nftables_bypass(self) -> str:
+        """Builds the nft script that replaces the bypass set's elements in one transaction."""
+
+        return f"flush set inet torsen {self.bypass_set}\nadd element inet torsen {self.bypass_set} {{ {', '.join(self.bypass_networks)} }}\n"
+
+    def compile_nftables_restore(self) -> str:
+        """Builds the nft script that removes Torsen's table, leaving every other table untouched."""
+
+        return "add table inet torsen\ndelete table inet torsen\n"
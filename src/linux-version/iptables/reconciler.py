@@ -0,0 +1,105 @@
+import difflib
+
+CHAIN_PREFIX = "TORSEN_"
+
+
+def parse_save(output: str) -> dict:
+    """Parses iptables-save output into {table: {chain: [rule specs]}}, keeping every chain and rule in order."""
+
+    model = {}
+    table = None
+    for line in output.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or line == "COMMIT":
+            continue
+        if line.startswith("*"):
+            table = model.setdefault(line[1:], {})
+        elif table is None:
+            continue
+        elif line.startswith(":"):
+            table.setdefault(line[1:].split()[0], [])
+        elif line.startswith("-A "):
+            chain, _, spec = line[3:].partition(" ")
+            table.setdefault(chain, []).append(spec)
+    return model
+
+
+class RulesetReconciler:
+    """Plans the smallest iptables-restore --noflush edit that turns the live rules into the desired ones.
+
+    Torsen owns only chains named TORSEN_<BUILTIN>, each hooked into <BUILTIN> by a single
+    jump at position 1. Rules in every other chain, including those added by Docker or fail2ban,
+    are never touched, and unchanged Torsen rules keep their position and counters.
+    """
+
+    @staticmethod
+    def _hook(chain: str) -> str:
+        """Returns the built-in chain a Torsen chain is jumped to from."""
+
+        return chain[len(CHAIN_PREFIX):]
+
+    @staticmethod
+    def _edit_chain(chain: str, current: list, desired: list) -> list:
+        """Returns the -R/-D/-I/-A commands that turn one chain's rules into the desired list.
+
+        Edits are emitted from the bottom of the chain upwards, so the rule numbers of every
+        edit refer to rules above it that have not moved yet.
+        """
+
+        commands = []
+        matcher = difflib.SequenceMatcher(None, current, desired, autojunk=False)
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag == "equal":
+                continue
+            paired = min(i2 - i1, j2 - j1)
+            for index in range(i2 - 1, i1 + paired - 1, -1):
+                commands.append(f"-D {chain} {index + 1}")
+            for index in range(j2 - 1, j1 + paired - 1, -1):
+                if i2 == len(current):
+                    commands.append(f"-A {chain} {desired[index]}")
+                else:
+                    commands.append(f"-I {chain} {i1 + paired + 1} {desired[index]}")
+            for offset in range(paired - 1, -1, -1):
+                commands.append(f"-R {chain} {i1 + offset + 1} {desired[j1 + offset]}")
+        # Appends were collected last-first like the inserts; put them back in rule order.
+        appends = [command for command in commands if command.startswith("-A ")]
+        return [command for command in commands if not command.startswith("-A ")] + appends[::-1]
+
+    def _plan_table(self, current: dict, desired: dict) -> list:
+        """Returns the lines for one table: new chains, rule edits, jumps, then removal of stale chains."""
+
+        owned = [chain for chain in current if chain.startswith(CHAIN_PREFIX)]
+        stale = [chain for chain in owned if chain not in desired]
+        lines = [f":{chain} - [0:0]" for chain in desired if chain not in current]
+
+        for chain, rules in desired.items():
+            lines += self._edit_chain(chain, current.get(chain, []), rules)
+
+        hooks = {self._hook(chain): chain for chain in list(desired) + stale}
+        for builtin, chain in hooks.items():
+            jump = f"-j {chain}"
+            positions = [index for index, spec in enumerate(current.get(builtin, [])) if spec == jump]
+            wanted = [0] if chain in desired else []
+            if positions == wanted:
+                continue
+            lines += [f"-D {builtin} {index + 1}" for index in reversed(positions)]
+            if wanted:
+                lines.append(f"-I {builtin} 1 {jump}")
+
+        for chain in stale:
+            lines += [f"-F {chain}", f"-X {chain}"]
+        return lines
+
+    def plan(self, current: dict, desired: dict) -> str:
+        """Builds the restore document for one address family; empty when the live rules already match.
+
+        `desired` maps tables to Torsen chains and their rules. Tables that are present live but
+        absent from `desired` lose their Torsen chains.
+        """
+
+        document = []
+        for table in list(desired) + [table for table in current if table not in desired]:
+            lines = self._plan_table(current.get(table, {}), desired.get(table, {}))
+            if lines:
+                document += [f"*{table}"] + lines + ["COMMIT"]
+        return "\n".join(document) + "\n" if document else ""
@@ -1,7 +1,12 @@
-import os
+import re
+import pwd
 import subprocess
 from config import setting
 from utils.logger import RecordLog
+from utils.runner import run_command
+from iptables.bypass import BypassNetworks
+from iptables.compiler import RulesetCompiler
+from iptables.reconciler import RulesetReconciler, parse_save
 
 
 class IptablesManager:
@@ -10,113 +15,177 @@ class IptablesManager:
     def __init__(self):
         """Initializes the IptablesManager."""
 
-        iptables_dir = os.path.dirname(os.path.abspath(__file__))
         self.logger = RecordLog(self.__class__.__name__).get_logger()
 
         self.tor_user = setting.TOR_USER
-        self.dns_port = setting.TOR_DNS_PORT
-        self.trans_port = setting.TOR_TRANSPARENT_PORT
-        self.non_tor_networks = setting.NON_TOR_NETWORKS
-        self.tor_uid = self._get_user_uid(self.tor_user)
-        self.backup_path_v4 = os.path.join(iptables_dir, "iptables.v4.bak")
+        self.dry_run = setting.FIREWALL_DRY_RUN
+        self.backend = setting.FIREWALL_BACKEND
+        self.dns_ports = [setting.TOR_DNS_PORT]
+        self.trans_ports = [setting.TOR_TRANSPARENT_PORT]
+        # Gateway clients always reach tor's own DNSPorts; the DNS cache only listens on localhost.
+        self.gateway_dns_ports = [setting.TOR_DNS_PORT]
+        self.gateway_interfaces = list(setting.GATEWAY_INTERFACES) if setting.GATEWAY_ENABLED else []
+        self.bypass = BypassNetworks()
+        self.bypass_set = setting.BYPASS_SET_NAME if setting.BYPASS_USE_SET else None
+        self._tor_uid = None
+        self.reconciler = RulesetReconciler()
 
-    def _run_command(self, command: list) -> bool:
+    def _run_command(self, command: list, stdin_data: str | None = None) -> bool:
         """Executes a given shell command and logs its outcome."""
         
-        self.logger.debug(f"Executing: {' '.join(command)}")    
+        self.logger.debug("Executing: %s", ' '.join(command), extra={"command": command})
         try:
-            subprocess.run(command, capture_output=True, text=True, check=True, encoding='utf-8')
+            run_command(command, input=stdin_data)
             return True
         except subprocess.CalledProcessError as e:
-            self.logger.error(f"Failed: {' '.join(command)}. Stderr: {e.stderr.strip()}")
+            self.logger.error("Failed: %s. Stderr: %s", ' '.join(command), e.stderr.strip(), extra={"command": command})
             return False
         except FileNotFoundError:
-            self.logger.critical(f"Command not found: {command[0]}. Is it installed?")
+            self.logger.critical("Command not found: %s. Is it installed?", command[0])
             return False
 
     def _get_user_uid(self, username: str) -> str | None:
-        """Retrieves the UID for a given system username."""
+        """Retrieves the UID for a given system username from the passwd database."""
         
-        self.logger.info(f"Fetching UID for user '{username}'...")
         try:
-            return subprocess.check_output(['id', '-u', username]).strip().decode()
-        except subprocess.CalledProcessError:
-            self.logger.critical(f"User '{username}' not found.")
+            return str(pwd.getpwnam(username).pw_uid)
+        except KeyError:
+            self.logger.critical("User '%s' not found.", username)
             return None
 
-    def backup_rules(self) -> bool:
-        """Saves the current IPv4 iptables rules to a backup file."""
-        
-        self.logger.info("Backing up IPv4 firewall rules...")
+    @property
+    def tor_uid(self) -> str | None:
+        """The tor user's UID, looked up on first use."""
+
+        if self._tor_uid is None:
+            self._tor_uid = self._get_user_uid(self.tor_user)
+        return self._tor_uid
+
+    def read_counters(self) -> dict:
+        """Returns packet counts of the DNS redirect and REJECT rules, read with one save/list call."""
+
+        command = ["nft", "list", "table", "inet", "torsen"] if self.backend == "nftables" else ["iptables-save", "-c"]
         try:
-            with open(self.backup_path_v4, 'w', encoding='utf-8') as f_v4:
-                subprocess.run(["iptables-save"], stdout=f_v4, check=True, text=True)
-            self.logger.info("Backup successful.")
+            output = run_command(command).stdout
+        except (FileNotFoundError, subprocess.CalledProcessError) as e:
+            self.logger.debug("Could not read firewall counters: %s", e)
+            return {}
+
+        counters = {"dns_redirect": 0, "reject": 0}
+        table = None
+        for line in output.splitlines():
+            line = line.strip()
+            if line.startswith("*"):
+                table = line[1:]
+            if self.backend == "nftables":
+                match = re.search(r"counter packets (\d+)", line)
+                if not match:
+                    continue
+                if "udp dport 53" in line and "redirect to" in line:
+                    counters["dns_redirect"] += int(match.group(1))
+                elif " reject" in line:
+                    counters["reject"] += int(match.group(1))
+            else:
+                match = re.match(r"\[(\d+):\d+\] (.*)", line)
+                if not match:
+                    continue
+                rule = match.group(2)
+                if table == "nat" and "--dport 53" in rule and "-j REDIRECT" in rule:
+                    counters["dns_redirect"] += int(match.group(1))
+                elif table == "filter" and "-j REJECT" in rule:
+                    counters["reject"] += int(match.group(1))
+        return counters
+
+    def read_live_rules(self, family: str) -> dict:
+        """Parses the live rules of one address family ("iptables" or "ip6tables"); empty if they cannot be read."""
+
+        try:
+            return parse_save(run_command([f"{family}-save"]).stdout or "")
+        except (FileNotFoundError, subprocess.CalledProcessError) as e:
+            self.logger.warning("Could not read the live %s rules (%s); planning against an empty ruleset.", family, e)
+            return {}
+
+    def _reconcile(self, desired: dict) -> dict:
+        """Returns the --noflush restore documents that move each family from its live rules to `desired`."""
+
+        documents = {}
+        for family in ("iptables", "ip6tables"):
+            document = self.reconciler.plan(self.read_live_rules(family), desired.get(family, {}))
+            if document:
+                documents[f"{family}-restore --noflush"] = document
+        return documents
+
+    def _load(self, command: list, document: str) -> bool:
+        """Loads a compiled ruleset document through a single restore process."""
+
+        if self.dry_run:
+            print(f"# {' '.join(command)}\n{document}")
             return True
-        except (IOError, subprocess.CalledProcessError) as e:
-            self.logger.error(f"Failed to backup firewall rules: {e}")
-            return False
-    
+        return self._run_command(command, document)
+
+    def _compiler(self) -> RulesetCompiler:
+        """Returns a compiler bound to the current Tor settings."""
+
+        return RulesetCompiler(self.tor_uid, self.trans_ports, self.dns_ports, self.bypass.load(), self.bypass_set,
+                               self.gateway_interfaces, self.gateway_dns_ports)
+
+    def compile_tor_rules(self) -> dict:
+        """Returns the documents that bring the live firewall to the Tor-only ruleset, keyed by the command that loads them."""
+
+        compiler = self._compiler()
+        if self.backend == "nftables":
+            return {"nft -f -": compiler.compile_nftables()}
+        documents = {"ipset restore -exist": compiler.compile_ipset()} if self.bypass_set else {}
+        documents.update(self._reconcile(compiler.compile_iptables()))
+        return documents
+
     def restore_rules(self) -> bool:
-        """Restores firewall rules from the backup file or resets to a default state."""
-        
-        self.logger.warning("Restoring firewall rules from backup...")
+        """Removes Torsen's chains and their jumps, leaving every other rule on the host as it is."""
 
-        self.logger.info("Flushing all existing IPv4 rules and chains...")
-        self._run_command(["iptables", "-t", "nat", "-F"]) 
-        self._run_command(["iptables", "-F"]) 
+        self.logger.warning("Removing Torsen's firewall rules...")
+        compiler = self._compiler()
 
-        self._run_command(["ip6tables", "-P", "INPUT", "ACCEPT"])
-        self._run_command(["ip6tables", "-P", "FORWARD", "ACCEPT"])
-        self._run_command(["ip6tables", "-P", "OUTPUT", "ACCEPT"])
-        self._run_command(["ip6tables", "-F"])
-        
-        if os.path.exists(self.backup_path_v4):
-            try:
-                with open(self.backup_path_v4, 'r', encoding='utf-8') as f:
-                    subprocess.run(["iptables-restore"], stdin=f, check=True, text=True)
-                os.remove(self.backup_path_v4)
-                self.logger.info("Successfully restored IPv4 rules from backup.")
-            except (IOError, subprocess.CalledProcessError) as e:
-                self.logger.error(f"Could not restore IPv4 rules: {e}")
-        else:
-            self.logger.info("No IPv4 backup file found. Resetting to default ACCEPT policies.")
-            self._run_command(["iptables", "-P", "INPUT", "ACCEPT"])
-            self._run_command(["iptables", "-P", "FORWARD", "ACCEPT"])
-            self._run_command(["iptables", "-P", "OUTPUT", "ACCEPT"])
-        return True
+        if self.backend == "nftables":
+            return self._load(["nft", "-f", "-"], compiler.compile_nftables_restore())
+
+        removed = True
+        for command, document in self._reconcile({}).items():
+            removed = self._load(command.split(), document) and removed
+        if removed and self.bypass_set:
+            self._load(["ipset", "restore"], compiler.compile_ipset_restore())
+        return removed
+
+    def update_bypass(self) -> bool:
+        """Reloads the bypass networks into the live set without touching any chain."""
+
+        if not self.bypass_set:
+            self.logger.error("In-place bypass updates need BYPASS_USE_SET; reconnect to apply the new networks.")
+            return False
+        compiler = self._compiler()
+        self.logger.info("Updating bypass set '%s' with %s networks...", self.bypass_set, len(compiler.bypass_networks))
+        if self.backend == "nftables":
+            return self._load(["nft", "-f", "-"], compiler.compile_nftables_bypass())
+        if not self.dry_run and not self._run_command(["ipset", "list", "-name", self.bypass_set]):
+            self.logger.error("Bypass set is not loaded. Is Torsen connected?")
+            return False
+        return self._load(["ipset", "restore", "-exist"], compiler.compile_ipset())
 
     def apply_tor_rules(self) -> bool:
-        """Applies a strict set of firewall rules to force all traffic through Tor."""
+        """Applies a strict set of firewall rules to force all traffic through Tor, changing only rules that differ."""
         
         self.logger.info("Applying strict Tor-only firewall rules...")
         if not self.tor_uid:
             return False
-        if not self.backup_rules():
-            return False
-    
-        self._run_command(["iptables", "-F"])
-        self._run_command(["iptables", "-t", "nat", "-F"])
-        self._run_command(["iptables", "-t", "nat", "-A", "OUTPUT", "-m", "owner", "--uid-owner", self.tor_uid,"-j", "RETURN"])
-        self._run_command(["iptables", "-t", "nat", "-A", "OUTPUT", "-p", "udp", "--dport", "53", "-j", "REDIRECT", "--to-ports", str(self.dns_port)])
-        self._run_command(["iptables", "-t", "nat", "-A", "PREROUTING", "-i", "lo", "-p", "udp", "--dport", "53", "-j", "REDIRECT", "--to-ports", str(self.dns_port)])
-    
-        for net in self.non_tor_networks.split() + ["127.0.0.0/8"]:
-            self._run_command(["iptables", "-t", "nat", "-A", "OUTPUT", "-d", net, "-j", "RETURN"])
-    
-        self._run_command(["iptables", "-t", "nat", "-A", "OUTPUT", "-p", "tcp", "--syn", "-j", "REDIRECT", "--to-ports", str(self.trans_port)])
-        self._run_command(["iptables", "-F", "OUTPUT"])
-        self._run_command(["iptables", "-A", "OUTPUT", "-m", "state", "--state", "ESTABLISHED,RELATED", "-j", "ACCEPT"])
-    
-        for net in self.non_tor_networks.split() + ["127.0.0.0/8"]:
-            self._run_command(["iptables", "-A", "OUTPUT", "-d", net, "-j", "ACCEPT"])
-    
-        self._run_command(["iptables", "-A", "OUTPUT", "-m", "owner", "--uid-owner", self.tor_uid, "-j", "ACCEPT"])
-        self._run_command(["iptables", "-A", "OUTPUT", "-j", "REJECT"])
-        self._run_command(["ip6tables", "-P", "INPUT", "DROP"])
-        self._run_command(["ip6tables", "-P", "FORWARD", "DROP"])
-        self._run_command(["ip6tables", "-P", "OUTPUT", "DROP"])
-        self._run_command(["ip6tables", "-F"])
-    
+
+        edits = 0
+        for command, document in self.compile_tor_rules().items():
+            if not self._load(command.split(), document):
+                self.logger.error("Ruleset was rejected by '%s'; its remaining changes were not committed.", command)
+                return False
+            if command.endswith("--noflush"):
+                edits += sum(line.startswith("-") for line in document.splitlines())
+
+        if self.backend != "nftables":
+            self.logger.info("Firewall reconciled with %s rule edits.", edits)
         self.logger.info("✅ Strict Tor firewall rules applied. All traffic goes through Tor now.")
         return True
@@ -1,134 +1,175 @@
 import os
 import sys
+import json
 import time
 import signal
-import subprocess
 from config import setting
-from utils.logger import RecordLog
-from stem.control import Controller
-from tor.controller import TorrcManager
-from dns.dns_manager import DNSManager
-from iptables.rules import IptablesManager
-
-is_connected = False
-dns_manager = DNSManager()
-torrc_manager = TorrcManager()
-connection_in_progress = False
-iptables_manager = IptablesManager()
-logger = RecordLog(__name__).get_logger()
-
-
-def run_system_command(command: list, description: str, check_result: bool = True) -> bool:
-    """Executes a system command and logs its description and outcome."""
-    
-    logger.info(description)
-    try:
-        result = subprocess.run(command, capture_output=True, text=True, check=check_result, encoding='utf-8')
-        if result.stdout: logger.debug(f"Stdout: {result.stdout.strip()}")
-        return True
-    except subprocess.CalledProcessError as e:
-        logger.critical(f"Failed to execute '{' '.join(command)}'. Stderr: {e.stderr.strip()}")
-        return False
-    except FileNotFoundError:
-        logger.critical(f"Command '{command[0]}' not found. Is it in your PATH?")
-        return False
 
-def cleanup(signum=None, frame=None):
-    """Restores all system configurations to their original state and exits."""
-    
-    global is_connected, connection_in_progress
-    if not is_connected and not connection_in_progress:
-        if signum is not None:
-             sys.exit(0)
-        return
+# Everything below is built on first use, so 'status', 'disconnect' and the usage text do not
+# pay for stem, asyncio or coloredlogs imports they never touch.
+connection = None
+logger = None
 
-    if is_connected: logger.warning("--- Cleanup Process Initiated ---")
-    connection_in_progress = False
+USAGE = "[connect|disconnect|suspend|resume|status|stats|newnym|daemon|ruleset|bridges probe|bypass reload|reload [Option=Value ...]|bench [--help]]"
+DISCONNECT_TIMEOUT = 60  # Seconds to wait for the running connection to finish its cleanup
+DAEMON_COMMANDS = ["connect", "disconnect", "suspend", "resume", "status", "stats", "newnym", "reload"]
 
-    script_path = os.path.join(os.path.dirname(__file__), 'config', 'bash.sh')
 
-    logger.info("Step 1: Stopping Tor service via bash.sh...")
-    run_system_command([script_path, "stop"], "Executing bash shutdown script for Tor service")
+def get_connection():
+    """Returns the process-wide ConnectionManager, creating it on first use."""
 
-    logger.info("Step 2: Restoring firewall rules...")
-    if not iptables_manager.restore_rules():
-        logger.critical("Failed to restore iptables. Manual intervention may be required!")
+    global connection
+    if connection is None:
+        from core.connection import ConnectionManager
+        connection = ConnectionManager()
+    return connection
 
-    logger.info("Step 3: Restoring Tor configuration...")
-    if not torrc_manager.restore_torrc(setting.SYSTEM_TORRC_PATH):
-        logger.critical("Failed to restore original torrc. Manual intervention may be required!")
-    
-    logger.info("Step 4: Releasing control of DNS...")
-    if not dns_manager.release_control():
-        logger.critical("Failed to restore DNS. Manual intervention may be required!")
+def get_logger():
+    """Returns the module logger, configuring logging on first use."""
 
-    logger.info("✅ System connectivity restored. Tor service is stopped.")
-    is_connected = False
-    sys.exit(0)
+    global logger
+    if logger is None:
+        from utils.logger import RecordLog
+        logger = RecordLog(__name__).get_logger()
+    return logger
 
-def wait_for_tor_bootstrap():
-    """Waits for the Tor service to fully connect to the network."""
-    
-    logger.info("Connecting to Tor Control Port to check bootstrap status...")
-    start_time = time.time()
+def require_root():
+    """Exits unless the script runs as root."""
 
-    while time.time() - start_time < setting.TOR_BOOTSTRAP_TIMEOUT:
-        try:
-            with Controller.from_port(port=setting.TOR_CONTROL_PORT) as controller:
-                controller.authenticate()
-                bootstrap_status = controller.get_info("status/bootstrap-phase")
-                
-                if "PROGRESS=" in bootstrap_status:
-                    progress = int(bootstrap_status.split("PROGRESS=")[1].split(" ")[0])
-                    logger.info(f"Tor bootstrap progress: {progress}%")
+    if os.geteuid() != 0:
+        get_logger().critical("This script must be run as root.")
+        sys.exit(1)
 
-                    if progress == 100:
-                        logger.info("✅ Tor has successfully bootstrapped.")
-                        return True
-                else:
-                    logger.debug(f"Tor status available, waiting for progress report. Status: {bootstrap_status}")
+def cleanup(signum=None, frame=None):
+    """Restores all system configurations to their original state and exits."""
 
-        except Exception as e:
-            logger.debug(f"Could not connect to Tor Control Port yet, waiting... Error: {e}")
+    if connection is None or (not connection.is_connected and not connection.connection_in_progress):
+        if signum is not None:
+             sys.exit(0)
+        return
 
-        time.sleep(2)
+    connection.disconnect()
+    if os.path.exists(setting.TORSEN_PID_PATH): os.remove(setting.TORSEN_PID_PATH)
+    sys.exit(0)
 
-    logger.critical("Tor bootstrap timed out. Could not connect to the Tor network.")
-    return False
+def suspend(signum=None, frame=None):
+    """Signal handler that suspends routing in the running 'connect' process."""
 
-def connect():
-    """Orchestrates the entire process of establishing a secure, system-wide Tor connection."""
-    
-    global is_connected, connection_in_progress
-    if os.geteuid() != 0:
-        logger.critical("This script must be run as root.")
-        sys.exit(1)
+    get_connection().suspend()
 
-    connection_in_progress = True
-    logger.info("--- Starting Secure Connection Process ---")
+def resume(signum=None, frame=None):
+    """Signal handler that resumes routing in the running 'connect' process."""
 
-    if not dns_manager.take_control():
-        logger.critical("Failed to take control of DNS. Aborting and cleaning up.")
-        cleanup()
+    get_connection().resume()
+
+def running_instance() -> int | None:
+    """Returns the pid of the running 'connect' process recorded in the pid file, if it is still alive."""
 
-    if not torrc_manager.backup_torrc(setting.SYSTEM_TORRC_PATH) or \
-       not torrc_manager.apply_template(setting.SYSTEM_TORRC_PATH):
-        logger.critical("Failed to configure torrc. Aborting and cleaning up.")
+    try:
+        with open(setting.TORSEN_PID_PATH, 'r', encoding='utf-8') as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (IOError, ValueError, ProcessLookupError, PermissionError):
+        return None
+
+def signal_running_instance(signum: int) -> bool:
+    """Sends a signal to the running 'connect' process recorded in the pid file."""
+
+    pid = running_instance()
+    if pid is None:
+        get_logger().critical("No running Torsen connection to signal.")
+        return False
+    os.kill(pid, signum)
+    return True
+
+def disconnect():
+    """Asks the running 'connect' process to clean up after itself, or cleans up locally if there is none."""
+
+    get_logger().info("Disconnect command received.")
+    pid = running_instance()
+    if pid is None:
+        # Nothing owns the connection any more; restore whatever a crashed run left behind.
+        get_connection().is_connected = True
+        connection.connection_in_progress = True
         cleanup()
+        return
 
-    script_path = os.path.join(os.path.dirname(__file__), 'config', 'bash.sh')
-    run_system_command([script_path, "start"], "Executing bash startup script for Tor service", check_result=False)
+    # The running process knows whether it is suspended and what it still has to restore.
+    os.kill(pid, signal.SIGTERM)
+    deadline = time.monotonic() + DISCONNECT_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            get_logger().info("Torsen connection %s has disconnected.", pid)
+            return
+        time.sleep(0.1)
+    get_logger().critical("Torsen connection %s is still cleaning up after %ss.", pid, DISCONNECT_TIMEOUT)
+    sys.exit(1)
+
+def stats():
+    """Prints the metrics of the running connection, scraped from its exporter; this process has none of its own."""
+
+    if setting.METRICS_ENABLED:
+        from urllib.request import urlopen
+        url = f"http://{setting.METRICS_ADDRESS}:{setting.METRICS_PORT}/metrics"
+        try:
+            with urlopen(url, timeout=5) as response:
+                print(response.read().decode('utf-8'), end="")
+            return
+        except OSError as e:
+            get_logger().debug("Metrics exporter at %s is not answering: %s", url, e)
+    get_logger().critical("No running daemon or exporter to read metrics from.")
+    sys.exit(1)
+
+def parse_overrides(arguments: list) -> dict:
+    """Parses 'Option=Value' command-line arguments into torrc overrides."""
+
+    overrides = {}
+    for argument in arguments:
+        key, sep, value = argument.partition("=")
+        if not sep:
+            print(f"Invalid override '{argument}', expected Option=Value.")
+            sys.exit(1)
+        overrides.setdefault(key, []).append(value)
+    return overrides
+
+def forward_to_daemon(command: str, arguments: list) -> bool:
+    """Sends the command to a running daemon, if there is one, and prints its reply."""
+
+    if not os.path.exists(setting.DAEMON_SOCKET_PATH):
+        return False
+    from daemon.client import send_command
 
-    if not wait_for_tor_bootstrap():
-        cleanup()
+    options = parse_overrides(arguments) if command == "reload" else None
+    try:
+        response = send_command(command, options=options)
+    except OSError as e:
+        get_logger().warning("Daemon socket present but not answering (%s); running the command locally.", e)
+        return False
+    except ValueError as e:
+        # The daemon took the request, so running it again locally could race whatever it already did.
+        get_logger().critical("Daemon sent no valid reply to '%s': %s", command, e)
+        sys.exit(1)
+    if command == "stats" and "metrics" in response:
+        print(response["metrics"], end="")
+    else:
+        print(json.dumps(response, indent=2))
+    sys.exit(0 if response.get("ok") else 1)
 
-    if not iptables_manager.apply_tor_rules():
-        logger.critical("Failed to apply firewall rules. Aborting and cleaning up.")
-        cleanup()
+def connect():
+    """Orchestrates the entire process of establishing a secure, system-wide Tor connection."""
+
+    require_root()
+    if setting.METRICS_ENABLED:
+        from utils.metrics import MetricsServer
+        MetricsServer().start()
+    if not get_connection().connect():
+        sys.exit(1)
 
-    is_connected = True
-    connection_in_progress = False
-    logger.info("✅ System traffic is now securely routed through Tor.")
+    with open(setting.TORSEN_PID_PATH, 'w', encoding='utf-8') as f:
+        f.write(f"{os.getpid()}\n")
     print("\nConnection is active. Press Ctrl+C to disconnect and restore settings.")
 
     try:
@@ -138,24 +179,64 @@ def connect():
 
 def main():
     """The main entry point for the script."""
-    
+
     signal.signal(signal.SIGINT, cleanup)
     signal.signal(signal.SIGTERM, cleanup)
+    signal.signal(signal.SIGUSR1, suspend)
+    signal.signal(signal.SIGUSR2, resume)
+
+    if sys.argv[1:] == ["bridges", "probe"]:
+        from tor.bridges import BridgeProber
+        for result in BridgeProber().probe():
+            latency = f"{result['latency'] * 1000:.0f}ms" if result["latency"] is not None else "unreachable"
+            print(f"{latency:>12}  {result['bridge']}")
+        return
+
+    if sys.argv[1:2] == ["bench"]:
+        from bench.datapath import main as bench
+        bench(sys.argv[2:])
 
-    if len(sys.argv) != 2 or sys.argv[1] not in ["connect", "disconnect"]:
-        print(f"Usage: sudo python3 {sys.argv[0]} [connect|disconnect]")
+    if sys.argv[1:] == ["bypass", "reload"]:
+        require_root()
+        sys.exit(0 if get_connection().iptables_manager.update_bypass() else 1)
+
+    if len(sys.argv) < 2 or (sys.argv[1] != "reload" and len(sys.argv) != 2) or \
+       sys.argv[1] not in DAEMON_COMMANDS + ["daemon", "ruleset"]:
+        print(f"Usage: sudo python3 {sys.argv[0]} {USAGE}")
         sys.exit(1)
 
     command = sys.argv[1]
+    if command in DAEMON_COMMANDS:
+        forward_to_daemon(command, sys.argv[2:])
 
     if command == "connect":
         connect()
     elif command == "disconnect":
-        logger.info("Disconnect command received.")
-        global is_connected, connection_in_progress
-        is_connected = True
-        connection_in_progress = True
-        cleanup()
+        disconnect()
+    elif command == "suspend":
+        sys.exit(0 if signal_running_instance(signal.SIGUSR1) else 1)
+    elif command == "resume":
+        sys.exit(0 if signal_running_instance(signal.SIGUSR2) else 1)
+    elif command == "status":
+        running = os.path.exists(setting.TORSEN_PID_PATH)
+        print(json.dumps({"ok": True, "status": {"connected": running, "daemon": False}}, indent=2))
+    elif command == "stats":
+        stats()
+    elif command == "newnym":
+        sys.exit(0 if get_connection().newnym() else 1)
+    elif command == "reload":
+        if not get_connection().reload(parse_overrides(sys.argv[2:])):
+            sys.exit(1)
+    elif command == "daemon":
+        require_root()
+        from daemon.supervisor import TorsenDaemon
+        from utils.metrics import MetricsServer
+        if setting.METRICS_ENABLED:
+            MetricsServer().start()
+        TorsenDaemon(get_connection()).run()
+    elif command == "ruleset":
+        for loader, document in get_connection().iptables_manager.compile_tor_rules().items():
+            print(f"# {loader}\n{document}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,286 @@
+import time
+import socket
+import struct
+import threading
+from stem import CircStatus, StreamStatus
+from config import setting
+from utils.logger import RecordLog
+from utils.metrics import registry
+from stem.control import EventType
+
+ATTACHED_STREAMS = registry.counter("torsen_attached_streams_total", "Streams attached by Torsen, by where their circuit came from.", ("source",))
+POOLED_CIRCUITS = registry.gauge("torsen_pooled_circuits", "Pre-built circuits waiting for a stream.")
+
+
+def socket_owner(address: str, port: int, table: str = "/proc/net/tcp") -> int | None:
+    """Returns the uid of the local IPv4 TCP socket bound to address:port, read from /proc/net/tcp."""
+
+    try:
+        # The kernel prints the address as a host-order integer.
+        wanted = "%08X:%04X" % (struct.unpack("=I", socket.inet_aton(address))[0], port)
+    except OSError:
+        return None
+    try:
+        with open(table, 'r', encoding='utf-8') as f:
+            next(f, None)
+            for line in f:
+                fields = line.split()
+                if len(fields) > 7 and fields[1] == wanted:
+                    return int(fields[7])
+    except IOError:
+        pass
+    return None
+
+
+class StreamAttacher:
+    """Attaches tor's streams itself, from a pool of circuits built ahead of time.
+
+    With __LeaveStreamsUnattached set, tor hands every new stream to the controller. Each
+    stream gets an isolation key (its destination, the uid of the local process, or nothing);
+    streams with the same key share one circuit until ATTACHER_CIRCUIT_LIFETIME expires, and a
+    new key takes the pooled circuit whose exit has answered fastest so far. When the pool is
+    empty the stream goes back to tor, which picks a circuit as it normally would.
+    """
+
+    def __init__(self, session):
+        """Initializes the StreamAttacher."""
+
+        self.session = session
+        self.pool = []
+        self.assigned = {}
+        self.counts = {"pool": 0, "assigned": 0, "tor": 0}
+        self.isolation = setting.ATTACHER_ISOLATION
+        self._launched = {}
+        self._exits = {}
+        self._circuit_exit = {}
+        self._streams = {}
+        self._stop = threading.Event()
+        self._refill = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+
+    def start(self) -> bool:
+        """Takes over stream attachment and starts filling the circuit pool."""
+
+        if not self.session.is_alive():
+            self.logger.error("Cannot start the stream attacher without a control session.")
+            return False
+        controller = self.session.controller
+        controller.add_event_listener(self._on_circ, EventType.CIRC)
+        controller.add_event_listener(self._on_stream, EventType.STREAM)
+        controller.add_event_listener(self._on_stream_bw, EventType.STREAM_BW)
+        controller.add_event_listener(self._on_signal, EventType.SIGNAL)
+        try:
+            controller.set_conf("__LeaveStreamsUnattached", "1")
+        except Exception as e:
+            self.logger.error("Tor refused __LeaveStreamsUnattached: %s", e)
+            self.stop()
+            return False
+
+        self._stop.clear()
+        self._refill.set()
+        self._thread = threading.Thread(target=self._refill_loop, name="stream-attacher", daemon=True)
+        self._thread.start()
+        self.logger.info("Stream attacher started (%s isolation, pool of %s circuits).", self.isolation, setting.ATTACHER_POOL_SIZE)
+        return True
+
+    def stop(self):
+        """Hands stream attachment back to tor and stops refilling the pool."""
+
+        self._stop.set()
+        self._refill.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if not self.session.is_alive():
+            return
+        controller = self.session.controller
+        try:
+            controller.reset_conf("__LeaveStreamsUnattached")
+        except Exception as e:
+            self.logger.error("Could not hand stream attachment back to tor: %s", e)
+        for listener in (self._on_circ, self._on_stream, self._on_stream_bw, self._on_signal):
+            controller.remove_event_listener(listener)
+
+    def _exit_latency(self, circuit_id: str) -> float:
+        """Returns the smoothed latency measured through a circuit's exit, or 0 for unmeasured exits."""
+
+        return self._exits.get(self._circuit_exit.get(circuit_id), 0.0)
+
+    def _measure(self, exit_fingerprint: str, seconds: float):
+        """Folds one latency sample into the exit's moving average."""
+
+        if exit_fingerprint is None:
+            return
+        previous = self._exits.get(exit_fingerprint)
+        self._exits[exit_fingerprint] = seconds if previous is None else 0.7 * previous + 0.3 * seconds
+
+    def _refill_loop(self):
+        """Launches circuits whenever the pool and the builds in flight fall below ATTACHER_POOL_SIZE."""
+
+        while not self._stop.is_set():
+            self._refill.wait(setting.ATTACHER_REFILL_INTERVAL)
+            self._refill.clear()
+            if self._stop.is_set():
+                return
+            with self._lock:
+                missing = setting.ATTACHER_POOL_SIZE - len(self.pool) - len(self._launched)
+            for _ in range(max(missing, 0)):
+                try:
+                    circuit_id = self.session.controller.new_circuit(await_build=False)
+                except Exception as e:
+                    self.logger.debug("Could not launch a pool circuit: %s", e)
+                    break
+                with self._lock:
+                    self._launched.setdefault(circuit_id, time.monotonic())
+
+    def _drop(self, circuit_id: str):
+        """Forgets a circuit that closed or failed; the caller holds the lock."""
+
+        self._launched.pop(circuit_id, None)
+        self._circuit_exit.pop(circuit_id, None)
+        if circuit_id in self.pool:
+            self.pool.remove(circuit_id)
+        for key in [key for key, (assigned, _) in self.assigned.items() if assigned == circuit_id]:
+            del self.assigned[key]
+
+    def _on_circ(self, event):
+        """Moves built circuits into the pool, closing those that built, or whose exit answers, slower than ATTACHER_MAX_LATENCY."""
+
+        close = None
+        with self._lock:
+            if event.status == CircStatus.BUILT and event.id in self._launched:
+                seconds = time.monotonic() - self._launched.pop(event.id)
+                exit_fingerprint = event.path[-1][0] if event.path else None
+                self._circuit_exit[event.id] = exit_fingerprint
+                self._measure(exit_fingerprint, seconds)
+                if max(seconds, self._exit_latency(event.id)) > setting.ATTACHER_MAX_LATENCY:
+                    close = event.id
+                    self._circuit_exit.pop(event.id, None)
+                else:
+                    self.pool.append(event.id)
+                    self.pool.sort(key=self._exit_latency)
+            elif event.status in (CircStatus.FAILED, CircStatus.CLOSED):
+                self._drop(event.id)
+            else:
+                return
+            POOLED_CIRCUITS.set(len(self.pool))
+        if close is None:
+            self._refill.set()
+        else:
+            # The replacement waits for the next refill round, so a slow network is not flooded with builds.
+            self.logger.debug("Closing slow pool circuit %s.", close)
+            try:
+                self.session.controller.close_circuit(close)
+            except Exception as e:
+                self.logger.debug("Could not close circuit %s: %s", close, e)
+
+    def isolation_key(self, event) -> str:
+        """Returns the key of streams that may share a circuit with this one."""
+
+        if self.isolation == "destination":
+            return f"dst:{event.target_address}"
+        if self.isolation == "uid":
+            uid = socket_owner(event.source_address, event.source_port) if event.source_address and event.source_port else None
+            return f"uid:{uid}"
+        return "any"
+
+    def choose(self, key: str) -> tuple:
+        """Returns (circuit id, source) for a new stream: its key's circuit, a pooled one, or '0' for tor to pick."""
+
+        now = time.monotonic()
+        with self._lock:
+            if key in self.assigned:
+                circuit_id, since = self.assigned[key]
+                if now - since < setting.ATTACHER_CIRCUIT_LIFETIME:
+                    return circuit_id, "assigned"
+                del self.assigned[key]
+            if not self.pool:
+                return "0", "tor"
+            circuit_id = self.pool.pop(0)
+            self.assigned[key] = (circuit_id, now)
+            POOLED_CIRCUITS.set(len(self.pool))
+        self._refill.set()
+        return circuit_id, "pool"
+
+    def _release(self, key: str, circuit_id: str, source: str):
+        """Undoes a choice whose attach failed, putting a freshly taken pool circuit back in front."""
+
+        with self._lock:
+            if self.assigned.get(key, (None,))[0] == circuit_id:
+                del self.assigned[key]
+            if source == "pool":
+                self.pool.insert(0, circuit_id)
+                POOLED_CIRCUITS.set(len(self.pool))
+
+    def _on_stream(self, event):
+        """Attaches new and detached streams and tracks when they started for the exit latency samples."""
+
+        if event.status in (StreamStatus.CLOSED, StreamStatus.FAILED):
+            with self._lock:
+                self._streams.pop(event.id, None)
+            return
+        if event.status not in (StreamStatus.NEW, StreamStatus.NEWRESOLVE, StreamStatus.DETACHED):
+            return
+
+        key = self.isolation_key(event)
+        if event.status == StreamStatus.DETACHED:
+            # Tor detaches a stream when its circuit failed it; never hand that circuit out again for this key.
+            with self._lock:
+                if self.assigned.get(key, (None,))[0] == event.circ_id:
+                    del self.assigned[key]
+        # Onion services need rendezvous circuits that only tor can build.
+        onion = (event.target_address or "").endswith(".onion")
+        circuit_id, source = ("0", "tor") if onion else self.choose(key)
+        try:
+            self.session.controller.attach_stream(event.id, circuit_id)
+        except Exception as e:
+            # Usually the exit's policy rejects this port; the circuit stays good for other streams.
+            self.logger.debug("Could not attach stream %s to circuit %s (%s); letting tor choose.", event.id, circuit_id, e)
+            self._release(key, circuit_id, source)
+            circuit_id, source = "0", "tor"
+            try:
+                self.session.controller.attach_stream(event.id, circuit_id)
+            except Exception as e:
+                self.logger.error("Could not attach stream %s: %s", event.id, e)
+                return
+        with self._lock:
+            self.counts[source] += 1
+            if circuit_id != "0":
+                self._streams[event.id] = (time.monotonic(), circuit_id)
+        ATTACHED_STREAMS.inc(source=source)
+
+    def _on_stream_bw(self, event):
+        """Uses a stream's time to first byte as a latency sample for its circuit's exit."""
+
+        if event.read <= 0:
+            return
+        with self._lock:
+            started = self._streams.pop(event.id, None)
+            if started is not None:
+                self._measure(self._circuit_exit.get(started[1]), time.monotonic() - started[0])
+
+    def _on_signal(self, event):
+        """Forgets every pooled and assigned circuit after NEWNYM, so no stream reuses an old identity."""
+
+        if event.signal != "NEWNYM":
+            return
+        with self._lock:
+            self.pool.clear()
+            self.assigned.clear()
+            self._launched.clear()
+            POOLED_CIRCUITS.set(0)
+        self._refill.set()
+
+    def snapshot(self) -> dict:
+        """Returns the pool size, isolation mode and attach counts."""
+
+        with self._lock:
+            return {
+                "isolation": self.isolation,
+                "pooled": len(self.pool),
+                "building": len(self._launched),
+                "isolation_keys": len(self.assigned),
+                "attached": dict(self.counts),
+            }
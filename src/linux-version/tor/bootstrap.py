@@ -0,0 +1,99 @@
+import time
+import threading
+from utils.logger import RecordLog
+from utils.metrics import registry
+from stem.control import EventType
+
+PHASE_SECONDS = registry.gauge("torsen_bootstrap_phase_seconds", "Seconds from the start of tracking until each bootstrap phase.", ("tag",))
+BOOTSTRAP_SECONDS = registry.histogram("torsen_bootstrap_seconds", "Time to a full bootstrap, by how warm tor's directory cache was.", ("cache",),
+                                       buckets=(1, 2.5, 5, 10, 20, 30, 60, 120))
+
+
+class BootstrapTracker:
+    """Follows Tor's bootstrap through STATUS_CLIENT events on a persistent control session."""
+
+    def __init__(self, session, cache: str = "unknown"):
+        """Initializes the BootstrapTracker."""
+
+        self.cache = cache
+        self.phases = []
+        self.progress = 0
+        self.session = session
+        self.started_at = None
+        self._done = threading.Event()
+        self._cancelled = False
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+
+    def _record(self, progress: int, tag: str, summary: str):
+        """Records a bootstrap phase with its arrival timestamp and wakes waiters on completion."""
+
+        if progress <= self.progress and self.phases:
+            return
+        self.progress = progress
+        self.phases.append({"progress": progress, "tag": tag, "summary": summary, "timestamp": time.time()})
+        if self.started_at is not None:
+            PHASE_SECONDS.set(round(self.phases[-1]["timestamp"] - self.started_at, 3), tag=tag)
+        self.logger.info("Tor bootstrap progress: %s%% (%s)", progress, tag)
+        if progress == 100:
+            self._done.set()
+
+    def _on_status(self, event):
+        """Handles STATUS_CLIENT events, keeping only BOOTSTRAP notifications."""
+
+        if event.action != "BOOTSTRAP":
+            return
+        try:
+            progress = int(event.arguments.get("PROGRESS", 0))
+        except ValueError:
+            return
+        self._record(progress, event.arguments.get("TAG", ""), event.arguments.get("SUMMARY", ""))
+
+    def _poll_current_phase(self):
+        """Reads the current phase once, covering progress made before the subscription existed."""
+
+        try:
+            status = self.session.controller.get_info("status/bootstrap-phase")
+        except Exception as e:
+            self.logger.debug("Could not read bootstrap phase: %s", e)
+            return
+        fields = dict(field.split("=", 1) for field in status.split() if "=" in field)
+        if "PROGRESS" in fields:
+            self._record(int(fields["PROGRESS"]), fields.get("TAG", ""), fields.get("SUMMARY", "").strip('"'))
+
+    def wait(self, timeout: float) -> bool:
+        """Blocks until Tor reports PROGRESS=100 or the timeout expires."""
+
+        self.logger.info("Connecting to Tor Control Port to track bootstrap status...")
+        self.started_at = time.time()
+        deadline = time.monotonic() + timeout
+        if not self.session.open(timeout):
+            return False
+
+        controller = self.session.controller
+        controller.add_event_listener(self._on_status, EventType.STATUS_CLIENT)
+        try:
+            self._poll_current_phase()
+            if not self._done.wait(max(deadline - time.monotonic(), 0)):
+                self.logger.critical("Tor bootstrap timed out. Could not connect to the Tor network.")
+                return False
+            if self._cancelled:
+                return False
+        finally:
+            controller.remove_event_listener(self._on_status)
+
+        BOOTSTRAP_SECONDS.observe(self.elapsed(), cache=self.cache)
+        self.logger.info("✅ Tor has successfully bootstrapped in %.2fs (%s cache).", self.elapsed(), self.cache)
+        return True
+
+    def cancel(self):
+        """Makes a pending wait() return False right away."""
+
+        self._cancelled = True
+        self._done.set()
+
+    def elapsed(self) -> float:
+        """Returns seconds between the start of tracking and the last recorded phase."""
+
+        if self.started_at is None or not self.phases:
+            return 0.0
+        return self.phases[-1]["timestamp"] - self.started_at
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import asyncio
+from config import setting
+from utils.logger import RecordLog
+
+
+class BridgeProber:
+    """Measures TCP connect latency to a pool of bridges and picks the fastest reachable ones."""
+
+    def __init__(self):
+        """Initializes the BridgeProber."""
+
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+        self.timeout = setting.BRIDGE_PROBE_TIMEOUT
+        self.cache_ttl = setting.BRIDGE_CACHE_TTL
+        self.concurrency = setting.BRIDGE_PROBE_CONCURRENCY
+        self.pool_path = os.path.join(os.path.dirname(__file__), '..', 'config', setting.BRIDGE_POOL_FILENAME)
+        self.cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), setting.BRIDGE_CACHE_FILENAME)
+
+    @staticmethod
+    def _parse_address(line: str) -> tuple | None:
+        """Extracts (host, port) from a bridge line such as 'obfs4 1.2.3.4:443 FINGERPRINT cert=...'."""
+
+        for field in line.split()[:2]:
+            host, sep, port = field.rpartition(":")
+            if sep and port.isdigit():
+                return host.strip("[]"), int(port)
+        return None
+
+    def load_pool(self) -> list:
+        """Reads bridge lines from the pool file, skipping blanks and comments."""
+
+        if not os.path.exists(self.pool_path):
+            self.logger.warning("Bridge pool file not found at '%s'.", self.pool_path)
+            return []
+
+        bridges = []
+        with open(self.pool_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("Bridge "):
+                    line = line[len("Bridge "):]
+                if self._parse_address(line) is None:
+                    self.logger.warning("Skipping malformed bridge line: '%s'", line)
+                    continue
+                bridges.append(line)
+        return bridges
+
+    async def _probe_one(self, bridge: str, semaphore: asyncio.Semaphore) -> dict:
+        """Opens one TCP connection to a bridge and reports its latency, or None when unreachable."""
+
+        host, port = self._parse_address(bridge)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.logger.debug("Bridge %s:%s unreachable: %r", host, port, e)
+                return {"bridge": bridge, "latency": None}
+            latency = time.perf_counter() - start
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+        return {"bridge": bridge, "latency": latency}
+
+    async def _probe_all(self, bridges: list) -> list:
+        """Probes every bridge concurrently, bounded by the configured concurrency."""
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*(self._probe_one(bridge, semaphore) for bridge in bridges))
+
+    def probe(self) -> list:
+        """Probes the whole pool, caches the results and returns them sorted fastest first."""
+
+        bridges = self.load_pool()
+        if not bridges:
+            return []
+
+        self.logger.info("Probing %s bridges (timeout %ss)...", len(bridges), self.timeout)
+        results = asyncio.run(self._probe_all(bridges))
+        results.sort(key=lambda r: (r["latency"] is None, r["latency"] or 0))
+
+        reachable = sum(1 for r in results if r["latency"] is not None)
+        self.logger.info("%s/%s bridges reachable.", reachable, len(results))
+        try:
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump({"probed_at": time.time(), "results": results}, f, indent=2)
+        except (IOError, PermissionError) as e:
+            self.logger.warning("Could not write bridge cache: %s", e)
+        return results
+
+    def cached_results(self, fresh: bool = True) -> list | None:
+        """Returns cached probe results of the current pool, if they are younger than the TTL or `fresh` is False."""
+
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            return None
+        probed_at = cache.get("probed_at", 0)
+        if fresh and time.time() - probed_at > self.cache_ttl:
+            return None
+        if os.path.exists(self.pool_path) and os.path.getmtime(self.pool_path) > probed_at:
+            return None
+        return cache.get("results")
+
+    def fastest(self, count: int = None, probe: bool = True) -> list:
+        """Returns the N fastest reachable bridge lines, probing only when the cache is stale and `probe` allows it.
+
+        Without probing, the last results are used however old they are, or the pool's own order if there are none.
+        """
+
+        count = count or setting.BRIDGE_COUNT
+        if probe:
+            results = self.cached_results()
+            if results is None:
+                results = self.probe()
+        else:
+            results = self.cached_results(fresh=False)
+            if results is None:
+                self.logger.info("Not probing bridges; using the configured order.")
+                return self.load_pool()[:count]
+        return [r["bridge"] for r in results if r["latency"] is not None][:count]
@@ -0,0 +1,65 @@
+import time
+import threading
+from config import setting
+from utils.logger import RecordLog
+
+
+class ControlSession:
+    """Holds one long-lived, authenticated connection to the Tor control port."""
+
+    def __init__(self, port: int = None):
+        """Initializes the ControlSession."""
+
+        self.controller = None
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self.port = port or setting.TOR_CONTROL_PORT
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+
+    def open(self, timeout: float = None) -> bool:
+        """Connects and authenticates, retrying until the control port accepts or the timeout expires."""
+
+        from stem.control import Controller
+
+        timeout = setting.TOR_BOOTSTRAP_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        self._closing.clear()
+
+        with self._lock:
+            if self.controller is not None and self.controller.is_alive():
+                return True
+
+            while True:
+                controller = None
+                try:
+                    controller = Controller.from_port(port=self.port)
+                    controller.authenticate()
+                    self.controller = controller
+                    self.logger.info("Control session established on port %s.", self.port)
+                    return True
+                except Exception as e:
+                    # Connected but not authenticated: close the socket instead of leaking one per retry.
+                    if controller is not None:
+                        controller.close()
+                    if time.monotonic() >= deadline:
+                        self.logger.error("Could not open a control session on port %s: %s", self.port, e)
+                        return False
+                    self.logger.debug("Control port not ready yet, retrying... Error: %s", e)
+                    if self._closing.wait(setting.TOR_CONTROL_RETRY_INTERVAL):
+                        self.logger.debug("Stopped waiting for the control port on %s: session closed.", self.port)
+                        return False
+
+    def is_alive(self) -> bool:
+        """Returns True if the control connection is open."""
+
+        return self.controller is not None and self.controller.is_alive()
+
+    def close(self):
+        """Closes the control connection, if any, and stops a concurrent open() from retrying."""
+
+        self._closing.set()
+        with self._lock:
+            if self.controller is not None:
+                self.controller.close()
+                self.controller = None
+                self.logger.info("Control session closed.")
@@ -1,11 +1,15 @@
 import os
 import shutil
+from string import Template
+from config import setting
 from utils.logger import RecordLog
 
 
 class TorrcManager:
     """Manages the system's torrc configuration file."""
 
+    END_MARKER = "## --- End Custom Configuration ---"
+
     def __init__(self):
         """Initializes the TorrcManager."""
 
@@ -16,7 +20,7 @@ class TorrcManager:
     def backup_torrc(self, system_torrc_path: str) -> bool:
         """Backs up the system's current torrc file."""
         
-        self.logger.info(f"Backing up '{system_torrc_path}' to '{self.backup_path}'")
+        self.logger.info("Backing up '%s' to '%s'", system_torrc_path, self.backup_path)
         try:
             if not os.path.exists(system_torrc_path):
                 self.logger.warning("Original torrc not found. Creating a blank backup.")
@@ -26,29 +30,126 @@ class TorrcManager:
             self.logger.info("Backup successful.")
             return True
         except (PermissionError, IOError) as e:
-            self.logger.error(f"Error during backup: {e}", exc_info=True)
+            self.logger.error("Error during backup: %s", e, exc_info=True)
             return False
 
-    def apply_template(self, system_torrc_path: str) -> bool:
-        """Replaces the system torrc file with the custom template."""
+    @staticmethod
+    def parse(text: str) -> dict:
+        """Parses torrc text into an ordered mapping of option -> list of values."""
+
+        options = {}
+        for line in text.splitlines():
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            key, _, value = line.partition(" ")
+            options.setdefault(key, []).append(value.strip())
+        return options
+
+    def render(self, overrides: dict | None = None) -> str:
+        """Renders the template from settings, then applies option overrides (exit nodes, bridges, ports)."""
+
+        with open(self.template_path, 'r', encoding='utf-8') as f:
+            text = Template(f.read()).safe_substitute(
+                tor_user=setting.TOR_USER,
+                data_directory=setting.TOR_DATA_DIRECTORY,
+                control_port=setting.TOR_CONTROL_PORT,
+                trans_port=setting.TOR_TRANSPARENT_PORT,
+                dns_port=setting.TOR_DNS_PORT,
+                exit_nodes=setting.TOR_EXIT_NODES,
+            )
+        if not overrides:
+            return text
+
+        overridden = {key.lower() for key in overrides}
+        lines = [line for line in text.splitlines()
+                 if line.split("#", 1)[0].strip().partition(" ")[0].lower() not in overridden]
+
+        extra = []
+        for key, values in overrides.items():
+            if values is None:
+                continue
+            for value in [values] if isinstance(values, str) else values:
+                extra.append(f"{key} {value}")
+
+        if self.END_MARKER in lines:
+            index = lines.index(self.END_MARKER)
+            lines[index:index] = extra + [""]
+        else:
+            lines += extra
+        return "\n".join(lines) + "\n"
+
+    def apply_template(self, system_torrc_path: str, overrides: dict | None = None) -> bool:
+        """Renders the template with the given overrides and writes it over the system torrc file."""
         
-        self.logger.info(f"Replacing '{system_torrc_path}' with template '{self.template_path}'")
+        self.logger.info("Rendering '%s' into '%s'", self.template_path, system_torrc_path)
         try:
             if not os.path.exists(self.template_path):
-                self.logger.error(f"Template file not found at '{self.template_path}'.")
+                self.logger.error("Template file not found at '%s'.", self.template_path)
                 return False
             
-            shutil.copy(self.template_path, system_torrc_path)
+            with open(system_torrc_path, 'w', encoding='utf-8') as f:
+                f.write(self.render(overrides))
+            if overrides:
+                self.logger.info("Applied overrides for: %s.", ', '.join(overrides))
             self.logger.info("Template successfully replaced the main torrc file.")
             return True
         except (PermissionError, IOError) as e:
-            self.logger.error(f"Error applying template: {e}", exc_info=True)
+            self.logger.error("Error applying template: %s", e, exc_info=True)
             return False
 
+    def reconfigure(self, controller, system_torrc_path: str, overrides: dict | None = None) -> set | None:
+        """Applies only the changed options to the running tor over the control port.
+
+        Returns the set of changed options that tor cannot take while running (the caller
+        restarts tor for those), or None if the new configuration could not be applied.
+        """
+
+        try:
+            with open(system_torrc_path, 'r', encoding='utf-8') as f:
+                previous = self.parse(f.read())
+        except (IOError, PermissionError):
+            previous = {}
+
+        desired = self.parse(self.render(overrides))
+        keys = list(desired) + [key for key in previous if key.lower() not in {k.lower() for k in desired}]
+        try:
+            running = controller.get_conf_map(keys, multiple=True)
+        except Exception as e:
+            self.logger.error("Could not read the running configuration: %s", e)
+            return None
+
+        running = {key.lower(): values for key, values in running.items()}
+        changed = {key: desired.get(key) for key in keys
+                   if [v.lower() for v in desired.get(key, [])] != [v.lower() for v in running.get(key.lower(), [])]}
+        restart = {key for key in changed if key.lower() in {opt.lower() for opt in setting.TOR_RESTART_OPTIONS}}
+
+        if not self.apply_template(system_torrc_path, overrides):
+            return None
+        if not changed:
+            self.logger.info("Running configuration already matches; nothing to change.")
+            return set()
+        if restart:
+            self.logger.warning("Options need a tor restart: %s", ', '.join(sorted(restart)))
+            return restart
+
+        self.logger.info("Applying %s changed options live: %s", len(changed), ', '.join(changed))
+        try:
+            controller.set_options(list(changed.items()))
+        except Exception as e:
+            self.logger.warning("SETCONF rejected (%s); asking tor to reload torrc instead.", e)
+            try:
+                from stem import Signal
+                controller.signal(Signal.RELOAD)
+            except Exception as e:
+                self.logger.error("Could not reload tor configuration: %s", e)
+                return None
+        return set()
+
     def restore_torrc(self, system_torrc_path: str) -> bool:
         """Restores the original torrc file from the backup."""
         
-        self.logger.info(f"Restoring original torrc from '{self.backup_path}'...")
+        self.logger.info("Restoring original torrc from '%s'...", self.backup_path)
         try:
             if not os.path.exists(self.backup_path):
                 self.logger.error("Backup file not found for restore.")
@@ -58,5 +159,5 @@ class TorrcManager:
             self.logger.info("Successfully restored original torrc file.")
             return True
         except (PermissionError, IOError) as e:
-            self.logger.error(f"Error restoring torrc: {e}", exc_info=True)
+            self.logger.error("Error restoring torrc: %s", e, exc_info=True)
             return False
\ No newline at end of file
@@ -0,0 +1,158 @@
+import time
+import threading
+from collections import Counter, deque
+from stem import CircStatus, Signal, StreamStatus
+from config import setting
+from utils.logger import RecordLog
+from utils.metrics import registry
+from stem.control import EventType
+
+CIRCUIT_BUILD_SECONDS = registry.histogram("torsen_circuit_build_seconds", "Time from circuit LAUNCHED to BUILT.")
+STREAM_TTFB_SECONDS = registry.histogram("torsen_stream_ttfb_seconds", "Time from stream NEW to its first bytes read.")
+ACTIVE_STREAMS = registry.gauge("torsen_active_streams", "Streams currently open through Tor.")
+TOR_BYTES = registry.counter("torsen_tor_bytes_total", "Bytes tor reported in BW events.", ("direction",))
+TOR_RATE = registry.gauge("torsen_tor_bytes_per_second", "Bytes tor read and wrote during the last second.", ("direction",))
+ROTATIONS = registry.counter("torsen_circuit_rotations_total", "Circuit rotations triggered by the latency monitor.", ("action",))
+
+
+def percentile(samples, fraction: float) -> float | None:
+    """Returns the nearest-rank percentile of the samples, or None when there are none."""
+
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+class CircuitMonitor:
+    """Watches circuit build times and stream time-to-first-byte, rotating circuits when they degrade."""
+
+    def __init__(self, session):
+        """Initializes the CircuitMonitor."""
+
+        self.actions = 0
+        self.session = session
+        self.last_action = 0.0
+        self._launched = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.build_times = deque(maxlen=setting.MONITOR_WINDOW_SIZE)
+        self.ttfb_times = deque(maxlen=setting.MONITOR_WINDOW_SIZE)
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+
+    def start(self) -> bool:
+        """Subscribes to CIRC, STREAM, STREAM_BW and BW events on the control session."""
+
+        if not self.session.is_alive():
+            self.logger.error("Cannot start circuit monitor without a control session.")
+            return False
+        controller = self.session.controller
+        controller.add_event_listener(self._on_circ, EventType.CIRC)
+        controller.add_event_listener(self._on_stream, EventType.STREAM)
+        controller.add_event_listener(self._on_stream_bw, EventType.STREAM_BW)
+        controller.add_event_listener(self._on_bw, EventType.BW)
+        self.logger.info("Circuit latency monitor started.")
+        return True
+
+    def stop(self):
+        """Unsubscribes from all events."""
+
+        if self.session.is_alive():
+            for listener in (self._on_circ, self._on_stream, self._on_stream_bw, self._on_bw):
+                self.session.controller.remove_event_listener(listener)
+
+    def _on_circ(self, event):
+        """Measures the time from LAUNCHED to BUILT for each circuit."""
+
+        now = time.monotonic()
+        with self._lock:
+            if event.status == CircStatus.LAUNCHED:
+                self._launched[event.id] = now
+            elif event.status == CircStatus.BUILT and event.id in self._launched:
+                self.build_times.append(now - self._launched.pop(event.id))
+                CIRCUIT_BUILD_SECONDS.observe(self.build_times[-1])
+            elif event.status in (CircStatus.FAILED, CircStatus.CLOSED):
+                self._launched.pop(event.id, None)
+        if event.status == CircStatus.BUILT:
+            self._evaluate()
+
+    def _on_stream(self, event):
+        """Tracks stream start times and the circuit each stream was attached to."""
+
+        with self._lock:
+            if event.status == StreamStatus.NEW:
+                self._streams[event.id] = {"start": time.monotonic(), "circ": None}
+            elif event.id in self._streams and event.status in (StreamStatus.FAILED, StreamStatus.CLOSED):
+                del self._streams[event.id]
+            elif event.id in self._streams and event.circ_id and event.circ_id != "0":
+                self._streams[event.id]["circ"] = event.circ_id
+            ACTIVE_STREAMS.set(len(self._streams))
+
+    def _on_stream_bw(self, event):
+        """Records time-to-first-byte when a stream reports its first bytes read."""
+
+        with self._lock:
+            stream = self._streams.get(event.id)
+            if stream is None or event.read <= 0 or stream.get("ttfb_recorded"):
+                return
+            stream["ttfb_recorded"] = True
+            self.ttfb_times.append((time.monotonic() - stream["start"], stream["circ"]))
+            STREAM_TTFB_SECONDS.observe(self.ttfb_times[-1][0])
+        self._evaluate()
+
+    def _on_bw(self, event):
+        """Records tor's per-second read and write totals."""
+
+        TOR_BYTES.inc(event.read, direction="read")
+        TOR_BYTES.inc(event.written, direction="written")
+        TOR_RATE.set(event.read, direction="read")
+        TOR_RATE.set(event.written, direction="written")
+
+    def _evaluate(self):
+        """Rotates circuits when a p95 crosses its threshold, at most once per action interval."""
+
+        if not setting.MONITOR_ENABLED:
+            return
+        with self._lock:
+            if time.monotonic() - self.last_action < setting.MONITOR_ACTION_INTERVAL:
+                return
+            ttfb_p95 = percentile([t for t, _ in self.ttfb_times], 0.95) \
+                if len(self.ttfb_times) >= setting.MONITOR_MIN_SAMPLES else None
+            build_p95 = percentile(self.build_times, 0.95) \
+                if len(self.build_times) >= setting.MONITOR_MIN_SAMPLES else None
+
+            slow_circuit = None
+            if ttfb_p95 is not None and ttfb_p95 > setting.MONITOR_STREAM_TTFB_P95:
+                slow = Counter(circ for t, circ in self.ttfb_times if t > setting.MONITOR_STREAM_TTFB_P95 and circ)
+                slow_circuit = slow.most_common(1)[0][0] if slow else ""
+            elif build_p95 is None or build_p95 <= setting.MONITOR_CIRC_BUILD_P95:
+                return
+
+            self.last_action = time.monotonic()
+            self.actions += 1
+            self.build_times.clear()
+            self.ttfb_times.clear()
+
+        try:
+            if slow_circuit:
+                self.logger.warning("Stream TTFB p95 %.2fs over threshold; closing circuit %s.", ttfb_p95, slow_circuit)
+                self.session.controller.close_circuit(slow_circuit)
+                ROTATIONS.inc(action="close_circuit")
+            else:
+                p95 = ttfb_p95 if slow_circuit is not None else build_p95
+                self.logger.warning("Latency p95 %.2fs over threshold; requesting NEWNYM.", p95)
+                self.session.controller.signal(Signal.NEWNYM)
+                ROTATIONS.inc(action="newnym")
+        except Exception as e:
+            self.logger.error("Circuit rotation failed: %s", e)
+
+    def snapshot(self) -> dict:
+        """Returns the current window statistics."""
+
+        with self._lock:
+            return {
+                "circuit_build_p95": percentile(self.build_times, 0.95),
+                "stream_ttfb_p95": percentile([t for t, _ in self.ttfb_times], 0.95),
+                "samples": {"circuit_build": len(self.build_times), "stream_ttfb": len(self.ttfb_times)},
+                "rotations": self.actions,
+            }
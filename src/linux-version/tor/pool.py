@@ -0,0 +1,262 @@
+import os
+import time
+import shutil
+import signal
+import threading
+from config import setting
+from utils.logger import RecordLog
+from utils.metrics import registry
+from utils.runner import run_command
+from utils.taskgraph import TaskGraph
+from tor.control import ControlSession
+from tor.controller import TorrcManager
+from tor.bootstrap import BootstrapTracker
+
+HEALTHY_INSTANCES = registry.gauge("torsen_pool_healthy_instances", "Tor pool instances currently in the firewall rotation.")
+
+
+class TorInstance:
+    """One tor process of the pool with its own ports, DataDirectory and control session."""
+
+    def __init__(self, index: int):
+        """Initializes the TorInstance."""
+
+        offset = index * setting.TOR_POOL_PORT_STRIDE
+        self.index = index
+        self.healthy = False
+        self.tracker = None
+        self.dns_port = setting.TOR_DNS_PORT + offset
+        self.trans_port = setting.TOR_TRANSPARENT_PORT + offset
+        self.control_port = setting.TOR_CONTROL_PORT + offset
+        self.data_directory = os.path.join(setting.TOR_POOL_DIRECTORY, f"instance-{index}")
+        self.torrc_path = os.path.join(self.data_directory, "torrc")
+        self.pid_path = os.path.join(self.data_directory, "tor.pid")
+        self.session = ControlSession(self.control_port)
+
+    def overrides(self, listen_addresses: list = ()) -> dict:
+        """Returns the torrc options that separate this instance from the others, listening on extra addresses if given."""
+
+        return {
+            "DataDirectory": self.data_directory,
+            "ControlPort": str(self.control_port),
+            "TransPort": [str(self.trans_port)] + [f"{address}:{self.trans_port}" for address in listen_addresses],
+            "DNSPort": [str(self.dns_port)] + [f"{address}:{self.dns_port}" for address in listen_addresses],
+            "SocksPort": "0",
+            "PidFile": self.pid_path,
+            "RunAsDaemon": "1",
+        }
+
+    def _wait_exit(self, pid: int, timeout: float) -> bool:
+        """Polls until the process is gone or the timeout expires; returns True once it has exited."""
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def stop(self, timeout: float = None) -> bool:
+        """Stops this instance's tor through the pid file it wrote and waits for it to exit.
+
+        Tor gets `timeout` seconds to shut down cleanly before it is killed, so its ports and
+        DataDirectory are free once this returns. Returns False if it had to be killed.
+        """
+
+        self.healthy = False
+        self.session.close()
+        timeout = setting.TOR_POOL_STOP_TIMEOUT if timeout is None else timeout
+        try:
+            with open(self.pid_path, 'r', encoding='utf-8') as f:
+                pid = int(f.read().strip())
+            os.kill(pid, signal.SIGTERM)
+        except (IOError, ValueError, ProcessLookupError):
+            return True
+        if self._wait_exit(pid, timeout):
+            return True
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            return True
+        self._wait_exit(pid, timeout)
+        return False
+
+
+class TorPool:
+    """Runs several tor instances side by side so traffic can be spread across CPU cores."""
+
+    def __init__(self, size: int = None):
+        """Initializes the TorPool."""
+
+        self.on_change = None
+        self.cache = "unknown"
+        self.listen_addresses = []
+        self._stop = threading.Event()
+        self._health_thread = None
+        self.torrc_manager = TorrcManager()
+        self.instances = [TorInstance(index) for index in range(size or setting.TOR_POOL_SIZE)]
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+
+    def healthy(self) -> list:
+        """Returns the instances currently in rotation."""
+
+        return [instance for instance in self.instances if instance.healthy]
+
+    def _launch(self, instance: TorInstance, overrides: dict) -> bool:
+        """Renders the instance's torrc, prepares its DataDirectory and starts tor in the background."""
+
+        try:
+            os.makedirs(instance.data_directory, mode=0o700, exist_ok=True)
+            shutil.chown(instance.data_directory, user=setting.TOR_USER)
+        except (OSError, LookupError) as e:
+            self.logger.error("Could not prepare '%s': %s", instance.data_directory, e)
+            return False
+        if not self.torrc_manager.apply_template(instance.torrc_path, {**overrides, **instance.overrides(self.listen_addresses)}):
+            return False
+        try:
+            run_command(["tor", "-f", instance.torrc_path])
+            return True
+        except Exception as e:
+            self.logger.error("Tor instance %s failed to start: %s", instance.index, e)
+            return False
+
+    def _bootstrap(self, instance: TorInstance, timeout: float) -> bool:
+        """Waits for one instance to bootstrap and marks it healthy if it does."""
+
+        instance.tracker = BootstrapTracker(instance.session, self.cache)
+        instance.healthy = instance.tracker.wait(timeout)
+        return instance.healthy
+
+    def cancel_bootstrap(self):
+        """Makes every pending bootstrap wait return at once."""
+
+        for instance in self.instances:
+            if instance.tracker is not None:
+                instance.tracker.cancel()
+
+    def _kill(self, instance: TorInstance) -> bool:
+        """Stops one instance and waits for its process to exit."""
+
+        if not instance.stop():
+            self.logger.warning("Tor instance %s did not exit within %ss and was killed.", instance.index, setting.TOR_POOL_STOP_TIMEOUT)
+        return True
+
+    def _run_all(self, name: str, action) -> TaskGraph:
+        """Runs an action for every instance concurrently."""
+
+        graph = TaskGraph(name, max_workers=len(self.instances), stop_on_failure=False)
+        for instance in self.instances:
+            graph.add(f"instance-{instance.index}", lambda instance=instance: action(instance))
+        graph.run()
+        return graph
+
+    def start(self, overrides: dict | None = None) -> bool:
+        """Launches every instance from its own rendered torrc."""
+
+        self.logger.info("Starting a pool of %s tor instances...", len(self.instances))
+        graph = self._run_all("pool-start", lambda instance: self._launch(instance, overrides or {}))
+        return len(graph.completed) >= setting.TOR_POOL_MIN_HEALTHY
+
+    def wait_for_bootstrap(self, timeout: float) -> bool:
+        """Waits for all instances in parallel; succeeds when at least TOR_POOL_MIN_HEALTHY bootstrapped."""
+
+        self._run_all("pool-bootstrap", lambda instance: self._bootstrap(instance, timeout))
+        HEALTHY_INSTANCES.set(len(self.healthy()))
+        if len(self.healthy()) < setting.TOR_POOL_MIN_HEALTHY:
+            self.logger.critical("Only %s of %s tor instances bootstrapped.", len(self.healthy()), len(self.instances))
+            return False
+        self.logger.info("✅ %s of %s tor instances are ready.", len(self.healthy()), len(self.instances))
+        return True
+
+    def stop_health_checks(self):
+        """Stops the background health checks and waits for a running check, and its on_change, to finish."""
+
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+
+    def stop(self) -> bool:
+        """Stops the health checks and every instance."""
+
+        self.stop_health_checks()
+        self._run_all("pool-stop", self._kill)
+        HEALTHY_INSTANCES.set(0)
+        return True
+
+    def check(self, instance: TorInstance) -> bool:
+        """Returns True if the instance answers on its control port with an established circuit."""
+
+        try:
+            return instance.session.open(timeout=1) and \
+                instance.session.controller.get_info("status/circuit-established") == "1"
+        except Exception as e:
+            self.logger.debug("Health check of tor instance %s failed: %s", instance.index, e)
+            return False
+
+    def check_all(self) -> bool:
+        """Probes every instance and calls on_change when the rotation changes; returns True if it did."""
+
+        previous = [instance.index for instance in self.healthy()]
+        results = {instance.index: self.check(instance) for instance in self.instances}
+        if not any(results.values()):
+            self.logger.critical("No tor instance is healthy; keeping the current rotation.")
+            return False
+
+        for instance in self.instances:
+            if instance.healthy != results[instance.index]:
+                state = "back in" if results[instance.index] else "out of"
+                self.logger.warning("Tor instance %s (port %s) is %s rotation.", instance.index, instance.trans_port, state)
+            instance.healthy = results[instance.index]
+        HEALTHY_INSTANCES.set(len(self.healthy()))
+
+        if [instance.index for instance in self.healthy()] == previous:
+            return False
+        if self.on_change is not None:
+            self.on_change(self.healthy())
+        return True
+
+    def _health_loop(self):
+        """Runs check_all every TOR_POOL_HEALTH_INTERVAL seconds until stopped."""
+
+        while not self._stop.wait(setting.TOR_POOL_HEALTH_INTERVAL):
+            self.check_all()
+
+    def start_health_checks(self, on_change=None):
+        """Starts the background health checks; on_change receives the new list of healthy instances."""
+
+        self.on_change = on_change
+        self._stop.clear()
+        self._health_thread = threading.Thread(target=self._health_loop, name="pool-health", daemon=True)
+        self._health_thread.start()
+
+    def reconfigure(self, overrides: dict | None = None) -> bool:
+        """Applies changed torrc options to every instance, restarting those that need it."""
+
+        def apply(instance: TorInstance) -> bool:
+            if not instance.session.open(timeout=5):
+                return False
+            merged = {**(overrides or {}), **instance.overrides(self.listen_addresses)}
+            restart = self.torrc_manager.reconfigure(instance.session.controller, instance.torrc_path, merged)
+            if restart is None:
+                return False
+            if restart:
+                self._kill(instance)
+                return self._launch(instance, overrides or {}) and self._bootstrap(instance, setting.TOR_BOOTSTRAP_TIMEOUT)
+            return True
+
+        return not self._run_all("pool-reload", apply).failed
+
+    def signal(self, tor_signal: str) -> bool:
+        """Sends a signal such as NEWNYM to every reachable instance."""
+
+        def send(instance: TorInstance) -> bool:
+            if not instance.session.open(timeout=5):
+                return False
+            instance.session.controller.signal(tor_signal)
+            return True
+
+        return not self._run_all("pool-signal", send).failed
@@ -0,0 +1,272 @@
+import os
+import io
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tarfile
+import calendar
+import threading
+from config import setting
+from utils.logger import RecordLog
+from utils.metrics import registry
+
+# Tor fetches a fresh consensus hourly but still bootstraps from one up to a day past valid-until.
+REASONABLY_LIVE_SECONDS = 24 * 3600
+CONSENSUS_FILES = ("cached-microdesc-consensus", "cached-consensus")
+STATE_FILES = CONSENSUS_FILES + ("cached-microdescs", "cached-microdescs.new", "cached-certs", "state")
+MANIFEST = "manifest.json"
+
+BUNDLE_VALID_SECONDS = registry.gauge("torsen_tor_state_bundle_valid_seconds", "Seconds until the cached consensus in the state bundle stops being live.")
+
+
+def consensus_valid_until(data: bytes) -> float | None:
+    """Returns the consensus' valid-until time as a Unix timestamp, read from its header."""
+
+    for line in io.BytesIO(data[:8192]):
+        if line.startswith(b"valid-until "):
+            try:
+                return calendar.timegm(time.strptime(line[12:].strip().decode(), "%Y-%m-%d %H:%M:%S"))
+            except ValueError:
+                return None
+    return None
+
+
+class TorStateCache:
+    """Snapshots tor's directory cache and guard state into a verified bundle and restores it before tor starts.
+
+    The bundle is a tar of the cached consensus, microdescriptors, certificates and the state
+    file plus a manifest with each file's sha256 and the consensus' valid-until time. Restores
+    only replace files when the bundle is newer than what the DataDirectory already holds.
+    """
+
+    def __init__(self, bundle_path: str = None):
+        """Initializes the TorStateCache."""
+
+        self.bundle_path = bundle_path or setting.TOR_STATE_CACHE_PATH
+        self._stop = threading.Event()
+        self._cancel = threading.Event()
+        self._prewarm_thread = None
+        self._prewarm_tracker = None
+        self._prewarm_instance = None
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+
+    @staticmethod
+    def _read_consensus(directory: str) -> float | None:
+        """Returns the valid-until time of the newest consensus in a DataDirectory, if any."""
+
+        times = []
+        for name in CONSENSUS_FILES:
+            try:
+                with open(os.path.join(directory, name), 'rb') as f:
+                    times.append(consensus_valid_until(f.read(8192)))
+            except IOError:
+                continue
+        times = [t for t in times if t is not None]
+        return max(times) if times else None
+
+    @staticmethod
+    def classify(valid_until: float | None) -> str:
+        """Names what a consensus valid until the given time gives tor: 'warm', 'stale' or 'cold'."""
+
+        if valid_until is None:
+            return "cold"
+        return "warm" if time.time() < valid_until + REASONABLY_LIVE_SECONDS else "stale"
+
+    @staticmethod
+    def _tor_running(directory: str) -> bool:
+        """Returns True if a tor process holds the DataDirectory's lock file."""
+
+        try:
+            with open(os.path.join(directory, "lock"), 'rb') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return True
+                fcntl.flock(f, fcntl.LOCK_UN)
+        except IOError:
+            pass
+        return False
+
+    def manifest(self) -> dict | None:
+        """Returns the bundle's manifest, or None if there is no readable bundle."""
+
+        try:
+            with tarfile.open(self.bundle_path, 'r') as bundle:
+                return json.load(bundle.extractfile(MANIFEST))
+        except (IOError, KeyError, ValueError, tarfile.TarError, AttributeError):
+            return None
+
+    def is_fresh(self) -> bool:
+        """Returns True if the bundle's consensus is still live, so a refresh would gain nothing."""
+
+        manifest = self.manifest()
+        return manifest is not None and manifest.get("valid_until") is not None and time.time() < manifest["valid_until"]
+
+    def snapshot(self, directory: str) -> bool:
+        """Bundles the DataDirectory's cache files, unless the existing bundle already has a newer consensus."""
+
+        valid_until = self._read_consensus(directory)
+        if valid_until is None:
+            self.logger.info("No cached consensus in '%s'; nothing to snapshot.", directory)
+            return True
+        previous = self.manifest()
+        if previous is not None and (previous.get("valid_until") or 0) >= valid_until:
+            self.logger.debug("State bundle is already as fresh as '%s'.", directory)
+            return True
+
+        manifest = {"created": time.time(), "valid_until": valid_until, "files": {}}
+        temporary = f"{self.bundle_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.bundle_path), mode=0o700, exist_ok=True)
+            with tarfile.open(temporary, 'w') as bundle:
+                for name in STATE_FILES:
+                    try:
+                        with open(os.path.join(directory, name), 'rb') as f:
+                            data = f.read()
+                    except IOError:
+                        continue
+                    manifest["files"][name] = hashlib.sha256(data).hexdigest()
+                    info = tarfile.TarInfo(name)
+                    info.size, info.mtime, info.mode = len(data), int(manifest["created"]), 0o600
+                    bundle.addfile(info, io.BytesIO(data))
+                encoded = json.dumps(manifest, indent=2).encode()
+                info = tarfile.TarInfo(MANIFEST)
+                info.size, info.mtime, info.mode = len(encoded), int(manifest["created"]), 0o600
+                bundle.addfile(info, io.BytesIO(encoded))
+            os.replace(temporary, self.bundle_path)
+        except (IOError, tarfile.TarError) as e:
+            self.logger.error("Could not write the tor state bundle: %s", e)
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return False
+
+        BUNDLE_VALID_SECONDS.set(round(valid_until - time.time()))
+        self.logger.info("Saved %s tor state files to '%s'.", len(manifest["files"]), self.bundle_path)
+        return True
+
+    def _extract(self, bundle: tarfile.TarFile, manifest: dict, directory: str, names: list) -> bool:
+        """Writes the named members into the directory after checking every one against the manifest."""
+
+        verified = {}
+        for name in names:
+            member = bundle.extractfile(name)
+            data = member.read() if member is not None else b""
+            if hashlib.sha256(data).hexdigest() != manifest["files"][name]:
+                self.logger.error("State bundle member '%s' does not match its checksum; ignoring the bundle.", name)
+                return False
+            verified[name] = data
+
+        for name, data in verified.items():
+            path = os.path.join(directory, name)
+            with open(f"{path}.torsen", 'wb') as f:
+                f.write(data)
+            os.chmod(f"{path}.torsen", 0o600)
+            shutil.chown(f"{path}.torsen", user=setting.TOR_USER)
+            os.replace(f"{path}.torsen", path)
+        return True
+
+    def restore(self, directory: str) -> str:
+        """Restores the bundle into a DataDirectory if it is newer, and returns how warm tor will start.
+
+        The result is 'warm' (a live consensus), 'stale' (only descriptors and certificates will
+        be reused) or 'cold'. An existing state file is kept so the host keeps its own guards.
+        """
+
+        on_disk = self._read_consensus(directory)
+        manifest = self.manifest()
+        bundled = manifest.get("valid_until") if manifest else None
+        if bundled is None or (on_disk is not None and on_disk >= bundled):
+            return self.classify(on_disk)
+        if self._tor_running(directory):
+            self.logger.info("Tor is already running on '%s'; leaving its cache alone.", directory)
+            return self.classify(on_disk)
+
+        names = [name for name in manifest["files"] if name in STATE_FILES and
+                 not (name == "state" and os.path.exists(os.path.join(directory, name)))]
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            shutil.chown(directory, user=setting.TOR_USER)
+            with tarfile.open(self.bundle_path, 'r') as bundle:
+                if not self._extract(bundle, manifest, directory, names):
+                    return self.classify(on_disk)
+        except (IOError, KeyError, LookupError, tarfile.TarError) as e:
+            self.logger.error("Could not restore the tor state bundle: %s", e)
+            return self.classify(on_disk)
+
+        state = self.classify(bundled)
+        self.logger.info("Restored %s tor state files into '%s' (%s cache).", len(names), directory, state)
+        return state
+
+    def prewarm(self, overrides: dict | None = None) -> bool:
+        """Refreshes the bundle by bootstrapping a throwaway tor instance on its own ports and DataDirectory."""
+
+        from tor.pool import TorInstance
+        from tor.controller import TorrcManager
+        from tor.bootstrap import BootstrapTracker
+        from utils.runner import run_command
+
+        instance = TorInstance(setting.TOR_STATE_PREWARM_INDEX)
+        # Only the directory cache is wanted, so the instance takes no traffic.
+        torrc = {**(overrides or {}), **instance.overrides(), "TransPort": "0", "DNSPort": "0"}
+        if self._cancel.is_set():
+            return False
+        self.logger.info("Pre-warming the tor state bundle in '%s'...", instance.data_directory)
+        self.restore(instance.data_directory)
+        if not TorrcManager().apply_template(instance.torrc_path, torrc):
+            return False
+
+        self._prewarm_instance = instance
+        self._prewarm_tracker = BootstrapTracker(instance.session, cache="prewarm")
+        try:
+            run_command(["tor", "-f", instance.torrc_path])
+            if self._cancel.is_set() or not self._prewarm_tracker.wait(setting.TOR_BOOTSTRAP_TIMEOUT):
+                return False
+            return self.snapshot(instance.data_directory)
+        except Exception as e:
+            self.logger.error("Pre-warm tor instance failed: %s", e)
+            return False
+        finally:
+            instance.stop()
+            self._prewarm_instance = None
+            self._prewarm_tracker = None
+
+    def cancel_prewarm(self):
+        """Stops a running pre-warm right away, so it never competes with a real connection."""
+
+        self._cancel.set()
+        tracker, instance = self._prewarm_tracker, self._prewarm_instance
+        if tracker is not None:
+            tracker.cancel()
+        if instance is not None:
+            instance.stop()
+
+    def _prewarm_loop(self, is_idle, overrides):
+        """Refreshes a stale bundle every TOR_STATE_CACHE_REFRESH_INTERVAL seconds while tor is idle."""
+
+        while True:
+            # Cleared before the idle check, so a connect that starts in between still cancels this attempt.
+            self._cancel.clear()
+            if is_idle() and not self.is_fresh():
+                self.prewarm(overrides())
+            if self._stop.wait(setting.TOR_STATE_CACHE_REFRESH_INTERVAL):
+                return
+
+    def start_prewarm(self, is_idle, overrides):
+        """Starts the background refresh; is_idle() and overrides() are asked before every attempt."""
+
+        self._stop.clear()
+        self._prewarm_thread = threading.Thread(target=self._prewarm_loop, args=(is_idle, overrides),
+                                                name="tor-state-prewarm", daemon=True)
+        self._prewarm_thread.start()
+
+    def stop_prewarm(self):
+        """Stops the background refresh and any pre-warm tor it started."""
+
+        self._stop.set()
+        self.cancel_prewarm()
+        if self._prewarm_thread is not None:
+            # The pre-warm tor is already stopped; a thread still retrying its control port ends on its own.
+            self._prewarm_thread.join(timeout=5)
+            self._prewarm_thread = None
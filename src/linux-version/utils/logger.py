@@ -1,51 +1,184 @@
 import os
+import sys
+import json
+import queue
+import atexit
 import logging
-import coloredlogs
+import datetime
+import threading
 from config import setting
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+FILE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s (%(filename)s:%(lineno)d)'
+LEVEL_STYLES = {
+    'debug': {'color': 'green'},
+    'info': {'color': 'cyan'},
+    'warning': {'color': 'yellow'},
+    'error': {'color': 'red'},
+    'critical': {'bold': True, 'color': 'red'},
+}
+# Attributes every LogRecord carries; anything else was passed through `extra=` and goes into the JSON line.
+_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName"}
+# Arguments of these types cannot change before the listener thread formats the message.
+_IMMUTABLE_ARGS = (str, bytes, int, float, complex, type(None))
+
+_queue = None
+_listener = None
+_lock = threading.Lock()
+
+
+class JsonLinesHandler(logging.Handler):
+    """Writes one JSON object per record, buffering lines and flushing them in batches."""
+
+    def __init__(self, path: str, batch_size: int = 100, flush_interval: float = 2.0):
+        """Initializes the JsonLinesHandler."""
+
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._timer = None
+
+    def serialize(self, record: logging.LogRecord) -> str:
+        """Renders a record with its structured `extra` fields as one JSON line."""
+
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = logging.Formatter().formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+    def emit(self, record: logging.LogRecord):
+        """Buffers a record and flushes once the batch is full or the flush interval has passed."""
+
+        try:
+            self._buffer.append(self.serialize(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Appends the buffered lines to the file in one write."""
+
+        self.acquire()
+        try:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError:
+            self.handleError(None)
+        finally:
+            self.release()
+
+    def close(self):
+        """Flushes what is left before closing."""
+
+        self.flush()
+        super().close()
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Enqueues records so %-style messages with immutable arguments are only formatted on the listener thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Renders the message now if an argument could change before the listener formats it; else returns the record as is."""
+
+        args = record.args
+        values = args.values() if isinstance(args, dict) else args or ()
+        if not all(isinstance(value, _IMMUTABLE_ARGS) for value in values):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def _build_handlers() -> list:
+    """Creates the console, rotating file and optional JSON-lines handlers the listener writes to."""
+
+    log_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', setting.LOG_DIRECTORY)
+    os.makedirs(log_directory, exist_ok=True)
+
+    # coloredlogs pulls in humanfriendly; import it only once a logger is actually configured.
+    import coloredlogs
+
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setLevel(setting.CONSOLE_LOG_LEVEL)
+    if coloredlogs.terminal_supports_colors(sys.stderr):
+        console_handler.setFormatter(coloredlogs.ColoredFormatter(fmt=CONSOLE_FORMAT, level_styles=LEVEL_STYLES))
+    else:
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    file_handler = RotatingFileHandler(os.path.join(log_directory, setting.LOG_FILENAME), maxBytes=setting.LOG_MAX_BYTES,
+                                       backupCount=setting.LOG_BACKUP_COUNT, encoding='utf-8')
+    file_handler.setLevel(setting.FILE_LOG_LEVEL)
+    file_handler.setFormatter(logging.Formatter(FILE_FORMAT))
+
+    handlers = [console_handler, file_handler]
+    if setting.LOG_JSON_ENABLED:
+        json_handler = JsonLinesHandler(os.path.join(log_directory, setting.LOG_JSON_FILENAME),
+                                        batch_size=setting.LOG_JSON_BATCH_SIZE, flush_interval=setting.LOG_JSON_FLUSH_INTERVAL)
+        json_handler.setLevel(setting.LOG_JSON_LEVEL)
+        handlers.append(json_handler)
+    return handlers
+
+def _shared_queue() -> tuple:
+    """Starts the single background listener on first use and returns (queue, lowest handler level)."""
+
+    global _queue, _listener
+    with _lock:
+        if _listener is None:
+            _queue = queue.SimpleQueue()
+            _listener = QueueListener(_queue, *_build_handlers(), respect_handler_level=True)
+            _listener.start()
+            atexit.register(stop)
+        return _queue, min(handler.level for handler in _listener.handlers)
+
+def stop():
+    """Drains the queue and stops the listener; safe to call more than once."""
+
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.flush()
+            _listener = None
 
 
 class RecordLog:
     """A centralized logging utility for the application."""
-    
+
     def __init__(self, name: str):
         """Initializes and configures a logger instance."""
-        
+
         self.logger = logging.getLogger(name)
-        self.logger.setLevel(setting.GLOBAL_LOG_LEVEL)
         self.logger.propagate = False
         if self.logger.hasHandlers():
             return
 
-        log_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', setting.LOG_DIRECTORY)
-        
-        if not os.path.exists(log_directory):
-            os.makedirs(log_directory)
-            
-        log_path = os.path.join(log_directory, setting.LOG_FILENAME)
-        
-        file_handler = RotatingFileHandler(log_path, maxBytes=setting.LOG_MAX_BYTES, backupCount=setting.LOG_BACKUP_COUNT, encoding='utf-8')
-        file_handler.setLevel(setting.FILE_LOG_LEVEL)
-        
-        file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s (%(filename)s:%(lineno)d)')
-        file_handler.setFormatter(file_formatter)
-        
-        coloredlogs.install(
-            level=setting.CONSOLE_LOG_LEVEL,
-            logger=self.logger,
-            fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            level_styles={
-                'debug': {'color': 'green'},
-                'info': {'color': 'cyan'},
-                'warning': {'color': 'yellow'},
-                'error': {'color': 'red'},
-                'critical': {'bold': True, 'color': 'red'},
-            }
-        )
-        
-        self.logger.addHandler(file_handler)
+        log_queue, lowest_level = _shared_queue()
+        # Records no handler would write are dropped before their message is ever formatted.
+        self.logger.setLevel(max(setting.GLOBAL_LOG_LEVEL, lowest_level))
+        self.logger.addHandler(_DeferredQueueHandler(log_queue))
 
     def get_logger(self):
         """Returns the configured logger instance."""
-        
-        return self.logger
\ No newline at end of file
+
+        return self.logger
@@ -0,0 +1,226 @@
+import time
+import threading
+from contextlib import contextmanager
+from config import setting
+from utils.logger import RecordLog
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    """Formats label pairs as a Prometheus label set."""
+
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Base class for labelled metrics kept in process memory."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        """Initializes the Metric."""
+
+        self.name = name
+        self.values = {}
+        self.labelnames = tuple(labelnames)
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        """Orders label values to match the declared label names."""
+
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list:
+        """Returns the exposition lines for this metric."""
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    """A monotonically increasing value."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """Increments the counter for the given labels."""
+
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        """Mirrors a monotonic counter maintained elsewhere, such as a kernel rule counter."""
+
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        """Sets the gauge for the given labels."""
+
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Counts observations into cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        """Initializes the Histogram."""
+
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        """Records one observation for the given labels."""
+
+        key = self._key(labels)
+        with self._lock:
+            entry = self.values.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][index] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall time spent inside the block."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list:
+        """Returns the bucket, sum and count lines for this histogram."""
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, entry in sorted(self.values.items()):
+                labels = _format_labels(self.labelnames, key)
+                for bound, count in zip(self.buckets + ("+Inf",), entry["buckets"] + [entry["count"]]):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+                lines.append(f"{self.name}_sum{labels} {entry['sum']}")
+                lines.append(f"{self.name}_count{labels} {entry['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric of the process plus callbacks that refresh values at scrape time."""
+
+    def __init__(self):
+        """Initializes the MetricsRegistry."""
+
+        self.metrics = {}
+        self.collectors = []
+
+    def _register(self, metric: Metric) -> Metric:
+        """Returns the already registered metric of that name, or registers this one."""
+
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        """Returns the named counter, creating it on first use."""
+
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        """Returns the named gauge, creating it on first use."""
+
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        """Returns the named histogram, creating it on first use."""
+
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, callback):
+        """Registers a callable that updates metrics right before they are rendered."""
+
+        if callback not in self.collectors:
+            self.collectors.append(callback)
+
+    def render(self) -> str:
+        """Runs the collectors and returns the Prometheus text exposition of all metrics."""
+
+        for callback in list(self.collectors):
+            try:
+                callback()
+            except Exception as e:
+                RecordLog(__name__).get_logger().debug("Metrics collector failed: %s", e)
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class MetricsServer:
+    """Serves the registry in Prometheus text format on a local HTTP port."""
+
+    def __init__(self):
+        """Initializes the MetricsServer."""
+
+        self.httpd = None
+        self.address = setting.METRICS_ADDRESS
+        self.port = setting.METRICS_PORT
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+
+    def start(self) -> bool:
+        """Starts serving /metrics from a background thread."""
+
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.httpd = ThreadingHTTPServer((self.address, self.port), Handler)
+        except OSError as e:
+            self.logger.error("Could not start metrics endpoint on %s:%s: %s", self.address, self.port, e)
+            return False
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True).start()
+        self.logger.info("Metrics available at http://%s:%s/metrics", self.address, self.port)
+        return True
+
+    def stop(self):
+        """Stops the HTTP server."""
+
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
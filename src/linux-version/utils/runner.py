@@ -0,0 +1,113 @@
+import os
+import time
+import threading
+import subprocess
+
+
+class CommandRunner:
+    """Runs system commands with subprocess; the default backend."""
+
+    def run(self, command: list, input: str | None = None, stdout=None, check: bool = True) -> subprocess.CompletedProcess:
+        """Runs a command to completion, capturing its output unless stdout is redirected."""
+
+        return subprocess.run(command, input=input, stdout=stdout if stdout is not None else subprocess.PIPE,
+                              stderr=subprocess.PIPE, text=True, check=check, encoding='utf-8')
+
+
+class SimulatedRunner(CommandRunner):
+    """Records every command instead of running it, with injectable per-command latency, output and failures.
+
+    Rules are keyed by a command prefix such as "systemctl" or "bash.sh start" (the executable
+    is matched by its basename); the longest matching prefix wins.
+    """
+
+    def __init__(self, latency: dict | None = None, outputs: dict | None = None, failures: dict | None = None):
+        """Initializes the SimulatedRunner."""
+
+        self.calls = []
+        self.latency = latency or {}
+        self.outputs = outputs or {}
+        self.failures = failures or {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _match(rules: dict, command: list):
+        """Returns the value of the longest rule whose prefix matches the command."""
+
+        joined = " ".join([os.path.basename(command[0])] + list(command[1:]))
+        best = None
+        for prefix in rules:
+            if (joined == prefix or joined.startswith(prefix + " ")) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return rules[best] if best is not None else None
+
+    def run(self, command: list, input: str | None = None, stdout=None, check: bool = True) -> subprocess.CompletedProcess:
+        """Simulates a command, sleeping for its injected latency and failing if told to."""
+
+        start = time.perf_counter()
+        time.sleep(self._match(self.latency, command) or 0)
+        error = self._match(self.failures, command)
+        output = self._match(self.outputs, command) or ""
+        returncode = 1 if error is not None else 0
+
+        with self._lock:
+            self.calls.append({"command": command, "input": input, "returncode": returncode,
+                               "duration": time.perf_counter() - start})
+
+        if error is FileNotFoundError:
+            raise FileNotFoundError(2, "No such file or directory", command[0])
+        if error is not None and check:
+            raise subprocess.CalledProcessError(returncode, command, output, str(error))
+        if stdout is not None and stdout is not subprocess.PIPE and hasattr(stdout, "write"):
+            stdout.write(output)
+            output = None
+        return subprocess.CompletedProcess(command, returncode, output, str(error or ""))
+
+
+class RecordingRunner(CommandRunner):
+    """Runs commands through another runner and records each call and its duration."""
+
+    def __init__(self, delegate: CommandRunner | None = None):
+        """Initializes the RecordingRunner."""
+
+        self.calls = []
+        self.delegate = delegate or CommandRunner()
+        self._lock = threading.Lock()
+
+    def run(self, command: list, input: str | None = None, stdout=None, check: bool = True) -> subprocess.CompletedProcess:
+        """Delegates the command and records it, including failed runs."""
+
+        start = time.perf_counter()
+        returncode = None
+        try:
+            result = self.delegate.run(command, input=input, stdout=stdout, check=check)
+            returncode = result.returncode
+            return result
+        except subprocess.CalledProcessError as e:
+            returncode = e.returncode
+            raise
+        finally:
+            with self._lock:
+                self.calls.append({"command": command, "input": input, "returncode": returncode,
+                                   "duration": time.perf_counter() - start})
+
+
+_runner = CommandRunner()
+
+
+def get_runner() -> CommandRunner:
+    """Returns the process-wide command runner."""
+
+    return _runner
+
+def set_runner(runner: CommandRunner) -> CommandRunner:
+    """Replaces the process-wide command runner and returns the previous one."""
+
+    global _runner
+    previous, _runner = _runner, runner
+    return previous
+
+def run_command(command: list, input: str | None = None, stdout=None, check: bool = True) -> subprocess.CompletedProcess:
+    """Runs a command through the current process-wide runner."""
+
+    return _runner.run(command, input=input, stdout=stdout, check=check)
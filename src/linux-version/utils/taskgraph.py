@@ -0,0 +1,110 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from utils.logger import RecordLog
+
+
+class Task:
+    """One step of a TaskGraph: an action returning bool, an optional rollback and its dependencies."""
+
+    def __init__(self, name: str, action, rollback=None, depends: tuple = ()):
+        """Initializes the Task."""
+
+        self.name = name
+        self.action = action
+        self.rollback = rollback
+        self.depends = tuple(depends)
+
+
+class TaskGraph:
+    """Runs tasks concurrently as soon as their dependencies succeed, unwinding completed ones on failure."""
+
+    def __init__(self, name: str, max_workers: int = 4, stop_on_failure: bool = True):
+        """Initializes the TaskGraph."""
+
+        self.name = name
+        self.tasks = {}
+        self.durations = {}
+        self.completed = []
+        self.failed = []
+        self.max_workers = max_workers
+        self.stop_on_failure = stop_on_failure
+        self.logger = RecordLog(self.__class__.__name__).get_logger()
+
+    def add(self, name: str, action, rollback=None, depends: tuple = ()) -> "TaskGraph":
+        """Adds a task; dependencies on tasks that are never added are ignored."""
+
+        self.tasks[name] = Task(name, action, rollback, depends)
+        return self
+
+    def _timed(self, task: Task) -> bool:
+        """Runs one task's action, recording its duration and treating exceptions as failure."""
+
+        start = time.perf_counter()
+        try:
+            return bool(task.action())
+        except Exception as e:
+            self.logger.error("[%s] Task '%s' raised: %s", self.name, task.name, e, exc_info=True)
+            return False
+        finally:
+            self.durations[task.name] = time.perf_counter() - start
+            self.logger.debug("[%s] Task '%s' took %.3fs.", self.name, task.name, self.durations[task.name],
+                              extra={"graph": self.name, "step": task.name, "duration_ms": round(self.durations[task.name] * 1000, 2)})
+
+    def run(self) -> bool:
+        """Executes the graph; on failure rolls back completed tasks in reverse completion order."""
+
+        pending = dict(self.tasks)
+        running = {}
+        pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        try:
+            while pending or running:
+                if not (self.failed and self.stop_on_failure):
+                    done_names = set(self.completed) | set(self.failed)
+                    for name, task in list(pending.items()):
+                        deps = [dep for dep in task.depends if dep in self.tasks]
+                        if any(dep in self.failed for dep in deps):
+                            del pending[name]
+                            self.logger.warning("[%s] Skipping '%s': a dependency failed.", self.name, name)
+                        elif all(dep in done_names for dep in deps):
+                            del pending[name]
+                            running[pool.submit(self._timed, task)] = name
+                elif pending:
+                    pending.clear()
+
+                if not running:
+                    for name in pending:
+                        self.failed.append(name)
+                        self.logger.error("[%s] Task '%s' has unresolvable dependencies.", self.name, name)
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.result():
+                        self.completed.append(name)
+                    else:
+                        self.failed.append(name)
+                        self.logger.error("[%s] Task '%s' failed.", self.name, name)
+        except BaseException:
+            # Interrupted (Ctrl+C, or a signal handler exiting): leave running steps behind instead of waiting them out.
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+
+        if self.failed and self.stop_on_failure:
+            self.unwind()
+            return False
+        return not self.failed
+
+    def unwind(self):
+        """Rolls back completed tasks, newest first, so dependents are undone before their dependencies."""
+
+        for name in reversed(self.completed):
+            rollback = self.tasks[name].rollback
+            if rollback is None:
+                continue
+            self.logger.warning("[%s] Rolling back '%s'...", self.name, name)
+            try:
+                rollback()
+            except Exception as e:
+                self.logger.critical("[%s] Rollback of '%s' failed: %s. Manual intervention may be required!", self.name, name, e)
+        self.completed.clear()